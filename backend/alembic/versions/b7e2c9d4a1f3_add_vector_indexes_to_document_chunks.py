@@ -0,0 +1,47 @@
+"""add_vector_indexes_to_document_chunks
+
+Revision ID: b7e2c9d4a1f3
+Revises: f3d386bd801a
+Create Date: 2026-10-17 10:12:05.481127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c9d4a1f3'
+down_revision: Union[str, None] = 'f3d386bd801a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Un índice HNSW por operador de distancia de pgvector:
+# <=> (coseno), <-> (L2) y <#> (producto interno negativo)
+VECTOR_INDEXES = {
+    'ix_document_chunks_embedding_cosine': 'vector_cosine_ops',
+    'ix_document_chunks_embedding_l2': 'vector_l2_ops',
+    'ix_document_chunks_embedding_ip': 'vector_ip_ops',
+}
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+    for index_name, opclass in VECTOR_INDEXES.items():
+        op.create_index(
+            index_name,
+            'document_chunks',
+            ['embedding'],
+            unique=False,
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'embedding': opclass},
+        )
+
+
+def downgrade() -> None:
+    for index_name in VECTOR_INDEXES:
+        op.drop_index(index_name, table_name='document_chunks')
@@ -7,6 +7,9 @@ from .subjects_routes import subjects_routes
 from .topics_routes import topics_routes
 from .auth_routes import auth_router
 from .images_routes import images_routes
+from .retrieval_routes import retrieval_routes
+from .monitoring_routes import monitoring_routes
+from .embeddings_routes import embeddings_routes
 
 api_router = APIRouter()
 
@@ -16,4 +19,7 @@ api_router.include_router(documents_routes, prefix="/documents", tags=["Document
 api_router.include_router(users_routes, prefix="/users", tags=["Users"])
 api_router.include_router(subjects_routes, prefix="/subjects", tags=["Subjects"])
 api_router.include_router(topics_routes, prefix="/topics", tags=["Topics"])
-api_router.include_router(images_routes, prefix="/images", tags=["Images"])
\ No newline at end of file
+api_router.include_router(images_routes, prefix="/images", tags=["Images"])
+api_router.include_router(retrieval_routes, prefix="/retrieval", tags=["Retrieval"])
+api_router.include_router(monitoring_routes, prefix="/monitoring", tags=["Monitoring"])
+api_router.include_router(embeddings_routes, prefix="/embeddings", tags=["Embeddings"])
\ No newline at end of file
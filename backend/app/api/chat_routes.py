@@ -1,7 +1,8 @@
-from typing import Dict, List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, logger, status, UploadFile, File, Form
-from fastapi.responses import FileResponse
-from sqlalchemy import Tuple
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, status, UploadFile, File, Form
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
 from ..models.models import  User, Document, Message
@@ -11,8 +12,9 @@ from ..services.chat_service import (
     get_conversation_messages, 
     get_conversations_by_user_role, 
     get_current_user_conversations,
-    add_message_and_generate_response,
+    add_message_and_generate_response_async,
     create_conversation,
+    stream_message_and_generate_response,
 )
 from ..services.image_service import get_image_by_message
 
@@ -33,6 +35,9 @@ from ..models.schemas import (
     MessagePairOut
 )
 
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
 chat_routes = APIRouter()
 
 @chat_routes.post("/conversation", response_model=APIResponse)
@@ -168,6 +173,52 @@ async def delete_conv(
         "status": 200
     }
 
+async def _read_message_input(
+    message_data: Optional[str],
+    file: Optional[UploadFile],
+    db: Session,
+    current_user: User
+) -> Tuple[Optional[str], Optional[int]]:
+    """Sube la imagen adjunta (si la hay) y extrae el texto del mensaje del formulario"""
+    # Procesar la imagen si se proporcionó
+    image_id = None
+    if file:
+        # Usar las funciones del image_service
+        from app.services.image_service import upload_image
+        image = await upload_image(
+            file=file,
+            user_id=current_user.id,
+            subject_id=None,  
+            db=db
+        )
+        image_id = image.id
+    
+    # Parsear el mensaje si fue enviado como string JSON
+    message_text = None
+    if message_data:
+        try:
+            message_obj = json.loads(message_data)
+            message_text = message_obj.get("text")
+            logger.debug(f"message_text después de json.loads: '{message_text}'")
+        except json.JSONDecodeError:
+            message_text = message_data
+            logger.debug(f"message_data no es JSON, se usa como texto: '{message_text}'")
+    else:
+        logger.debug("No se recibió message_data")
+    
+    # Validar que se proporcionó texto o archivo
+    if not message_text and not image_id:
+        raise HTTPException(
+            status_code=400,
+            detail="Se requiere proporcionar texto del mensaje o un archivo"
+        )
+    
+    return message_text, image_id
+
+def _sse_event(event: str, data: Any) -> str:
+    """Formatea un evento Server-Sent Events con datos JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @chat_routes.post("/c/{conversation_id}", response_model=APIResponse)
 async def add_message_to_conversation(
     conversation_id: int,
@@ -178,42 +229,9 @@ async def add_message_to_conversation(
 ):
     """Añadir mensaje a una conversación, opcionalmente con una imagen"""
     try:
-    
-        # Procesar la imagen si se proporcionó
-        image_id = None
-        if file:
-            # Usar las funciones del image_service
-            from app.services.image_service import upload_image
-            image = await upload_image(
-                file=file,
-                user_id=current_user.id,
-                subject_id=None,  
-                db=db
-            )
-            image_id = image.id
-        
-        # Parsear el mensaje si fue enviado como string JSON
-        message_text = None
-        if message_data:
-            try:
-                import json
-                message_obj = json.loads(message_data)
-                message_text = message_obj.get("text")
-                print(f"DEBUG - message_text después de json.loads: '{message_text}'")
-            except json.JSONDecodeError:
-                message_text = message_data
-                print(f"DEBUG - Error JSON, usando message_data como texto: '{message_text}'")
-        else:
-            print("DEBUG - No se recibió message_data")
+        message_text, image_id = await _read_message_input(message_data, file, db, current_user)
         
-        # Validar que se proporcionó texto o archivo
-        if not message_text and not image_id:
-            raise HTTPException(
-                status_code=400,
-                detail="Se requiere proporcionar texto del mensaje o un archivo"
-            )
-        
-        user_msg_obj, bot_msg_obj = add_message_and_generate_response(
+        user_msg_obj, bot_msg_obj = await add_message_and_generate_response_async(
             db=db,
             conversation_id=conversation_id,
             user_id=current_user.id,
@@ -235,9 +253,55 @@ async def add_message_to_conversation(
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Error processing message: {e}")
+        logger.exception(f"Error procesando el mensaje: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error procesando el mensaje")
 
+@chat_routes.post("/c/{conversation_id}/stream")
+async def stream_message_to_conversation(
+    conversation_id: int,
+    message_data: str = Form(None),
+    file: UploadFile = File(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Añadir mensaje a una conversación y recibir la respuesta en streaming (Server-Sent Events).
+
+    Eventos: "user_message" (mensaje guardado), "token" (fragmento de texto, repetido),
+    "bot_message" (respuesta completa guardada) y "error" si el turno no puede completarse.
+    """
+    conversation = get_conversation_by_id(db, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    if conversation.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="No tienes permiso para esta conversación")
+
+    message_text, image_id = await _read_message_input(message_data, file, db, current_user)
+
+    async def event_stream():
+        try:
+            async for event, value in stream_message_and_generate_response(
+                conversation_id=conversation_id,
+                user_id=current_user.id,
+                message_text=message_text,
+                image_id=image_id
+            ):
+                if event == "token":
+                    yield _sse_event("token", {"text": value})
+                else:
+                    yield _sse_event(event, MessageOut.model_validate(value).model_dump(mode="json"))
+        except HTTPException as e:
+            yield _sse_event("error", {"detail": e.detail, "status": e.status_code})
+        except Exception as e:
+            logger.exception(f"Error procesando el mensaje en streaming: {e}")
+            yield _sse_event("error", {"detail": "Error procesando el mensaje", "status": 500})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @chat_routes.post("/context/{document_id}", response_model=APIResponse)
 async def get_context_for_question(
     document_id: int, 
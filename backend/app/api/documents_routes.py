@@ -9,7 +9,8 @@ from ..core.database import get_db
 from ..core.auth import get_current_user, require_role
 from ..services.document_service import save_document, list_documents, list_all_documents, delete_document, get_documents_by_topic_id, get_document_by_id
 from ..services.summary_service import generate_document_summary_by_id, generate_subject_summary, update_subject_summary
-from ..models.schemas import APIResponse, DocumentOut, DocumentCreate
+from ..services.ingestion_service import get_latest_ingestion_job, retry_ingestion_job
+from ..models.schemas import APIResponse, DocumentOut, DocumentCreate, IngestionJobOut
 
 documents_routes = APIRouter()
 
@@ -54,10 +55,60 @@ async def upload_document(
         subject_id=subject_id,  
         topic_id=topic_id  
     )
-    document = save_document(db, pdf_file, document_data)
+    document, job = save_document(db, pdf_file, document_data)
     return {
-        "data": {"document_id": document.id},
-        "message": "Documento subido exitosamente",
+        "data": {
+            "document_id": document.id,
+            "ingestion_job": IngestionJobOut.model_validate(job)
+        },
+        "message": "Documento subido exitosamente; el procesamiento continúa en segundo plano",
+        "status": 200
+    }
+
+@documents_routes.get("/{document_id}/ingestion", response_model=APIResponse)
+def get_document_ingestion_status(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    _: dict = Depends(require_role(["teacher", "admin"]))
+):
+    """
+    Consulta el estado de la ingesta de un documento
+    (queued, extracting, chunking, embedding, indexed o failed).
+    """
+    document = get_document_by_id(db, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    validate_subject_access(current_user, document.subject_id, db)
+
+    job = get_latest_ingestion_job(db, document_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="El documento no tiene trabajos de ingesta")
+    return {
+        "data": IngestionJobOut.model_validate(job),
+        "message": "Estado de la ingesta obtenido correctamente",
+        "status": 200
+    }
+
+@documents_routes.post("/{document_id}/ingestion/retry", response_model=APIResponse)
+def retry_document_ingestion(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    _: dict = Depends(require_role(["teacher", "admin"]))
+):
+    """
+    Vuelve a encolar la ingesta fallida de un documento.
+    """
+    document = get_document_by_id(db, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    validate_subject_access(current_user, document.subject_id, db)
+
+    job = retry_ingestion_job(db, document_id)
+    return {
+        "data": IngestionJobOut.model_validate(job),
+        "message": "Ingesta del documento encolada de nuevo",
         "status": 200
     }
 
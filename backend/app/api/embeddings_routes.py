@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from ..core.auth import require_role
+from ..core.database import get_db
+from ..models.schemas import APIResponse, ReembeddingJobCreate, ReembeddingJobOut
+from ..services.reembedding_service import (
+    cancel_reembedding_job,
+    get_embedding_model_status,
+    get_reembedding_job,
+    start_reembedding
+)
+
+embeddings_routes = APIRouter()
+
+@embeddings_routes.get("/model", response_model=APIResponse)
+def get_embedding_model(
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Modelo de embeddings activo y número de chunks codificados con cada modelo.
+    """
+    return {
+        "data": get_embedding_model_status(db),
+        "message": "Estado del modelo de embeddings obtenido correctamente",
+        "status": 200
+    }
+
+@embeddings_routes.post("/reembedding", response_model=APIResponse)
+def create_reembedding_job(
+    job_data: ReembeddingJobCreate,
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Lanza en segundo plano la recodificación de todos los chunks con otro modelo. La
+    búsqueda sigue usando el modelo actual hasta que el trabajo termina.
+    """
+    job = start_reembedding(db, job_data.target_model)
+    return {
+        "data": ReembeddingJobOut.model_validate(job),
+        "message": "Trabajo de re-embedding encolado",
+        "status": 200
+    }
+
+@embeddings_routes.get("/reembedding/{job_id}", response_model=APIResponse)
+def get_reembedding_job_status(
+    job_id: int,
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Consulta el progreso de un trabajo de re-embedding.
+    """
+    return {
+        "data": ReembeddingJobOut.model_validate(get_reembedding_job(db, job_id)),
+        "message": "Estado del trabajo de re-embedding obtenido correctamente",
+        "status": 200
+    }
+
+@embeddings_routes.post("/reembedding/{job_id}/cancel", response_model=APIResponse)
+def cancel_reembedding(
+    job_id: int,
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Cancela un trabajo de re-embedding; el modelo activo no cambia.
+    """
+    return {
+        "data": ReembeddingJobOut.model_validate(cancel_reembedding_job(db, job_id)),
+        "message": "Trabajo de re-embedding cancelado",
+        "status": 200
+    }
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends
+
+from ..core.auth import require_role
+from ..core.database import get_pool_status
+from ..models.schemas import APIResponse
+from ..services.api_service import llm_gateway
+from ..utils.prompt_budget import get_prompt_token_stats
+
+monitoring_routes = APIRouter()
+
+@monitoring_routes.get("/db-pool", response_model=APIResponse)
+def get_db_pool_metrics(
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Estado y métricas del pool de conexiones a la BD: conexiones en uso y de
+    desbordamiento, obtenciones, tiempos de espera y timeouts (solo administradores).
+    """
+    return {
+        "data": get_pool_status(),
+        "message": "Métricas del pool de conexiones obtenidas correctamente",
+        "status": 200
+    }
+
+@monitoring_routes.get("/prompt-tokens", response_model=APIResponse)
+def get_prompt_token_metrics(
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Tokens medios por sección de los prompts enviados al modelo y recortes aplicados
+    para ajustarlos al presupuesto (solo administradores).
+    """
+    return {
+        "data": get_prompt_token_stats(),
+        "message": "Métricas de tokens del prompt obtenidas correctamente",
+        "status": 200
+    }
+
+@monitoring_routes.get("/llm", response_model=APIResponse)
+def get_llm_gateway_metrics(
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Métricas de la pasarela del LLM: llamadas en curso y en espera, reintentos, timeouts,
+    rechazos y estado del circuit breaker, y latencias medias (solo administradores).
+    """
+    return {
+        "data": llm_gateway.stats(),
+        "message": "Métricas de la pasarela del LLM obtenidas correctamente",
+        "status": 200
+    }
@@ -0,0 +1,102 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from ..core.database import get_db
+from ..core.auth import require_role
+from ..models.schemas import APIResponse, VectorIndexRebuildRequest
+from ..services.vector_index_service import (
+    list_vector_indexes,
+    rebuild_vector_indexes,
+    reindex_vector_indexes
+)
+from ..services.vector_service import get_retrieval_diagnostics
+from ..services.answer_cache_service import get_answer_cache_stats
+from ..services.embedding_service import get_query_embedding_cache_stats
+
+retrieval_routes = APIRouter()
+
+@retrieval_routes.get("/indexes", response_model=APIResponse)
+def get_vector_indexes(
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin"]))
+):
+    """Lista los índices vectoriales de los chunks (solo administradores)"""
+    indexes = list_vector_indexes(db)
+    return {
+        "data": indexes,
+        "message": "Índices vectoriales obtenidos correctamente",
+        "status": 200
+    }
+
+@retrieval_routes.post("/indexes/rebuild", response_model=APIResponse)
+def rebuild_indexes(
+    request: Optional[VectorIndexRebuildRequest] = None,
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin"]))
+):
+    """
+    Reconstruye los índices vectoriales, opcionalmente cambiando el tipo de índice.
+    Pensado para ejecutarse tras cargas masivas de documentos (solo administradores).
+    """
+    request = request or VectorIndexRebuildRequest()
+    indexes = rebuild_vector_indexes(db, index_type=request.index_type, metrics=request.metrics)
+    return {
+        "data": indexes,
+        "message": "Índices vectoriales reconstruidos correctamente",
+        "status": 200
+    }
+
+@retrieval_routes.post("/indexes/reindex", response_model=APIResponse)
+def reindex_indexes(
+    request: Optional[VectorIndexRebuildRequest] = None,
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin"]))
+):
+    """Reindexa los índices vectoriales existentes (solo administradores)"""
+    request = request or VectorIndexRebuildRequest()
+    indexes = reindex_vector_indexes(db, metrics=request.metrics)
+    return {
+        "data": indexes,
+        "message": "Índices vectoriales reindexados correctamente",
+        "status": 200
+    }
+
+@retrieval_routes.get("/diagnostics", response_model=APIResponse)
+def get_diagnostics(
+    subject_id: Optional[int] = Query(None, description="ID de la asignatura a diagnosticar"),
+    db: Session = Depends(get_db),
+    _: dict = Depends(require_role(["admin", "teacher"]))
+):
+    """
+    Diagnóstico de la recuperación: chunks totales, chunks por documento de la asignatura
+    y dimensión de sus embeddings (profesores y administradores).
+    """
+    diagnostics = get_retrieval_diagnostics(db, subject_id)
+    return {
+        "data": diagnostics,
+        "message": "Diagnóstico de recuperación obtenido correctamente",
+        "status": 200
+    }
+
+@retrieval_routes.get("/embedding-cache", response_model=APIResponse)
+def get_embedding_cache_stats(
+    _: dict = Depends(require_role(["admin"]))
+):
+    """Estadísticas de la caché de embeddings de consultas (solo administradores)"""
+    return {
+        "data": get_query_embedding_cache_stats(),
+        "message": "Estadísticas de la caché de embeddings obtenidas correctamente",
+        "status": 200
+    }
+
+@retrieval_routes.get("/answer-cache", response_model=APIResponse)
+def get_answer_cache_statistics(
+    _: dict = Depends(require_role(["admin"]))
+):
+    """Aciertos y tasa de acierto de la caché semántica de respuestas (solo administradores)"""
+    return {
+        "data": get_answer_cache_stats(),
+        "message": "Estadísticas de la caché de respuestas obtenidas correctamente",
+        "status": 200
+    }
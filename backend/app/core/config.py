@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,10 +22,161 @@ class Settings:
     DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
    
     
+    # Proveedor del LLM: "gemini" (Google AI Studio) o "fake" (local y determinista, para
+    # pruebas de carga sin clave de API). El proveedor simulado usa el perfil de latencia
+    # LLM_FAKE_PROFILE ("instant", "flash", "gemma" o "slow") y responde con
+    # LLM_FAKE_OUTPUT_TOKENS tokens
+    LLM_PROVIDER: str = os.getenv("LLM_PROVIDER", "gemini")
+    LLM_FAKE_PROFILE: str = os.getenv("LLM_FAKE_PROFILE", "flash")
+    LLM_FAKE_OUTPUT_TOKENS: int = int(os.getenv("LLM_FAKE_OUTPUT_TOKENS", "200"))
+
     # Configuración de Google AI Studio
     GOOGLE_AI_API_KEY: str = os.getenv("GOOGLE_AI_API_KEY")
     GOOGLE_AI_MODEL_NAME: str = os.getenv("GOOGLE_AI_MODEL_NAME", "gemma-2-9b-it")
-    
+
+    # Presupuesto de tokens del prompt de texto. El historial se limita a
+    # PROMPT_HISTORY_TOKEN_BUDGET (los turnos antiguos se resumen antes de descartarse) y
+    # el material de la asignatura ocupa el resto, descartando primero los chunks con menor
+    # similitud. Los tokens se cuentan con el tokenizador de Hugging Face PROMPT_TOKENIZER_NAME,
+    # que se carga al arrancar (por defecto una copia pública del de Gemma 2: el repositorio
+    # de Google requiere aceptar la licencia y HF_TOKEN); si no se puede cargar se registra
+    # un error y se estima a razón de PROMPT_CHARS_PER_TOKEN caracteres por token
+    PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+    PROMPT_HISTORY_TOKEN_BUDGET: int = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", "1500"))
+    # Turnos recientes que se conservan literales; los anteriores se resumen
+    PROMPT_HISTORY_RECENT_TURNS: int = int(os.getenv("PROMPT_HISTORY_RECENT_TURNS", "4"))
+    PROMPT_TOKENIZER_NAME: str = os.getenv("PROMPT_TOKENIZER_NAME", "unsloth/gemma-2-9b-it")
+    PROMPT_CHARS_PER_TOKEN: float = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))
+    # Instrucciones fijas de las plantillas de prompt como system_instruction (no lo admiten
+    # los modelos Gemma). Con GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS > 0 se guardan además en la
+    # caché de contexto de Gemini, que exige un mínimo de tokens según el modelo
+    GOOGLE_AI_SYSTEM_INSTRUCTION: bool = os.getenv("GOOGLE_AI_SYSTEM_INSTRUCTION", "false").lower() == "true"
+    GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS: int = int(os.getenv("GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS", "0"))
+    # Pasarela de llamadas al LLM: llamadas simultáneas como máximo (las demás esperan turno),
+    # tiempo máximo por intento y plazo total por llamada (incluida la espera de turno y los
+    # reintentos), reintentos con espera exponencial y jitter ante errores 429/5xx/timeouts y
+    # circuit breaker que rechaza las llamadas durante LLM_CIRCUIT_RECOVERY_SECONDS tras
+    # LLM_CIRCUIT_FAILURE_THRESHOLD fallos transitorios seguidos
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_ATTEMPT_TIMEOUT_SECONDS: float = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "30"))
+    LLM_DEADLINE_SECONDS: float = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+    LLM_MAX_ATTEMPTS: int = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+    LLM_RETRY_BACKOFF_SECONDS: float = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "0.5"))
+    LLM_RETRY_BACKOFF_MAX_SECONDS: float = float(os.getenv("LLM_RETRY_BACKOFF_MAX_SECONDS", "8"))
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+    LLM_CIRCUIT_RECOVERY_SECONDS: float = float(os.getenv("LLM_CIRCUIT_RECOVERY_SECONDS", "30"))
+
+    # Índices ANN de pgvector sobre document_chunks.embedding
+    # VECTOR_INDEX_TYPE: "hnsw" (recomendado) o "ivfflat"
+    VECTOR_INDEX_TYPE: str = os.getenv("VECTOR_INDEX_TYPE", "hnsw")
+    HNSW_M: int = int(os.getenv("HNSW_M", "16"))
+    HNSW_EF_CONSTRUCTION: int = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+    HNSW_EF_SEARCH: int = int(os.getenv("HNSW_EF_SEARCH", "40"))
+    IVFFLAT_LISTS: int = int(os.getenv("IVFFLAT_LISTS", "100"))
+    IVFFLAT_PROBES: int = int(os.getenv("IVFFLAT_PROBES", "10"))
+    # Consultas de diagnóstico (conteos por documento) en cada búsqueda; solo para depurar
+    RETRIEVAL_DIAGNOSTICS: bool = os.getenv("RETRIEVAL_DIAGNOSTICS", "false").lower() == "true"
+
+    # Modelo de embeddings inicial. Para cambiarlo sin borrar los chunks se lanza un trabajo
+    # de re-embedding; el modelo activo se lee de la BD y se refresca cada
+    # EMBEDDING_MODEL_REFRESH_SECONDS en cada proceso. Tras un cambio de modelo, los
+    # procesos que aún no se han refrescado buscan en los vectores del modelo anterior, que
+    # se conservan REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS (al menos el doble del refresco)
+    EMBEDDING_MODEL_NAME: str = os.getenv("EMBEDDING_MODEL_NAME", "all-mpnet-base-v2")
+    EMBEDDING_MODEL_REFRESH_SECONDS: int = int(os.getenv("EMBEDDING_MODEL_REFRESH_SECONDS", "15"))
+    REEMBEDDING_BATCH_SIZE: int = int(os.getenv("REEMBEDDING_BATCH_SIZE", "256"))
+    REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS: int = max(
+        int(os.getenv("REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS", "120")),
+        2 * EMBEDDING_MODEL_REFRESH_SECONDS
+    )
+    # Volcado final del re-embedding (sin statement_timeout): espera máxima por el bloqueo
+    # de document_chunks, que las ingestas en curso retienen hasta confirmar, y espera antes
+    # de reintentar un volcado que no pudo completarse
+    REEMBEDDING_SWAP_LOCK_TIMEOUT_MS: int = int(os.getenv("REEMBEDDING_SWAP_LOCK_TIMEOUT_MS", "120000"))
+    REEMBEDDING_SWAP_RETRY_SECONDS: int = int(os.getenv("REEMBEDDING_SWAP_RETRY_SECONDS", "300"))
+    # Backend de inferencia del modelo: "torch" (por defecto), "torch-int8" (cuantizado en
+    # CPU), "onnx" u "onnx-int8" (ONNX Runtime; requieren instalar optimum[onnxruntime]).
+    # EMBEDDING_ONNX_FILE elige el fichero .onnx dentro del repositorio del modelo
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_ONNX_FILE: str = os.getenv("EMBEDDING_ONNX_FILE", "")
+
+    # Caché de embeddings de consultas (LRU + TTL, limitada en bytes)
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_MAX_BYTES: int = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    EMBEDDING_CACHE_TTL_SECONDS: int = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+    # Directorio para el nivel en disco de la caché (vacío = solo memoria)
+    EMBEDDING_CACHE_DIR: str = os.getenv("EMBEDDING_CACHE_DIR", "")
+    # Caché de embeddings de oraciones al indexar documentos: al volver a subir un documento
+    # corregido solo se codifican las oraciones nuevas (0 bytes = desactivada). Con un
+    # directorio, el nivel en disco se comparte entre los procesos de ingesta
+    SENTENCE_EMBEDDING_CACHE_MAX_BYTES: int = int(os.getenv("SENTENCE_EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    SENTENCE_EMBEDDING_CACHE_TTL_SECONDS: int = int(os.getenv("SENTENCE_EMBEDDING_CACHE_TTL_SECONDS", str(7 * 86400)))
+    SENTENCE_EMBEDDING_CACHE_DIR: str = os.getenv("SENTENCE_EMBEDDING_CACHE_DIR", "")
+
+    # Micro-lotes de embeddings de consultas: las preguntas que llegan a la vez se codifican
+    # en una sola pasada del modelo, esperando como mucho EMBEDDING_BATCH_MAX_WAIT_MS
+    EMBEDDING_BATCHING_ENABLED: bool = os.getenv("EMBEDDING_BATCHING_ENABLED", "true").lower() == "true"
+    EMBEDDING_BATCH_MAX_SIZE: int = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+
+    # Caché semántica de respuestas: una pregunta de la misma asignatura con similitud
+    # >= SEMANTIC_CACHE_MIN_SIMILARITY a otra ya respondida reutiliza su respuesta sin
+    # recuperar contexto ni llamar al modelo. Se invalida al indexar o borrar documentos de
+    # la asignatura. Las preguntas muy cortas (p. ej. "¿y un ejemplo?") dependen del
+    # historial y no se cachean
+    SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_MIN_SIMILARITY: float = float(os.getenv("SEMANTIC_CACHE_MIN_SIMILARITY", "0.95"))
+    SEMANTIC_CACHE_TTL_SECONDS: int = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 86400)))
+    SEMANTIC_CACHE_MIN_QUESTION_CHARS: int = int(os.getenv("SEMANTIC_CACHE_MIN_QUESTION_CHARS", "15"))
+
+    # Embeddings de las respuestas del bot: se calculan en segundo plano tras responder
+    # (solo se usan para analítica; "false" los desactiva por completo)
+    EMBED_BOT_MESSAGES: bool = os.getenv("EMBED_BOT_MESSAGES", "true").lower() == "true"
+    BACKGROUND_EMBEDDING_WORKERS: int = int(os.getenv("BACKGROUND_EMBEDDING_WORKERS", "1"))
+
+    # Pools acotados para sacar del event loop las etapas bloqueantes del chat:
+    # acceso a BD/ficheros y codificación de embeddings (CPU)
+    CHAT_IO_WORKERS: int = int(os.getenv("CHAT_IO_WORKERS", "10"))
+    CHAT_EMBEDDING_WORKERS: int = int(os.getenv("CHAT_EMBEDDING_WORKERS", "2"))
+
+    # Embeddings de los chunks al indexar documentos: "pooled" (media de los embeddings de
+    # oraciones ya calculados al dividir), "reencode" (volver a codificar cada chunk) o
+    # "auto" (pooled, recodificando solo chunks con coherencia menor que el umbral)
+    CHUNK_EMBEDDING_MODE: str = os.getenv("CHUNK_EMBEDDING_MODE", "auto")
+    CHUNK_REENCODE_MIN_COHERENCE: float = float(os.getenv("CHUNK_REENCODE_MIN_COHERENCE", "0.85"))
+    # Percentil de corte de la división semántica (p. ej. 95, como breakpoint_percentile_threshold
+    # de llama_index). Vacío: se usa el umbral fijo de similitud entre oraciones consecutivas
+    CHUNK_BREAKPOINT_PERCENTILE: Optional[float] = (
+        float(os.getenv("CHUNK_BREAKPOINT_PERCENTILE")) if os.getenv("CHUNK_BREAKPOINT_PERCENTILE") else None
+    )
+
+    # Extracción de PDFs por páginas: a partir de PDF_PARALLEL_MIN_PAGES páginas se reparten
+    # en lotes de PDF_PAGES_PER_TASK entre PDF_EXTRACTION_WORKERS procesos. El chunking
+    # avanza en ventanas de CHUNK_STREAM_SENTENCES oraciones mientras se extrae el resto
+    PDF_EXTRACTION_WORKERS: int = int(os.getenv("PDF_EXTRACTION_WORKERS", "2"))
+    PDF_PARALLEL_MIN_PAGES: int = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "50"))
+    PDF_PAGES_PER_TASK: int = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+    CHUNK_STREAM_SENTENCES: int = int(os.getenv("CHUNK_STREAM_SENTENCES", "256"))
+
+    # Ingesta de documentos en segundo plano: procesos del pool de ingesta (cada uno
+    # carga su propio modelo de embeddings), reintentos y espera base entre reintentos
+    INGESTION_WORKERS: int = int(os.getenv("INGESTION_WORKERS", "2"))
+    INGESTION_MAX_ATTEMPTS: int = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+    INGESTION_RETRY_BACKOFF_SECONDS: int = int(os.getenv("INGESTION_RETRY_BACKOFF_SECONDS", "30"))
+    # Trabajos en curso sin actualizar durante este tiempo se consideran abandonados
+    # (p. ej. por un reinicio) y se vuelven a encolar al arrancar
+    INGESTION_STALE_SECONDS: int = int(os.getenv("INGESTION_STALE_SECONDS", "3600"))
+
+    # Pool de conexiones a la BD (QueuePool): tamaño, desbordamiento, espera máxima,
+    # reciclado de conexiones y comprobación previa (pre-ping)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # statement_timeout de PostgreSQL por conexión en milisegundos (0 = sin límite)
+    DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
     UPLOAD_FOLDER: str = os.getenv("UPLOAD_FOLDER", "uploads")
     
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key")
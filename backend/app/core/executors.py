@@ -0,0 +1,64 @@
+"""
+Ejecutores acotados para las etapas bloqueantes del chat.
+Las rutas asíncronas delegan aquí el acceso a BD/ficheros y la codificación de
+embeddings para no bloquear el event loop. Cada pool tiene un tamaño máximo, de modo
+que una ráfaga de peticiones no agote las conexiones del pool de BD ni los núcleos de CPU.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+import asyncio
+import threading
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+_embedding_executor: Optional[ThreadPoolExecutor] = None
+_executors_lock = threading.Lock()
+
+
+def _get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    with _executors_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(
+                max_workers=settings.CHAT_IO_WORKERS,
+                thread_name_prefix="chat-io"
+            )
+        return _io_executor
+
+
+def _get_embedding_executor() -> ThreadPoolExecutor:
+    global _embedding_executor
+    with _executors_lock:
+        if _embedding_executor is None:
+            _embedding_executor = ThreadPoolExecutor(
+                max_workers=settings.CHAT_EMBEDDING_WORKERS,
+                thread_name_prefix="chat-embedding"
+            )
+        return _embedding_executor
+
+
+async def run_in_io_executor(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Ejecuta una función bloqueante de BD o ficheros en el pool de E/S."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_io_executor(), partial(func, *args, **kwargs))
+
+
+async def run_in_embedding_executor(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Ejecuta una función intensiva en CPU (codificación de embeddings) en su propio pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_embedding_executor(), partial(func, *args, **kwargs))
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Detiene los pools del chat, esperando a las tareas pendientes si wait=True."""
+    global _io_executor, _embedding_executor
+    with _executors_lock:
+        for executor in (_io_executor, _embedding_executor):
+            if executor is not None:
+                executor.shutdown(wait=wait)
+        _io_executor = None
+        _embedding_executor = None
@@ -1,49 +1,389 @@
-from typing import Optional, List, Tuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, NamedTuple, Optional, List, Sequence, Tuple
+import io
+import struct
+import time
+import numpy as np
 from sqlalchemy.orm import Session
-from sqlalchemy import select, literal_column
-from app.models.models import Document, DocumentChunk, Conversation, Message
+from sqlalchemy import bindparam, cast, func, insert, select, text
+from app.core.config import settings
+from app.utils.content_hash import chunk_content_hash
+from app.models.models import (
+    CachedAnswer,
+    ChunkReembedding,
+    Document,
+    DocumentChunk,
+    Conversation,
+    Message,
+    ReembeddingJob,
+    Subject,
+    CosineDistance,
+    EuclideanDistance,
+    InnerProduct
+)
+
+def set_vector_search_params(
+    db: Session,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None
+) -> None:
+    """
+    Ajusta hnsw.ef_search / ivfflat.probes solo para la transacción actual.
+    Los valores por defecto ya se fijan por conexión en core/database.py, por lo que
+    solo se envía la sentencia cuando se pide un valor distinto al configurado.
+    """
+    clauses = []
+    params = {}
+    if ef_search is not None and ef_search != settings.HNSW_EF_SEARCH:
+        clauses.append("set_config('hnsw.ef_search', :ef_search, true)")
+        params["ef_search"] = str(int(ef_search))
+    if probes is not None and probes != settings.IVFFLAT_PROBES:
+        clauses.append("set_config('ivfflat.probes', :probes, true)")
+        params["probes"] = str(int(probes))
+
+    if clauses:
+        db.execute(text(f"SELECT {', '.join(clauses)}"), params)
+
+class RetrievedChunk(NamedTuple):
+    """
+    Fila ligera devuelta por la búsqueda de similitud: el contenido del chunk y el
+    título de su documento, sin el embedding ni el objeto ORM completo.
+    """
+    id: int
+    document_id: int
+    document_title: Optional[str]
+    content: str
+    chunk_number: int
+    page_number: Optional[int] = None
+
+# Métrica de similitud -> operador de pgvector y conversión de distancia a score
+SIMILARITY_DISTANCES = {
+    "cosine": CosineDistance,
+    "l2": EuclideanDistance,
+    "inner_product": InnerProduct,
+}
+
+SIMILARITY_SCORES = {
+    "cosine": lambda x: 1.0 - x,
+    "l2": lambda x: 1.0 / (1.0 + x),
+    "inner_product": lambda x: -x,
+}
+
+@lru_cache(maxsize=None)
+def build_similarity_query(
+    similarity_metric: str = "cosine",
+    filter_by_subject: bool = False,
+    filter_by_model: bool = False,
+    previous_vectors: bool = False
+):
+    """
+    Construye una sola vez por (métrica, filtros) la consulta de similitud.
+    El embedding, la asignatura, el modelo y el límite se envían como parámetros enlazados
+    (:query_embedding, :subject_id, :embedding_model, :limit), así el SQL es siempre el
+    mismo y SQLAlchemy reutiliza la sentencia compilada de su caché.
+
+    Con previous_vectors se compara con los vectores que un re-embedding ya volcado
+    conserva en chunk_reembeddings durante el periodo de gracia, cuyo modelo anterior es
+    :embedding_model (búsqueda exacta, sin índice ANN).
+    """
+    # Cualquier métrica desconocida se trata como producto interno, igual que antes
+    distance_function = SIMILARITY_DISTANCES.get(similarity_metric, InnerProduct)
+    embedding_type = DocumentChunk.embedding.type
+    embedding_column = ChunkReembedding.embedding if previous_vectors else DocumentChunk.embedding
+
+    query_embedding = cast(bindparam("query_embedding", type_=embedding_type), embedding_type)
+    distance = distance_function(embedding_column, query_embedding).label("distance")
+
+    # Proyección con el título del documento en la misma consulta (sin el embedding)
+    query = select(
+        DocumentChunk.id,
+        DocumentChunk.document_id,
+        Document.title.label("document_title"),
+        DocumentChunk.content,
+        DocumentChunk.chunk_number,
+        DocumentChunk.page_number,
+        distance
+    ).join(Document, DocumentChunk.document_id == Document.id)
+
+    if filter_by_subject:
+        query = query.where(Document.subject_id == bindparam("subject_id"))
+    if previous_vectors:
+        query = query.join(ChunkReembedding, ChunkReembedding.chunk_id == DocumentChunk.id).join(
+            ReembeddingJob, ReembeddingJob.id == ChunkReembedding.job_id
+        ).where(
+            ReembeddingJob.status == "swapped",
+            ReembeddingJob.previous_model == bindparam("embedding_model")
+        )
+    elif filter_by_model:
+        # Nunca se comparan vectores de modelos distintos (p. ej. justo tras un cambio de modelo)
+        query = query.where(DocumentChunk.embedding_model == bindparam("embedding_model"))
+
+    return query.order_by(distance).limit(bindparam("limit"))
 
 def search_similar_chunks_db(
     db: Session,
     query_embedding: List[float],
     subject_id: Optional[int] = None,
     limit: int = 10,
-    similarity_metric: str = "cosine"
-) -> List[Tuple[DocumentChunk, float]]:
+    similarity_metric: str = "cosine",
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    embedding_model: Optional[str] = None,
+    previous_vectors: bool = False
+) -> List[Tuple[RetrievedChunk, float]]:
     """
     Busca chunks similares a un embedding de consulta usando pgvector desde la BD.
+    Devuelve tuplas (RetrievedChunk, score) con el título del documento ya incluido.
+    ef_search / probes permiten ajustar el índice ANN para esta consulta; con
+    embedding_model solo se buscan chunks codificados con ese modelo. Con previous_vectors
+    se busca en los vectores de embedding_model conservados tras un cambio de modelo.
     """
     if not query_embedding or len(query_embedding) == 0:
         return []
-        
-    embedding_str = f"CAST(ARRAY[{', '.join(map(str, query_embedding))}] AS vector)"
-
-    if similarity_metric == "cosine":
-        distance_expression = literal_column(f"({DocumentChunk.embedding.key} <=> {embedding_str})")
-        convert_score = lambda x: 1.0 - x
-    elif similarity_metric == "l2":
-        distance_expression = literal_column(f"({DocumentChunk.embedding.key} <-> {embedding_str})")
-        convert_score = lambda x: 1.0 / (1.0 + x)
+    if previous_vectors and not embedding_model:
+        return []
+
+    if ef_search is None and limit > settings.HNSW_EF_SEARCH:
+        ef_search = limit
+    set_vector_search_params(db, ef_search=ef_search, probes=probes)
+
+    query = build_similarity_query(similarity_metric, bool(subject_id), bool(embedding_model), previous_vectors)
+    params = {"query_embedding": query_embedding, "limit": limit}
+    if subject_id:
+        params["subject_id"] = subject_id
+    if embedding_model:
+        params["embedding_model"] = embedding_model
+
+    results = db.execute(query, params).all()
+
+    convert_score = SIMILARITY_SCORES.get(similarity_metric, SIMILARITY_SCORES["inner_product"])
+    return [
+        (
+            RetrievedChunk(
+                id=row.id,
+                document_id=row.document_id,
+                document_title=row.document_title,
+                content=row.content,
+                chunk_number=row.chunk_number,
+                page_number=row.page_number
+            ),
+            convert_score(row.distance)
+        )
+        for row in results
+    ]
+
+# Cabecera y terminador del formato binario de COPY de PostgreSQL
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_BINARY_TRAILER = struct.pack(">h", -1)
+
+def encode_chunks_copy_binary(
+    document_id: int,
+    chunks: Sequence[str],
+    embeddings: np.ndarray,
+    page_numbers: Optional[Sequence[Optional[int]]] = None,
+    start_number: int = 0,
+    content_hashes: Optional[Sequence[str]] = None,
+    embedding_model: Optional[str] = None
+) -> bytes:
+    """
+    Codifica los chunks en el formato binario de COPY para las columnas
+    (document_id, content, embedding, chunk_number, page_number, content_hash,
+    embedding_model). Los vectores usan el formato binario de pgvector: dimensión (int16),
+    reservado (int16) y floats de 4 bytes big-endian. Los chunks se numeran desde
+    start_number; una página o un modelo None se envían como NULL y los hashes que no se
+    indiquen se calculan a partir del texto.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=">f4")
+    dimension = embeddings.shape[1]
+    document_id_field = struct.pack(">ii", 4, document_id)
+    if embedding_model is None:
+        model_field = struct.pack(">i", -1)
     else:
-        distance_expression = literal_column(f"({DocumentChunk.embedding.key} <#> {embedding_str})")
-        convert_score = lambda x: -x
+        model_bytes = embedding_model.encode("utf-8")
+        model_field = struct.pack(">i", len(model_bytes)) + model_bytes
+    vector_header = struct.pack(">ihh", 4 + 4 * dimension, dimension, 0)
 
-    # Construir la consulta base
-    query = select(
-        DocumentChunk,
-        distance_expression.label("distance")
+    buffer = io.BytesIO()
+    buffer.write(COPY_BINARY_HEADER)
+    for i, content in enumerate(chunks):
+        content_bytes = content.encode("utf-8")
+        page_number = page_numbers[i] if page_numbers is not None else None
+        content_hash = (content_hashes[i] if content_hashes is not None else chunk_content_hash(content)).encode("ascii")
+        buffer.write(struct.pack(">h", 7))
+        buffer.write(document_id_field)
+        buffer.write(struct.pack(">i", len(content_bytes)))
+        buffer.write(content_bytes)
+        buffer.write(vector_header)
+        buffer.write(embeddings[i].tobytes())
+        buffer.write(struct.pack(">ii", 4, start_number + i))
+        buffer.write(struct.pack(">i", -1) if page_number is None else struct.pack(">ii", 4, page_number))
+        buffer.write(struct.pack(">i", len(content_hash)))
+        buffer.write(content_hash)
+        buffer.write(model_field)
+    buffer.write(COPY_BINARY_TRAILER)
+    return buffer.getvalue()
+
+def bulk_insert_document_chunks(
+    db: Session,
+    document_id: int,
+    chunks: Sequence[str],
+    embeddings: np.ndarray,
+    page_numbers: Optional[Sequence[Optional[int]]] = None,
+    start_number: int = 0,
+    content_hashes: Optional[Sequence[str]] = None,
+    embedding_model: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Inserta todos los chunks de un documento en una sola operación dentro de la
+    transacción de la sesión (el llamante hace commit). Con start_number se puede cargar
+    un documento en varios lotes manteniendo la numeración de los chunks.
+
+    Con psycopg2 se usa COPY ... FROM STDIN en formato binario; con otros drivers se
+    recurre a un INSERT executemany. Devuelve las métricas de rendimiento de la carga.
+    """
+    start = time.perf_counter()
+    dbapi_connection = db.connection().connection
+    cursor = dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):
+            method = "copy"
+            payload = encode_chunks_copy_binary(
+                document_id, chunks, embeddings, page_numbers, start_number, content_hashes, embedding_model
+            )
+            cursor.copy_expert(
+                "COPY document_chunks "
+                "(document_id, content, embedding, chunk_number, page_number, content_hash, embedding_model) "
+                "FROM STDIN WITH (FORMAT binary)",
+                io.BytesIO(payload)
+            )
+            payload_bytes = len(payload)
+        else:
+            method = "executemany"
+            rows = [
+                {
+                    "document_id": document_id,
+                    "content": content,
+                    "embedding": embeddings[i],
+                    "chunk_number": start_number + i,
+                    "page_number": page_numbers[i] if page_numbers is not None else None,
+                    "content_hash": content_hashes[i] if content_hashes is not None else chunk_content_hash(content),
+                    "embedding_model": embedding_model
+                }
+                for i, content in enumerate(chunks)
+            ]
+            db.execute(insert(DocumentChunk.__table__), rows)
+            payload_bytes = sum(len(content.encode("utf-8")) for content in chunks) + int(np.asarray(embeddings).nbytes)
+    finally:
+        cursor.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "document_id": document_id,
+        "method": method,
+        "chunks": len(chunks),
+        "bytes": payload_bytes,
+        "seconds": round(seconds, 4),
+        "chunks_per_second": round(len(chunks) / seconds, 1) if seconds else None,
+        "mb_per_second": round(payload_bytes / seconds / (1024 * 1024), 2) if seconds else None
+    }
+
+def get_chunk_embeddings_by_hash(
+    db: Session,
+    content_hashes: Sequence[str],
+    embedding_model: Optional[str] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Busca embeddings ya calculados para chunks con el mismo contenido (en cualquier
+    documento), solo del modelo indicado si se pasa embedding_model.
+
+    Returns:
+        {hash: embedding} con los hashes encontrados
+    """
+    if not content_hashes:
+        return {}
+    query = select(DocumentChunk.content_hash, DocumentChunk.embedding).where(
+        DocumentChunk.content_hash.in_(set(content_hashes))
     )
-    
-    # Si se proporciona subject_id, filtrar por los documentos de esa asignatura
-    if subject_id:
-        query = query.join(Document, DocumentChunk.document_id == Document.id)
-        query = query.filter(Document.subject_id == subject_id)
-    
-    # Ordenar por distancia y limitar resultados
-    query = query.order_by("distance").limit(limit)
-    results = db.execute(query).all()
+    if embedding_model:
+        query = query.where(DocumentChunk.embedding_model == embedding_model)
+    rows = db.execute(query.distinct(DocumentChunk.content_hash)).all()
+    return {
+        row.content_hash: np.asarray(row.embedding, dtype=np.float32)
+        for row in rows
+        if row.embedding is not None
+    }
 
-    return [(row.DocumentChunk, convert_score(row.distance)) for row in results]
+def find_indexed_duplicate(db: Session, document_id: int, content_hash: str) -> Optional[int]:
+    """
+    Devuelve el ID de otro documento con el mismo PDF que ya tenga chunks, o None.
+    """
+    if not content_hash:
+        return None
+    has_chunks = select(DocumentChunk.id).where(DocumentChunk.document_id == Document.id).exists()
+    return db.execute(
+        select(Document.id)
+        .where(Document.content_hash == content_hash, Document.id != document_id, has_chunks)
+        .order_by(Document.id)
+        .limit(1)
+    ).scalar()
+
+def clone_document_chunks(db: Session, source_document_id: int, target_document_id: int) -> int:
+    """
+    Copia en la BD los chunks (texto, embedding, modelo, página y hash) de un documento a otro con un
+    INSERT ... SELECT, sin pasar por la aplicación. El llamante hace commit.
+
+    Returns:
+        Número de chunks copiados
+    """
+    chunks = DocumentChunk.__table__
+    columns = ["content", "embedding", "chunk_number", "page_number", "content_hash", "embedding_model"]
+    source = select(
+        bindparam("target_document_id", target_document_id).label("document_id"),
+        *[chunks.c[column] for column in columns]
+    ).where(chunks.c.document_id == source_document_id)
+    result = db.execute(insert(chunks).from_select(["document_id", *columns], source))
+    return result.rowcount
+
+def lock_document_chunks_for_insert(db: Session) -> None:
+    """
+    Toma en la transacción actual el bloqueo de tabla que usa INSERT en document_chunks
+    (ROW EXCLUSIVE). No bloquea otras ingestas ni las búsquedas, pero espera a que termine
+    el volcado de un re-embedding y no le deja empezar hasta el commit: el modelo activo
+    leído después de tomarlo sigue siendo el activo al confirmar los chunks.
+    """
+    # La espera puede durar todo el volcado: sin statement_timeout solo para esta sentencia
+    db.execute(text("SET LOCAL statement_timeout = 0"))
+    db.execute(text("LOCK TABLE document_chunks IN ROW EXCLUSIVE MODE"))
+    db.execute(text("SET LOCAL statement_timeout TO DEFAULT"))
+
+def get_active_embedding_model_name(db: Session) -> Optional[str]:
+    """
+    Modelo del último trabajo de re-embedding completado, o None si nunca se ha cambiado
+    de modelo (se usa entonces settings.EMBEDDING_MODEL_NAME).
+    """
+    return db.execute(
+        select(ReembeddingJob.target_model)
+        .where(ReembeddingJob.status == "swapped")
+        .order_by(ReembeddingJob.finished_at.desc(), ReembeddingJob.id.desc())
+        .limit(1)
+    ).scalar()
+
+def delete_previous_embeddings(db: Session, job_id: Optional[int] = None, finished_before: Optional[datetime] = None) -> int:
+    """
+    Borra los vectores del modelo anterior que conservan los re-embeddings ya volcados:
+    los del trabajo job_id, o los de todos los terminados antes de finished_before (todos
+    si no se indica ninguno). No hace commit.
+
+    Returns:
+        Número de vectores borrados
+    """
+    jobs = select(ReembeddingJob.id).where(ReembeddingJob.status == "swapped")
+    if job_id is not None:
+        jobs = jobs.where(ReembeddingJob.id == job_id)
+    if finished_before is not None:
+        jobs = jobs.where(ReembeddingJob.finished_at < finished_before)
+    return db.query(ChunkReembedding).filter(ChunkReembedding.job_id.in_(jobs)).delete(synchronize_session=False)
 
 def get_conversation_by_id(db: Session, conversation_id: int) -> Optional[Conversation]:
     """
@@ -136,6 +476,15 @@ def get_sample_chunk_by_document_id(db: Session, document_id: int) -> Optional[D
     """
     return db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).first()
 
+def get_embedding_dimension_by_document_id(db: Session, document_id: int) -> Optional[int]:
+    """
+    Obtiene la dimensión del embedding de un chunk del documento sin transferir el vector.
+    """
+    return db.query(func.vector_dims(DocumentChunk.embedding)).filter(
+        DocumentChunk.document_id == document_id,
+        DocumentChunk.embedding.isnot(None)
+    ).limit(1).scalar()
+
 def count_total_chunks(db: Session) -> int:
     """
     Cuenta el total de chunks en la BD.
@@ -149,3 +498,111 @@ def count_chunks_by_subject_id(db: Session, subject_id: int) -> int:
     return db.query(DocumentChunk).\
         join(Document, DocumentChunk.document_id == Document.id).\
         filter(Document.subject_id == subject_id).count()
+
+# --- Caché semántica de respuestas ---
+
+class AnswerLookup(NamedTuple):
+    """
+    Resultado de buscar una pregunta en la caché de respuestas de una asignatura.
+    documents_version es la versión de los documentos leída en la misma consulta; la
+    respuesta generada tras un fallo se guarda con ella (ver save_cached_answer).
+    """
+    documents_version: int
+    answer_id: Optional[int]
+    answer: Optional[str]
+    similarity: Optional[float]
+
+# La versión de la asignatura y la respuesta más parecida en una sola consulta; el LEFT
+# JOIN LATERAL devuelve la versión aunque no haya ninguna respuesta válida
+ANSWER_LOOKUP_QUERY = text(
+    "SELECT s.documents_version, c.id, c.answer, c.distance "
+    "FROM subjects AS s "
+    "LEFT JOIN LATERAL ("
+    "SELECT a.id, a.answer, a.question_embedding <=> CAST(:query_embedding AS vector) AS distance "
+    "FROM cached_answers AS a "
+    "WHERE a.subject_id = s.id AND a.documents_version = s.documents_version "
+    "AND a.embedding_model = :embedding_model "
+    "AND a.created_at > :created_after "
+    "ORDER BY distance LIMIT 1"
+    ") AS c ON true "
+    "WHERE s.id = :subject_id"
+).bindparams(bindparam("query_embedding", type_=CachedAnswer.__table__.c.question_embedding.type))
+
+def find_cached_answer(
+    db: Session,
+    subject_id: int,
+    query_embedding: List[float],
+    embedding_model: str,
+    max_age_seconds: int
+) -> Optional[AnswerLookup]:
+    """
+    Busca la respuesta en caché más parecida a la pregunta (similitud coseno) entre las
+    de la versión actual de los documentos de la asignatura y el modelo indicado.
+
+    Returns:
+        AnswerLookup (answer None si no hay ninguna), o None si la asignatura no existe
+    """
+    row = db.execute(ANSWER_LOOKUP_QUERY, {
+        "query_embedding": query_embedding,
+        "embedding_model": embedding_model,
+        "created_after": datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds),
+        "subject_id": subject_id
+    }).first()
+    if row is None:
+        return None
+    similarity = SIMILARITY_SCORES["cosine"](row.distance) if row.id is not None else None
+    return AnswerLookup(row.documents_version, row.id, row.answer, similarity)
+
+def record_cached_answer_hit(db: Session, answer_id: int) -> None:
+    """
+    Contabiliza un acierto de una respuesta en caché.
+    """
+    db.query(CachedAnswer).filter(CachedAnswer.id == answer_id).update(
+        {CachedAnswer.hits: CachedAnswer.hits + 1, CachedAnswer.last_hit_at: func.now()},
+        synchronize_session=False
+    )
+    db.commit()
+
+def save_cached_answer(
+    db: Session,
+    subject_id: int,
+    documents_version: int,
+    embedding_model: str,
+    question: str,
+    question_embedding: List[float],
+    answer: str,
+    max_age_seconds: int
+) -> None:
+    """
+    Guarda una respuesta con la versión de los documentos leída antes de generarla: si los
+    documentos cambiaron mientras tanto, la respuesta nace invalidada. Aprovecha para
+    borrar las respuestas caducadas de la asignatura.
+    """
+    db.query(CachedAnswer).filter(
+        CachedAnswer.subject_id == subject_id,
+        CachedAnswer.created_at < datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+    ).delete(synchronize_session=False)
+    db.add(CachedAnswer(
+        subject_id=subject_id,
+        documents_version=documents_version,
+        embedding_model=embedding_model,
+        question=question,
+        question_embedding=question_embedding,
+        answer=answer,
+        hits=0
+    ))
+    db.commit()
+
+def invalidate_subject_answers(db: Session, subject_id: Optional[int]) -> None:
+    """
+    Invalida las respuestas en caché de una asignatura tras cambiar sus documentos:
+    incrementa documents_version y borra las respuestas existentes. No hace commit, para
+    que la invalidación vaya en la misma transacción que el cambio.
+    """
+    if not subject_id:
+        return
+    db.query(Subject).filter(Subject.id == subject_id).update(
+        {Subject.documents_version: Subject.documents_version + 1},
+        synchronize_session=False
+    )
+    db.query(CachedAnswer).filter(CachedAnswer.subject_id == subject_id).delete(synchronize_session=False)
@@ -5,7 +5,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api import api_router
-from app.services.embedding_service import load_sentence_transformer_model_singleton
+from app.services.embedding_service import load_sentence_transformer_model_singleton, shutdown_query_embedding_batcher
+from app.core.database import ensure_vector_extension
+from app.core.executors import shutdown_executors
+from app.services.background_embedding_service import shutdown_background_embeddings
+from app.services.ingestion_service import resume_ingestion_jobs, shutdown_ingestion_workers
+from app.services.reembedding_service import resume_reembedding_jobs, shutdown_reembedding_workers
+from app.services.api_service import warm_up_llm_instructions
+from app.utils.prompt_budget import load_prompt_tokenizer
 
 
 logging.basicConfig(
@@ -58,8 +65,42 @@ async def startup_event():
     except Exception as e:
         logging.error(f"Error al precargar el modelo de embedding: {e}")
         # No falla la aplicación, solo registra el error
+    # Tokenizador del presupuesto del prompt: se descarga aquí y no en la primera petición
+    load_prompt_tokenizer()
+    # Instrucciones fijas de las plantillas en el proveedor del LLM (caché de contexto)
+    try:
+        warm_up_llm_instructions()
+    except Exception as e:
+        logging.error(f"No se pudieron preparar las instrucciones del LLM: {e}")
     logging.info("Precarga de modelos completada")
 
+    # Comprobar la extensión pgvector una sola vez, no en cada conexión del pool
+    try:
+        ensure_vector_extension()
+    except Exception as e:
+        logging.error(f"No se pudo comprobar la extensión pgvector: {e}")
+
+    # Reanudar los trabajos de ingesta que quedaron en cola o interrumpidos
+    try:
+        resume_ingestion_jobs()
+    except Exception as e:
+        logging.error(f"No se pudieron reanudar los trabajos de ingesta: {e}")
+
+    # Reanudar un cambio de modelo de embeddings interrumpido desde su último lote
+    try:
+        resume_reembedding_jobs()
+    except Exception as e:
+        logging.error(f"No se pudieron reanudar los trabajos de re-embedding: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Esperar a que terminen los embeddings de mensajes pendientes, los pools del chat y la ingesta en curso"""
+    shutdown_background_embeddings(wait=True)
+    shutdown_executors(wait=True)
+    shutdown_query_embedding_batcher(wait=True)
+    shutdown_ingestion_workers()
+    shutdown_reembedding_workers()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
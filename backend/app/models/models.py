@@ -1,8 +1,9 @@
-from sqlalchemy import Boolean, Column, Float, Integer, String, DateTime, ForeignKey, Text, func, Table
-from sqlalchemy.orm import declarative_base, relationship, validates
+from sqlalchemy import Boolean, Column, Float, Integer, String, DateTime, ForeignKey, Text, func, Table, Index
+from sqlalchemy.orm import declarative_base, deferred, relationship, validates
 from sqlalchemy.sql import expression
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.types import UserDefinedType
+import numpy as np
 
 from app.core.database import Base
 
@@ -23,20 +24,23 @@ class Vector(UserDefinedType):
           
             if value is None:
                 return None
-            if isinstance(value, list):
+            if hasattr(value, "tolist"):
+                # Arrays de NumPy (por ejemplo, la salida directa de model.encode)
+                value = value.tolist()
+            if isinstance(value, (list, tuple)):
                 return f"[{','.join(map(str, value))}]"
-            return value 
+            return value
         return process
 
     def result_processor(self, dialect, coltype):
         def process(value):
-            # Convierte el string PostgreSQL '[1,2,3]' a lista Python de floats
+            # Convierte el string PostgreSQL '[1,2,3]' a un array NumPy float32
+            # (un solo buffer en lugar de un objeto float de Python por componente)
             if value is None:
                 return None
             if isinstance(value, str):
                 try:
-                   
-                    return [float(x) for x in value.strip('[]').split(',')]
+                    return np.array(value.strip('[]').split(','), dtype=np.float32)
                 except ValueError:
                   
                     return None
@@ -119,6 +123,8 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     file_path = Column(String, nullable=True)
+    # SHA-256 del PDF: el fichero se guarda una vez por contenido y un PDF repetido reutiliza los chunks
+    content_hash = Column(String(64), nullable=True, index=True)
     description = Column(String, nullable=True)
     summary = Column(Text, nullable=True)  # Resumen del documento generado por IA
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -130,6 +136,7 @@ class Document(Base):
     subject = relationship("Subject", back_populates="documents")
     topic = relationship("Topic", back_populates="documents")
     chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+    ingestion_jobs = relationship("IngestionJob", back_populates="document", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<Document(id={self.id}, title='{self.title}')>"
@@ -140,16 +147,103 @@ class DocumentChunk(Base):
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(Vector(768))
+    # Diferido: solo se carga si se accede al atributo (la búsqueda y los listados no lo usan)
+    embedding = deferred(Column(Vector(768)))
     chunk_number = Column(Integer, nullable=False)
+    # Página del PDF en la que empieza el chunk (None en chunks anteriores a la ingesta por páginas)
+    page_number = Column(Integer, nullable=True)
+    # SHA-256 del texto normalizado: chunks idénticos de otras subidas reutilizan el embedding
+    content_hash = Column(String(64), nullable=True, index=True)
+    # Modelo que generó el embedding; cambia en bloque al terminar un trabajo de re-embedding
+    embedding_model = Column(String, nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     document = relationship("Document", back_populates="chunks")
 
+    # Índices ANN (HNSW) por operador de distancia. Se crean en la migración
+    # b7e2c9d4a1f3 y se pueden reconstruir con vector_index_service.
+    __table_args__ = (
+        Index(
+            "ix_document_chunks_embedding_cosine", "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+        Index(
+            "ix_document_chunks_embedding_l2", "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_l2_ops"},
+        ),
+        Index(
+            "ix_document_chunks_embedding_ip", "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_ip_ops"},
+        ),
+    )
+
     def __repr__(self):
         return f"<DocumentChunk(id={self.id}, document_id={self.document_id}, chunk_number={self.chunk_number})>"
 
 
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    # 'queued', 'extracting', 'chunking', 'embedding', 'indexed', 'failed'
+    status = Column(String, nullable=False, default="queued", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    error = Column(Text, nullable=True)
+    chunk_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    document = relationship("Document", back_populates="ingestion_jobs")
+
+    def __repr__(self):
+        return f"<IngestionJob(id={self.id}, document_id={self.document_id}, status='{self.status}')>"
+
+class ReembeddingJob(Base):
+    __tablename__ = "reembedding_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    target_model = Column(String, nullable=False)
+    # Modelo activo antes del volcado: sus vectores quedan en chunk_reembeddings durante
+    # el periodo de gracia, para los procesos que aún no han cambiado de modelo
+    previous_model = Column(String, nullable=True)
+    # 'queued', 'running', 'swapped', 'failed', 'cancelled'
+    status = Column(String, nullable=False, default="queued", index=True)
+    total_chunks = Column(Integer, nullable=True)
+    processed_chunks = Column(Integer, nullable=False, default=0)
+    # Último chunk procesado: el trabajo se reanuda desde aquí tras un reinicio
+    last_chunk_id = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<ReembeddingJob(id={self.id}, target_model='{self.target_model}', status='{self.status}')>"
+
+class ChunkReembedding(Base):
+    """
+    Embeddings nuevos de los chunks mientras dura un trabajo de re-embedding. La búsqueda
+    sigue usando document_chunks.embedding hasta que el trabajo los vuelca de una vez; tras
+    el volcado guarda los vectores del modelo anterior durante el periodo de gracia.
+    """
+    __tablename__ = "chunk_reembeddings"
+
+    job_id = Column(Integer, ForeignKey("reembedding_jobs.id", ondelete="CASCADE"), primary_key=True)
+    chunk_id = Column(Integer, ForeignKey("document_chunks.id", ondelete="CASCADE"), primary_key=True)
+    embedding = Column(Vector(768), nullable=False)
+
+
 # --- Modelos de Conversaciones y Mensajes ---
 
 class Conversation(Base):
@@ -177,7 +271,7 @@ class Message(Base):
     image_id = Column(Integer, ForeignKey("images.id"), nullable=True)  # Referencia a la imagen si el mensaje contiene una
     is_bot = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    embedding = Column(Vector(768), nullable=True) 
+    embedding = deferred(Column(Vector(768), nullable=True))
 
     conversation = relationship("Conversation", back_populates="messages")
     image = relationship("Image", back_populates="messages")  
@@ -202,6 +296,8 @@ class Subject(Base):
     code = Column(String, nullable=False, unique=True)
     description = Column(Text, nullable=True)
     summary = Column(Text, nullable=True)  # Resumen de la asignatura generado por IA
+    # Se incrementa al indexar o borrar documentos; invalida las respuestas en caché de la asignatura
+    documents_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     users = relationship(
@@ -255,4 +351,24 @@ class Image(Base):
     def __repr__(self):
         return f"<Image(id={self.id}, file_path='{self.file_path}')>"
 
+class CachedAnswer(Base):
+    """
+    Respuesta del bot reutilizable para preguntas casi idénticas de la misma asignatura.
+    Solo es válida mientras documents_version coincide con el de la asignatura y la
+    pregunta se codificó con el modelo de embeddings activo.
+    """
+    __tablename__ = "cached_answers"
 
+    id = Column(Integer, primary_key=True, index=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="CASCADE"), nullable=False, index=True)
+    documents_version = Column(Integer, nullable=False)
+    embedding_model = Column(String, nullable=False)
+    question = Column(Text, nullable=False)
+    question_embedding = deferred(Column(Vector(768), nullable=False))
+    answer = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_hit_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<CachedAnswer(id={self.id}, subject_id={self.subject_id}, hits={self.hits})>"
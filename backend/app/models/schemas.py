@@ -102,11 +102,46 @@ class DocumentOut(DocumentBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class IngestionJobOut(BaseModel):
+    id: int
+    document_id: int
+    status: str
+    attempts: int
+    max_attempts: int
+    error: Optional[str] = None
+    chunk_count: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ReembeddingJobCreate(BaseModel):
+    target_model: str
+
+class ReembeddingJobOut(BaseModel):
+    id: int
+    target_model: str
+    status: str
+    total_chunks: Optional[int] = None
+    processed_chunks: int
+    last_chunk_id: int
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
 class DocumentChunkOut(BaseModel):
     id: int
     document_id: int
     content: str
     chunk_number: int
+    page_number: Optional[int] = None
+    embedding_model: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -318,3 +353,14 @@ class StudentAnalysisRequest(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+
+# ----------------------------------------
+# SCHEMA PARA LA RECUPERACIÓN (ÍNDICES VECTORIALES)
+# ----------------------------------------
+
+class VectorIndexRebuildRequest(BaseModel):
+    """
+    Modelo para reconstruir o reindexar los índices vectoriales de los chunks.
+    """
+    index_type: Optional[str] = Field(None, example="hnsw", description="'hnsw' o 'ivfflat' (por defecto el configurado)")
+    metrics: Optional[List[str]] = Field(None, example=["cosine"], description="Métricas a reconstruir (por defecto todas)")
@@ -0,0 +1,147 @@
+"""
+Servicio de Caché Semántica de Respuestas - Capa base
+Reutiliza la respuesta del bot cuando un estudiante hace una pregunta casi idéntica a
+otra ya respondida en la misma asignatura, sin recuperar contexto ni llamar al modelo.
+Las respuestas se guardan en la tabla cached_answers y se invalidan al cambiar los
+documentos de la asignatura (ver crud_vector.invalidate_subject_answers). Solo se usa
+en el primer turno de cada conversación: la clave no incluye el historial.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional
+import logging
+import threading
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud.crud_vector import find_cached_answer, record_cached_answer_hit, save_cached_answer
+from app.services.embedding_service import get_active_embedding_model
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {"lookups": 0, "hits": 0, "misses": 0, "skipped": 0, "stored": 0, "errors": 0}
+
+
+class AnswerCacheLookup(NamedTuple):
+    """
+    Resultado de consultar la caché en un turno. Si answer es None, la respuesta
+    generada se guarda con documents_version, embedding_model y el embedding de la
+    pregunta (ver store_answer).
+    """
+    subject_id: int
+    documents_version: int
+    embedding_model: str
+    question_embedding: List[float]
+    answer: Optional[str] = None
+    similarity: Optional[float] = None
+
+
+def _count(stat: str) -> None:
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def is_cacheable_question(subject_id: Optional[int], message_text: Optional[str], has_image: bool) -> bool:
+    """
+    Solo se cachean preguntas de texto de una asignatura y con longitud suficiente para
+    no depender del historial de la conversación.
+    """
+    return bool(
+        settings.SEMANTIC_CACHE_ENABLED
+        and subject_id
+        and not has_image
+        and message_text
+        and len(message_text.strip()) >= settings.SEMANTIC_CACHE_MIN_QUESTION_CHARS
+    )
+
+
+def lookup_cached_answer(
+    db: Session,
+    subject_id: Optional[int],
+    message_text: Optional[str],
+    query_embedding: Optional[List[float]],
+    has_image: bool = False
+) -> Optional[AnswerCacheLookup]:
+    """
+    Busca una respuesta en caché para la pregunta. Un fallo de la caché nunca impide
+    responder: se registra y se trata como pregunta no cacheable.
+
+    Returns:
+        AnswerCacheLookup con answer si hay acierto, sin answer si hay que generarla y
+        guardarla, o None si la pregunta no se cachea
+    """
+    if not query_embedding or not is_cacheable_question(subject_id, message_text, has_image):
+        _count("skipped")
+        return None
+
+    try:
+        embedding_model = get_active_embedding_model()
+        found = find_cached_answer(
+            db, subject_id, query_embedding, embedding_model, settings.SEMANTIC_CACHE_TTL_SECONDS
+        )
+        if found is None:
+            _count("skipped")
+            return None
+
+        _count("lookups")
+        if found.answer is not None and found.similarity >= settings.SEMANTIC_CACHE_MIN_SIMILARITY:
+            record_cached_answer_hit(db, found.answer_id)
+            _count("hits")
+            logger.info(
+                f"Respuesta en caché para la asignatura {subject_id} "
+                f"(similitud {found.similarity:.3f}): '{message_text[:50]}...'"
+            )
+            return AnswerCacheLookup(
+                subject_id, found.documents_version, embedding_model, query_embedding, found.answer, found.similarity
+            )
+
+        _count("misses")
+        return AnswerCacheLookup(subject_id, found.documents_version, embedding_model, query_embedding)
+    except Exception as e:
+        db.rollback()
+        _count("errors")
+        logger.error(f"Error al consultar la caché de respuestas: {e}")
+        return None
+
+
+def store_answer(
+    db: Session,
+    lookup: Optional[AnswerCacheLookup],
+    question: str,
+    answer: str
+) -> None:
+    """
+    Guarda la respuesta generada tras un fallo de la caché. No hace nada si la pregunta
+    no era cacheable o ya venía de la caché.
+    """
+    if lookup is None or lookup.answer is not None or not answer:
+        return
+    try:
+        save_cached_answer(
+            db,
+            subject_id=lookup.subject_id,
+            documents_version=lookup.documents_version,
+            embedding_model=lookup.embedding_model,
+            question=question,
+            question_embedding=lookup.question_embedding,
+            answer=answer,
+            max_age_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS
+        )
+        _count("stored")
+    except Exception as e:
+        db.rollback()
+        _count("errors")
+        logger.error(f"Error al guardar la respuesta en la caché: {e}")
+
+
+def get_answer_cache_stats() -> Dict[str, Any]:
+    """
+    Contadores de la caché de respuestas de este proceso. hit_rate es la fracción de
+    consultas a la caché que evitaron la llamada al modelo.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["enabled"] = settings.SEMANTIC_CACHE_ENABLED
+    stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+    return stats
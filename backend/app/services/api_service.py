@@ -1,32 +1,65 @@
 """
 Servicio de API - Capa superior
-Este servicio maneja las interacciones con APIs externas como Google AI.
+Este servicio maneja las interacciones con APIs externas como Google AI, a través del
+proveedor de LLM configurado (settings.LLM_PROVIDER).
 Puede depender de cualquier servicio de las capas inferiores.
 """
 import os
-from typing import Optional
-import google.generativeai as genai
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from app.core.config import settings
+from app.core.executors import run_in_io_executor
 import logging
+from app.services.llm_providers import load_llm_provider
 from app.utils.google_logger import log_google_context
+from app.utils.llm_gateway import LLMGateway
+from app.utils.prompt_budget import count_tokens, fit_prompt_sections, record_prompt_tokens
+from app.utils.prompt_templates import (
+    CHAT_TEMPLATE,
+    PROMPT_TEMPLATES,
+    PromptTemplate,
+    format_subject_info,
+    select_template
+)
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Inicialización del cliente Google AI
-google_client = None
-if settings.GOOGLE_AI_API_KEY:
-    try:
-        logger.info("Configurando Google AI Studio client")
-        genai.configure(api_key=settings.GOOGLE_AI_API_KEY)
-        google_client = genai.GenerativeModel(settings.GOOGLE_AI_MODEL_NAME)
-        logger.info("Google AI Studio client configurado exitosamente")
-    except Exception as e:
-        logger.error(f"Error configurando Google AI Studio client: {type(e).__name__} - {e}")
-        google_client = None
-else:
-    logger.error("FATAL ERROR: GOOGLE_AI_API_KEY no configurada. Cliente Google AI no disponible.")
+# Proveedor del LLM (Google AI o el simulado, ver app.services.llm_providers)
+llm_provider = load_llm_provider()
+
+# Todas las llamadas al LLM pasan por la pasarela: plazo, reintentos, circuit breaker
+# y límite de llamadas simultáneas (ver app.utils.llm_gateway)
+llm_gateway = LLMGateway(
+    llm_provider.name,
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    attempt_timeout_seconds=settings.LLM_ATTEMPT_TIMEOUT_SECONDS,
+    deadline_seconds=settings.LLM_DEADLINE_SECONDS,
+    max_attempts=settings.LLM_MAX_ATTEMPTS,
+    backoff_base_seconds=settings.LLM_RETRY_BACKOFF_SECONDS,
+    backoff_max_seconds=settings.LLM_RETRY_BACKOFF_MAX_SECONDS,
+    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+    recovery_seconds=settings.LLM_CIRCUIT_RECOVERY_SECONDS
+)
+
+_static_prefix_token_counts: Dict[str, int] = {}
+
+# Textos para el usuario cuando no hay respuesta utilizable del modelo
+AI_CONFIG_ERROR_TEXT = "Lo siento, la configuración del servicio de IA no es correcta."
+EMPTY_RESPONSE_TEXT = "Lo siento, no recibí una respuesta válida del modelo de IA."
+
+
+class AIResponseError(Exception):
+    """
+    No hay respuesta utilizable del modelo: proveedor sin configurar o respuesta vacía
+    (p. ej. bloqueada por los filtros de seguridad). user_message es el texto que se
+    muestra en su lugar; no es una respuesta del modelo y no debe cachearse.
+    """
+
+    def __init__(self, user_message: str):
+        super().__init__(user_message)
+        self.user_message = user_message
+
 
 def generate_ai_response(user_question: str, context: str, conversation_history: str = "", 
                       user_id: str = "unknown", conversation_id: int = None) -> str:
@@ -43,9 +76,9 @@ def generate_ai_response(user_question: str, context: str, conversation_history:
     Returns:
         La respuesta generada por el modelo de Google AI.
     """
-    if google_client is None:
+    if not llm_provider.available:
         logger.error("ERROR: generate_ai_response called but Google AI client is not valid!")
-        return "Lo siento, la configuración del servicio de IA no es correcta."
+        return AI_CONFIG_ERROR_TEXT
         
     # Log de depuración - verificamos si context es None o vacío
     if context is None:
@@ -61,49 +94,11 @@ def generate_ai_response(user_question: str, context: str, conversation_history:
     if len(context) < 10:
         logger.warning(f"¡ALERTA! Contexto muy pequeño o vacío: '{context}'")
 
-    prompt = f"""
-    ### Instrucciones:
-    Eres un tutor virtual especializado en educación. Tu objetivo es ayudar a los estudiantes no solo respondiendo preguntas, sino también realizando diversas tareas educativas basadas en el material de estudio proporcionado. Mantén un tono profesional, pedagógico y motivador.
-
-    **Capacidades que tienes:**
-    - Responder preguntas sobre el contenido de la asignatura
-    - Generar exámenes y cuestionarios con preguntas de opción múltiple, verdadero/falso, y desarrollo
-    - Crear resúmenes del material de estudio
-    - Elaborar esquemas y mapas conceptuales en texto
-    - Proporcionar ejercicios de práctica
-    - Explicar conceptos complejos de manera sencilla
-    - Crear guías de estudio
-    - Sugerir técnicas de memorización y aprendizaje
-    - Identificar puntos clave y conceptos importantes
-
-    **Instrucciones de funcionamiento:**
-    Debes basar todas tus respuestas y actividades *únicamente* en la información contenida en el 'Contexto' proporcionado (material de la asignatura). No utilices conocimientos externos ni información que no esté presente en los documentos.
-
-    Si la solicitud no puede ser completada con la información disponible, explica qué información adicional sería necesaria.
-
-    Cuando generes exámenes o cuestionarios:
-    - Incluye diferentes tipos de preguntas (opción múltiple, verdadero/falso, desarrollo)
-    - Proporciona las respuestas correctas al final
-    - Ajusta la dificultad según el nivel del contenido
-
-    Cuando hagas resúmenes:
-    - Identifica los puntos más importantes
-    - Organiza la información de manera lógica y jerárquica
-    - Utiliza bullet points o numeración cuando sea apropiado
-
-    Responde de manera directa sin mencionar constantemente que te basas en el contexto proporcionado.
-
-    ### Historial de la Conversación:
-    {conversation_history}
-
-    ### Material de la Asignatura:
-    {context}
-
-    ### Solicitud del Estudiante:
-    {user_question}
-
-    ### Respuesta:
-    """
+    prompt = CHAT_TEMPLATE.render(
+        conversation_history=conversation_history,
+        context=context,
+        user_question=user_question
+    )
     
     # Registrar el contexto completo enviado a Google AI
     try:
@@ -125,11 +120,10 @@ def generate_ai_response(user_question: str, context: str, conversation_history:
     
     try:
         logger.info("Executing Google AI API call")
-        response = google_client.generate_content(prompt)
+        response_content = llm_gateway.call(lambda timeout: llm_provider.generate(prompt, timeout))
         logger.info("Google AI API call completed successfully")
         
-        if hasattr(response, "text") and response.text:
-            response_content = response.text
+        if response_content:
             logger.info("Successfully extracted response content from Google AI API")
             return response_content.strip() 
         else:
@@ -140,7 +134,22 @@ def generate_ai_response(user_question: str, context: str, conversation_history:
         logger.error(f"Google AI API Error: {type(e).__name__} - {e}")
         return f"Lo siento, hubo un error con la API de Google AI: {str(e)}"
 
-def generate_google_ai_response(
+def warm_up_llm_instructions() -> None:
+    """
+    Registra al arrancar las instrucciones fijas de cada plantilla en el proveedor (p. ej.
+    la caché de contexto de Gemini se empieza a crear en segundo plano), para que no
+    esperen a la primera petición que las usa.
+    """
+    for template in PROMPT_TEMPLATES.values():
+        llm_provider.use_instructions(template.name, template.static_prefix)
+
+def _static_prefix_tokens(template: PromptTemplate) -> int:
+    """Tokens de las instrucciones fijas de la plantilla, contados una sola vez."""
+    if template.name not in _static_prefix_token_counts:
+        _static_prefix_token_counts[template.name] = count_tokens(template.static_prefix)
+    return _static_prefix_token_counts[template.name]
+
+def _build_google_ai_content(
     user_question: str,
     context: str,
     conversation_history: str = "",
@@ -149,28 +158,20 @@ def generate_google_ai_response(
     asignatura: Optional[dict] = None,
     user_id: str = "unknown",
     conversation_id: int = None
-) -> str:
+) -> Tuple[Optional[str], List[Any]]:
     """
-    Genera una respuesta utilizando la API de Google AI Studio (Gemma3) basada en la pregunta
-    del usuario, el contexto proporcionado y, opcionalmente, una imagen.
-
-    Args:
-        user_question: La pregunta realizada por el usuario.
-        context: El contexto extraído de los documentos relevantes.
-        conversation_history: El historial de la conversación (opcional).
-        image_base64: La imagen codificada en base64 (opcional).
-        image_mime_type: El tipo MIME de la imagen (ej: image/jpeg) (opcional).
-        asignatura: La asignatura asociada a la conversación o imagen (opcional).
-        user_id: ID del usuario que realiza la consulta (opcional).
-        conversation_id: ID de la conversación (opcional).
+    Construye el prompt con la plantilla que corresponde y las partes del contenido
+    (imagen opcional + texto) que se envían al LLM, y registra el contexto utilizado.
+    El historial y el material se ajustan a settings.PROMPT_TOKEN_BUDGET (ver
+    app.utils.prompt_budget). Si el proveedor ya lleva las instrucciones fijas de la
+    plantilla (ver LLMProvider.use_instructions), solo se envían los huecos.
+    Lo comparten las variantes síncrona y asíncrona de generate_google_ai_response. Es
+    bloqueante (escribe el registro en disco y tokeniza el prompt): las variantes
+    asíncronas lo ejecutan en el pool de E/S.
 
     Returns:
-        La respuesta generada por el modelo de Google AI Studio.
+        (clave de las instrucciones registradas en el proveedor o None, partes del contenido)
     """
-    if google_client is None:
-        logger.error("ERROR: generate_google_ai_response llamado pero el cliente de Google AI no es válido!")
-        return "Lo siento, la configuración del servicio de IA no es correcta."
-
     # Log de depuración del contexto
     if context is None:
         logger.warning("Contexto es None en generate_google_ai_response")
@@ -179,95 +180,41 @@ def generate_google_ai_response(
         logger.warning("Contexto está vacío en generate_google_ai_response")
     logger.info(f"Tamaño del contexto en generate_google_ai_response: {len(context)} caracteres")
 
-    # Construir información de la asignatura si está disponible
-    subject_info_text = ""
-    if asignatura and isinstance(asignatura, dict):
-        subject_info_text = f"""
-        **Información de la Asignatura:**
-        - Nombre: {asignatura.get('name', 'No especificado')}
-        - Código: {asignatura.get('code', 'No especificado')}
-        - Descripción: {asignatura.get('description', 'No especificada')}"""
-        
-        if asignatura.get('summary') and asignatura['summary'].strip():
-            subject_info_text += f"""
-        - Resumen de la asignatura: {asignatura['summary']}"""
-        
-        subject_info_text += "\n"
+    subject_info_text = format_subject_info(asignatura)
+    has_image = bool(image_base64 and image_mime_type)
+    template = select_template(has_image, user_question)
+    slots = {"subject_info": subject_info_text, "user_question": user_question}
+    if "conversation_history" not in template.slots:
+        conversation_history = ""
+
+    # Se ajustan historial y material al presupuesto de tokens; el resto del prompt
+    # (instrucciones, asignatura y pregunta) no se recorta
+    instruction_tokens = _static_prefix_tokens(template)
+    fixed_tokens = instruction_tokens + count_tokens(template.render_dynamic(**slots))
+    fitted = fit_prompt_sections(fixed_tokens, context, conversation_history)
+    context, conversation_history = fitted.context, fitted.conversation_history
+    slots["context"] = context
+    if "conversation_history" in template.slots:
+        slots["conversation_history"] = conversation_history
+    prompt = template.render(**slots)
+
+    subject_tokens = count_tokens(subject_info_text)
+    question_tokens = count_tokens(user_question) if user_question else 0
+    section_tokens = {
+        "instructions": instruction_tokens,
+        "subject": subject_tokens,
+        "question": question_tokens,
+        "history": fitted.history_tokens,
+        "context": fitted.context_tokens,
+        "total": fixed_tokens + fitted.history_tokens + fitted.context_tokens
+    }
+    record_prompt_tokens(section_tokens, fitted)
+    logger.info(
+        f"Tokens del prompt '{template.name}' por sección: {section_tokens} (chunks: {fitted.chunks_kept} usados, "
+        f"{fitted.chunks_dropped} descartados; turnos: {fitted.turns_summarized} resumidos, "
+        f"{fitted.turns_dropped} descartados)"
+    )
 
-    # Construcción del prompt basado en si hay imagen o no
-    prompt = ""
-    if image_base64 and image_mime_type:
-        # Caso con imagen
-        if user_question and user_question.strip():
-            prompt = f"""
-                ### Instrucciones:
-                Eres un tutor virtual especializado en educación. Analiza la siguiente imagen en relación con la pregunta del estudiante: '{user_question}'. Basándote en el contexto proporcionado y la imagen, proporciona una respuesta clara, concisa y pedagógica.
-
-                {subject_info_text}
-                **Contexto de la Asignatura:**
-                {context}
-
-                ### Respuesta:
-                """
-        else:
-            # Imagen sin pregunta directa - caso de profesor o análisis general
-            prompt = f"""
-                ### Instrucciones:
-                Eres un tutor virtual especializado en educación. Describe y analiza el contenido de la siguiente imagen en el contexto de la asignatura. Identifica los elementos clave y explica su posible relevancia educativa.
-
-                {subject_info_text}
-                **Contexto de la Asignatura:**
-                {context}
-
-                ### Respuesta:
-                """
-    else:
-        # Caso solo con texto (tu prompt original)
-        prompt = f"""
-        ### Instrucciones:
-        Eres un tutor virtual especializado en educación. Tu objetivo es ayudar a los estudiantes no solo respondiendo preguntas, sino también realizando diversas tareas educativas basadas en el material de estudio proporcionado. Mantén un tono profesional, pedagógico y motivador.
-
-        **Capacidades que tienes:**
-        - Responder preguntas sobre el contenido de la asignatura
-        - Generar exámenes y cuestionarios con preguntas de opción múltiple, verdadero/falso, y desarrollo
-        - Crear resúmenes del material de estudio
-        - Elaborar esquemas y mapas conceptuales en texto
-        - Proporcionar ejercicios de práctica
-        - Explicar conceptos complejos de manera sencilla
-        - Crear guías de estudio
-        - Sugerir técnicas de memorización y aprendizaje
-        - Identificar puntos clave y conceptos importantes
-
-        **Instrucciones de funcionamiento:**
-        Debes basar todas tus respuestas y actividades *únicamente* en la información contenida en el 'Contexto' proporcionado (material de la asignatura). No utilices conocimientos externos ni información que no esté presente en los documentos.
-
-        Si la solicitud no puede ser completada con la información disponible, explica qué información adicional sería necesaria.
-
-        Cuando generes exámenes o cuestionarios:
-        - Incluye diferentes tipos de preguntas (opción múltiple, verdadero/falso, desarrollo)
-        - Proporciona las respuestas correctas al final
-        - Ajusta la dificultad según el nivel del contenido
-
-        Cuando hagas resúmenes:
-        - Identifica los puntos más importantes
-        - Organiza la información de manera lógica y jerárquica
-        - Utiliza bullet points o numeración cuando sea apropiado
-
-        Responde de manera directa sin mencionar constantemente que te basas en el contexto proporcionado.
-
-        {subject_info_text}
-        ### Historial de la Conversación:
-        {conversation_history}
-
-        ### Material de la Asignatura:
-        {context}
-
-        ### Solicitud del Estudiante:
-        {user_question}
-
-        ### Respuesta:
-        """
-    
     # Registrar el contexto completo enviado a Google AI
     try:
         if conversation_id:
@@ -284,29 +231,171 @@ def generate_google_ai_response(
         logger.error(f"Error al registrar contexto de Google AI: {str(log_error)}")
         logger.error(f"Detalles: user_id={user_id}, conversation_id={conversation_id}, context_len={len(context) if context else 0}")
 
+    instructions_key = template.name if llm_provider.use_instructions(template.name, template.static_prefix) else None
+    content_parts = []
+    if image_base64 and image_mime_type:
+        image_part = {"mime_type": image_mime_type, "data": image_base64}
+        content_parts.append(image_part)
+    content_parts.append(template.render_dynamic(**slots) if instructions_key else prompt)
+    return instructions_key, content_parts
+
+def _extract_google_ai_text(text: str) -> str:
+    """Limpia el texto de la respuesta del LLM; lanza AIResponseError si está vacío."""
+    if text and text.strip():
+        logger.info("Respuesta de Google AI API recibida correctamente")
+        return text.strip()
+    logger.warning("ADVERTENCIA: La respuesta de Google AI API no contiene texto.")
+    raise AIResponseError(EMPTY_RESPONSE_TEXT)
+
+def generate_google_ai_response(
+    user_question: str,
+    context: str,
+    conversation_history: str = "",
+    image_base64: Optional[str] = None,  
+    image_mime_type: Optional[str] = None,  
+    asignatura: Optional[dict] = None,
+    user_id: str = "unknown",
+    conversation_id: int = None
+) -> str:
+    """
+    Genera una respuesta utilizando la API de Google AI Studio (Gemma3) basada en la pregunta
+    del usuario, el contexto proporcionado y, opcionalmente, una imagen.
+
+    Args:
+        user_question: La pregunta realizada por el usuario.
+        context: El contexto extraído de los documentos relevantes.
+        conversation_history: El historial de la conversación (opcional).
+        image_base64: La imagen codificada en base64 (opcional).
+        image_mime_type: El tipo MIME de la imagen (ej: image/jpeg) (opcional).
+        asignatura: La asignatura asociada a la conversación o imagen (opcional).
+        user_id: ID del usuario que realiza la consulta (opcional).
+        conversation_id: ID de la conversación (opcional).
+
+    Returns:
+        La respuesta generada por el modelo de Google AI Studio.
+    """
+    if not llm_provider.available:
+        logger.error("ERROR: generate_google_ai_response llamado pero el cliente de Google AI no es válido!")
+        return AI_CONFIG_ERROR_TEXT
+
+    instructions_key, content_parts = _build_google_ai_content(
+        user_question=user_question,
+        context=context,
+        conversation_history=conversation_history,
+        image_base64=image_base64,
+        image_mime_type=image_mime_type,
+        asignatura=asignatura,
+        user_id=user_id,
+        conversation_id=conversation_id
+    )
+
     logger.info(f"Preparando llamada a Google AI API con modelo: {settings.GOOGLE_AI_MODEL_NAME}")
 
     try:
         logger.info("Ejecutando llamada a Google AI API")
-        content_parts = []
-        if image_base64 and image_mime_type:
-            image_part = {"mime_type": image_mime_type, "data": image_base64}
-            content_parts.append(image_part)
-        content_parts.append(prompt)
-
-        response = google_client.generate_content(content_parts)
-
-        if hasattr(response, "text") and response.text:
-            logger.info("Respuesta de Google AI API recibida correctamente")
-            return response.text.strip()
-        else:
-            logger.warning("ADVERTENCIA: La respuesta de Google AI API no contiene texto.")
-            return "Lo siento, no recibí una respuesta válida del modelo de IA para la imagen."
+        response = llm_gateway.call(
+            lambda timeout: llm_provider.generate(content_parts, timeout, instructions_key)
+        )
+        return _extract_google_ai_text(response)
 
+    except AIResponseError as e:
+        return e.user_message
     except Exception as e:
         logger.error(f"Error inesperado durante llamada a Google AI: {type(e).__name__} - {e}")
         return "Lo siento, ocurrió un error inesperado al procesar la solicitud de IA con la imagen."
 
+async def generate_google_ai_response_async(
+    user_question: str,
+    context: str,
+    conversation_history: str = "",
+    image_base64: Optional[str] = None,  
+    image_mime_type: Optional[str] = None,  
+    asignatura: Optional[dict] = None,
+    user_id: str = "unknown",
+    conversation_id: int = None
+) -> str:
+    """
+    Variante asíncrona de generate_google_ai_response: usa el cliente asíncrono de
+    Gemini (generate_content_async), de modo que la espera al modelo no bloquea el
+    event loop y varias conversaciones pueden generarse a la vez. Los errores que
+    persisten tras los reintentos de la pasarela se propagan (LLMUnavailableError si el
+    circuito está abierto o se agota el plazo), y sin proveedor configurado o con una
+    respuesta vacía se lanza AIResponseError, para que el llamante no guarde ni cachee un
+    mensaje de error como respuesta.
+    """
+    if not llm_provider.available:
+        logger.error("ERROR: generate_google_ai_response_async llamado pero el cliente de Google AI no es válido!")
+        raise AIResponseError(AI_CONFIG_ERROR_TEXT)
+
+    # Registro del contexto en disco y recuento de tokens: fuera del bucle de eventos
+    instructions_key, content_parts = await run_in_io_executor(
+        _build_google_ai_content,
+        user_question=user_question,
+        context=context,
+        conversation_history=conversation_history,
+        image_base64=image_base64,
+        image_mime_type=image_mime_type,
+        asignatura=asignatura,
+        user_id=user_id,
+        conversation_id=conversation_id
+    )
+
+    logger.info(f"Preparando llamada asíncrona a Google AI API con modelo: {settings.GOOGLE_AI_MODEL_NAME}")
+
+    response = await llm_gateway.call_async(
+        lambda timeout: llm_provider.generate_async(content_parts, timeout, instructions_key)
+    )
+    return _extract_google_ai_text(response)
+
+async def generate_google_ai_response_stream(
+    user_question: str,
+    context: str,
+    conversation_history: str = "",
+    image_base64: Optional[str] = None,  
+    image_mime_type: Optional[str] = None,  
+    asignatura: Optional[dict] = None,
+    user_id: str = "unknown",
+    conversation_id: int = None
+) -> AsyncIterator[str]:
+    """
+    Genera la respuesta de Google AI en streaming, devolviendo los fragmentos de texto
+    a medida que el modelo los produce (generate_content_async con stream=True).
+    Los errores de la API se propagan para que el llamante decida qué guardar; sin
+    proveedor configurado o si el stream termina sin texto se lanza AIResponseError.
+    """
+    if not llm_provider.available:
+        logger.error("ERROR: generate_google_ai_response_stream llamado pero el cliente de Google AI no es válido!")
+        raise AIResponseError(AI_CONFIG_ERROR_TEXT)
+
+    # Registro del contexto en disco y recuento de tokens: fuera del bucle de eventos
+    instructions_key, content_parts = await run_in_io_executor(
+        _build_google_ai_content,
+        user_question=user_question,
+        context=context,
+        conversation_history=conversation_history,
+        image_base64=image_base64,
+        image_mime_type=image_mime_type,
+        asignatura=asignatura,
+        user_id=user_id,
+        conversation_id=conversation_id
+    )
+
+    logger.info(f"Iniciando respuesta en streaming de Google AI con modelo: {settings.GOOGLE_AI_MODEL_NAME}")
+    chunks = llm_gateway.stream_async(
+        lambda timeout: llm_provider.open_stream(content_parts, timeout, instructions_key)
+    )
+    has_text = False
+    try:
+        async for text in chunks:
+            has_text = has_text or bool(text.strip())
+            yield text
+    finally:
+        # Libera el hueco de concurrencia aunque el cliente deje de leer a mitad
+        await chunks.aclose()
+    if not has_text:
+        logger.warning("ADVERTENCIA: La respuesta en streaming de Google AI API no contiene texto.")
+        raise AIResponseError(EMPTY_RESPONSE_TEXT)
+
 def generate_google_ai_simple(prompt: str) -> str:
     """
     Función genérica para llamar a la API de Google AI con cualquier prompt.
@@ -317,18 +406,18 @@ def generate_google_ai_simple(prompt: str) -> str:
     Returns:
         La respuesta generada por el modelo de Google AI
     """
-    if google_client is None:
+    if not llm_provider.available:
         logger.error("ERROR: generate_google_ai_simple llamado pero el cliente de Google AI no es válido!")
-        return "Lo siento, la configuración del servicio de IA no es correcta."
+        return AI_CONFIG_ERROR_TEXT
 
     try:
         logger.info("Ejecutando llamada a Google AI API con prompt personalizado")
         
-        response = google_client.generate_content(prompt)
+        response = llm_gateway.call(lambda timeout: llm_provider.generate(prompt, timeout))
         
-        if response.text:
+        if response:
             logger.info("Respuesta de Google AI obtenida exitosamente")
-            return response.text.strip()
+            return response.strip()
         else:
             logger.warning("Google AI no devolvió texto en la respuesta")
             return "Lo siento, no recibí una respuesta válida del modelo de IA."
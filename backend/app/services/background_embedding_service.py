@@ -0,0 +1,81 @@
+"""
+Servicio de Embeddings en Segundo Plano - Capa base
+Este servicio calcula los embeddings de los mensajes del bot fuera del ciclo
+petición/respuesta, en un pool de hilos acotado, y los guarda en Message.embedding.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+import logging
+import threading
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.models import Message
+from app.services.embedding_service import get_embedding_for_query
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_EMBEDDING_WORKERS,
+                thread_name_prefix="message-embedding"
+            )
+        return _executor
+
+
+def _embed_message(message_id: int, message_text: str) -> None:
+    """
+    Calcula el embedding de un mensaje y lo guarda con su propia sesión de BD.
+    """
+    db = SessionLocal()
+    try:
+        # Fuera del agrupador de preguntas: es de baja prioridad y una respuesta larga
+        # alargaría la codificación de todo el lote
+        embedding = get_embedding_for_query(message_text, use_cache=False, use_batcher=False)
+        if not embedding:
+            logger.warning(f"No se pudo generar el embedding del mensaje {message_id}")
+            return
+
+        db.query(Message).filter(Message.id == message_id).update(
+            {Message.embedding: embedding},
+            synchronize_session=False
+        )
+        db.commit()
+        logger.info(f"Embedding guardado para el mensaje {message_id}")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error al guardar el embedding del mensaje {message_id}: {e}")
+    finally:
+        db.close()
+
+
+def enqueue_message_embedding(message_id: int, message_text: str) -> Optional[Future]:
+    """
+    Encola el cálculo del embedding de un mensaje ya confirmado en la BD.
+
+    Returns:
+        El Future de la tarea, o None si los embeddings de mensajes están desactivados
+    """
+    if not settings.EMBED_BOT_MESSAGES or not message_text:
+        return None
+
+    return _get_executor().submit(_embed_message, message_id, message_text)
+
+
+def shutdown_background_embeddings(wait: bool = True) -> None:
+    """
+    Detiene el pool de embeddings, esperando a las tareas pendientes si wait=True.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -2,19 +2,36 @@
 Servicio de Chat - Capa superior
 Este servicio maneja la lógica de chat y puede usar todos los servicios de capas inferiores.
 """
-from typing import List, Optional, Dict, Any, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 from fastapi import HTTPException
 from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
+import asyncio
 import logging
+import time
 
 from ..services.image_service import get_image_by_id, prepare_image_for_google_ai
 
 # Configuración de logging
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Respuesta cuando la pasarela del LLM rechaza la llamada (circuito abierto o plazo agotado)
+LLM_UNAVAILABLE_TEXT = "El servicio de IA no está disponible en este momento. Inténtalo de nuevo en unos minutos."
+
+from app.core.database import SessionLocal
+from app.core.executors import run_in_io_executor
 from app.models.models import Conversation, Message, User, Subject
-from app.services.api_service import generate_google_ai_response
+from app.services.api_service import (
+    AIResponseError,
+    generate_google_ai_response,
+    generate_google_ai_response_async,
+    generate_google_ai_response_stream
+)
+from app.services.answer_cache_service import AnswerCacheLookup, lookup_cached_answer, store_answer
+from app.services.embedding_service import get_embedding_for_query_async
+from app.utils.llm_gateway import LLMUnavailableError
 from app.services.vector_service import ( 
     get_conversation_context,
     get_conversation_history,
@@ -138,71 +155,349 @@ def get_conversation_messages(db: Session, conversation_id: int) -> List[Message
 
 
 
-def add_message_and_generate_response(db: Session, conversation_id: int, user_id: int, message_text: str = None, image_id: int = None) -> Tuple[Message, Message]:
+def _get_conversation_for_user(db: Session, conversation_id: int, user_id: int) -> Conversation:
     """
-    Añade un mensaje del usuario a una conversación existente y genera una respuesta.
-    Se puede incluir texto, imagen o ambos en el mensaje.
+    Obtiene la conversación comprobando que pertenece al usuario.
     """
-
     conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
 
-
     if conversation.user_id != user_id:
         raise HTTPException(status_code=403, detail="No tienes permiso para esta conversación")
 
+    return conversation
 
-    user_msg = add_user_message(db, conversation_id, message_text, image_id)
-
-    image_base64: Optional[str] = None
-    image_mime_type: Optional[str] = None
-
+def _load_image_for_ai(db: Session, image_id: Optional[int]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Lee la imagen adjunta (si la hay) y la devuelve en base64 junto a su tipo MIME.
+    """
     if image_id:
-         image = get_image_by_id(image_id,db)
-         if image:
-             image_base64, image_mime_type = prepare_image_for_google_ai(image)
+        image = get_image_by_id(image_id, db)
+        if image:
+            return prepare_image_for_google_ai(image)
+    return None, None
 
+def _get_subject_info(db: Session, subject_id: Optional[int]) -> Optional[Dict[str, Any]]:
+    """
+    Obtiene la información completa de la asignatura incluyendo el resumen.
+    """
+    if not subject_id:
+        return None
+    subject = db.query(Subject).filter(Subject.id == subject_id).first()
+    if not subject:
+        return None
+    return {
+        "id": subject.id,
+        "name": subject.name,
+        "code": subject.code,
+        "description": subject.description,
+        "summary": subject.summary
+    }
 
+def _build_response_inputs(
+    db: Session,
+    conversation: Conversation,
+    user_id: int,
+    message_text: Optional[str],
+    image_base64: Optional[str],
+    image_mime_type: Optional[str],
+    query_embedding: Optional[List[float]] = None
+) -> Dict[str, Any]:
+    """
+    Reúne la asignatura, el contexto y el historial de la conversación y devuelve
+    los argumentos para generar la respuesta del modelo.
+    """
     context = ""
     subject_info = None
-    try:
-        if conversation.subject_id:
-            # Obtener información completa de la asignatura incluyendo el resumen
-            subject = db.query(Subject).filter(Subject.id == conversation.subject_id).first()
-            if subject:
-                subject_info = {
-                    "id": subject.id,
-                    "name": subject.name,
-                    "code": subject.code,
-                    "description": subject.description,
-                    "summary": subject.summary
-                }
-            
-            context = get_conversation_context(
-                db=db,
-                message_text=message_text,
-                subject_id=conversation.subject_id
-            )
+    if conversation.subject_id:
+        subject_info = _get_subject_info(db, conversation.subject_id)
 
-        
-        conversation_history = get_conversation_history(db, conversation_id)
-        
-        bot_response = generate_google_ai_response(
-            user_question=message_text,
-            context=context,
-            conversation_history=conversation_history,
-            image_base64=image_base64,
-            image_mime_type=image_mime_type,
-            asignatura=subject_info,
-            user_id=str(user_id),
-            conversation_id=conversation_id
+        context = get_conversation_context(
+            db=db,
+            message_text=message_text,
+            subject_id=conversation.subject_id,
+            query_embedding=query_embedding
         )
+
+    conversation_history = get_conversation_history(db, conversation.id)
+
+    return {
+        "user_question": message_text,
+        "context": context,
+        "conversation_history": conversation_history,
+        "image_base64": image_base64,
+        "image_mime_type": image_mime_type,
+        "asignatura": subject_info,
+        "user_id": str(user_id),
+        "conversation_id": conversation.id
+    }
+
+def add_message_and_generate_response(db: Session, conversation_id: int, user_id: int, message_text: str = None, image_id: int = None) -> Tuple[Message, Message]:
+    """
+    Añade un mensaje del usuario a una conversación existente y genera una respuesta.
+    Se puede incluir texto, imagen o ambos en el mensaje.
+    """
+    conversation = _get_conversation_for_user(db, conversation_id, user_id)
+
+    user_msg = add_user_message(db, conversation_id, message_text, image_id)
+
+    image_base64, image_mime_type = _load_image_for_ai(db, image_id)
+
+    try:
+        response_inputs = _build_response_inputs(
+            db, conversation, user_id, message_text, image_base64, image_mime_type
+        )
+        bot_response = generate_google_ai_response(**response_inputs)
     except Exception as e:
-        print(f"Error generating AI response: {e}")
+        logger.error(f"Error generating AI response: {e}")
         bot_response = "Lo siento, hubo un error al generar la respuesta."
 
-    
     bot_msg = add_bot_message(db, conversation_id, bot_response)
     
-    return user_msg, bot_msg
\ No newline at end of file
+    return user_msg, bot_msg
+
+def _with_session(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Ejecuta func con una sesión de BD propia y de corta duración.
+    Una Session no puede compartirse entre hilos, así que cada etapa concurrente abre la suya.
+    """
+    db = SessionLocal()
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        db.close()
+
+def _get_context_for_turn(db: Session, subject_id: Optional[int], message_text: Optional[str], query_embedding: Optional[List[float]]) -> str:
+    if not subject_id:
+        return ""
+    return get_conversation_context(
+        db=db,
+        message_text=message_text,
+        subject_id=subject_id,
+        query_embedding=query_embedding
+    )
+
+async def _timed(timings: Dict[str, float], stage: str, awaitable: Awaitable[T]) -> T:
+    """Espera awaitable y anota su duración en milisegundos en timings[stage]."""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+async def _prepare_turn(
+    db: Session,
+    conversation_id: int,
+    user_id: int,
+    message_text: Optional[str],
+    image_id: Optional[int]
+) -> Tuple[Message, Optional[Dict[str, Any]], Optional[AnswerCacheLookup], Dict[str, float]]:
+    """
+    Etapa de orquestación de un turno: guarda el mensaje del usuario y reúne las
+    entradas del modelo ejecutando en paralelo las etapas independientes.
+
+    - embedding de la pregunta, y después en paralelo guardar el mensaje y consultar la
+      caché de respuestas (solo en el primer turno de la conversación); la búsqueda
+      vectorial solo se hace si la caché falla
+    - información de la asignatura
+    - historial de la conversación
+    - lectura y codificación de la imagen adjunta
+
+    Solo el mensaje del usuario usa la sesión db; el resto de etapas abren su propia sesión.
+
+    Returns:
+        (mensaje del usuario, argumentos para el modelo o None si falló la preparación
+        del contexto, consulta a la caché de respuestas o None, tiempos por etapa en ms)
+    """
+    conversation = await run_in_io_executor(_get_conversation_for_user, db, conversation_id, user_id)
+    timings: Dict[str, float] = {}
+
+    async def embed_question() -> Optional[List[float]]:
+        if not message_text:
+            return None
+        # Se espera en el agrupador de embeddings junto a las preguntas de otros turnos
+        return await _timed(timings, "embedding", get_embedding_for_query_async(message_text))
+
+    # La pregunta se codifica una sola vez y se reutiliza para guardarla y para el contexto
+    embedding_task = asyncio.ensure_future(embed_question())
+
+    async def save_user_message() -> Message:
+        query_embedding = await embedding_task
+        return await _timed(timings, "user_message", run_in_io_executor(
+            add_user_message, db, conversation_id, message_text, image_id, query_embedding
+        ))
+
+    # El mensaje actual aún no es visible para otras sesiones: se leen los 9 anteriores
+    # y se añade al final, igual que el historial de 10 mensajes del flujo secuencial
+    history_task = asyncio.ensure_future(
+        _timed(timings, "history", run_in_io_executor(_with_session, get_conversation_history, conversation_id, 9))
+    )
+
+    async def lookup_answer() -> Optional[AnswerCacheLookup]:
+        query_embedding = await embedding_task
+        try:
+            history = await history_task
+        except Exception:
+            history = None
+        if history != "":
+            # La clave de la caché no incluye la conversación: en un turno de seguimiento la
+            # respuesta depende de lo anterior, así que solo se cachea la primera pregunta
+            return None
+        return await _timed(timings, "answer_cache", run_in_io_executor(
+            _with_session, lookup_cached_answer, conversation.subject_id, message_text, query_embedding, image_id is not None
+        ))
+
+    answer_task = asyncio.ensure_future(lookup_answer())
+
+    async def load_context() -> str:
+        query_embedding = await embedding_task
+        answer_lookup = await answer_task
+        if answer_lookup is not None and answer_lookup.answer is not None:
+            # La respuesta sale de la caché: no hace falta contexto
+            return ""
+        return await _timed(timings, "context", run_in_io_executor(
+            _with_session, _get_context_for_turn, conversation.subject_id, message_text, query_embedding
+        ))
+
+    start = time.perf_counter()
+    user_msg, context, answer_lookup, subject_info, conversation_history, image = await asyncio.gather(
+        save_user_message(),
+        load_context(),
+        answer_task,
+        _timed(timings, "subject", run_in_io_executor(_with_session, _get_subject_info, conversation.subject_id)),
+        history_task,
+        _timed(timings, "image", run_in_io_executor(_with_session, _load_image_for_ai, image_id)),
+        return_exceptions=True
+    )
+    timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(f"Tiempos por etapa del turno (ms) en la conversación {conversation_id}: {timings}")
+
+    # Los fallos al guardar el mensaje o leer la imagen se propagan, como en el flujo secuencial
+    for result in (user_msg, image):
+        if isinstance(result, BaseException):
+            raise result
+
+    if isinstance(answer_lookup, BaseException):
+        logger.error(f"Error consultando la caché de respuestas: {answer_lookup}")
+        answer_lookup = None
+
+    for stage, result in (("context", context), ("subject", subject_info), ("history", conversation_history)):
+        if isinstance(result, BaseException):
+            logger.error(f"Error preparando la etapa '{stage}' de la respuesta: {result}")
+            return user_msg, None, answer_lookup, timings
+
+    if message_text:
+        conversation_history = "\n".join(
+            part for part in (conversation_history, f"Usuario: {message_text}") if part
+        )
+
+    image_base64, image_mime_type = image
+    response_inputs = {
+        "user_question": message_text,
+        "context": context,
+        "conversation_history": conversation_history,
+        "image_base64": image_base64,
+        "image_mime_type": image_mime_type,
+        "asignatura": subject_info,
+        "user_id": str(user_id),
+        "conversation_id": conversation_id
+    }
+    return user_msg, response_inputs, answer_lookup, timings
+
+async def add_message_and_generate_response_async(db: Session, conversation_id: int, user_id: int, message_text: str = None, image_id: int = None) -> Tuple[Message, Message]:
+    """
+    Versión asíncrona de add_message_and_generate_response para las rutas async.
+
+    Las etapas bloqueantes se ejecutan fuera del event loop: el acceso a BD y ficheros
+    en el pool de E/S, la codificación de la pregunta en el agrupador de embeddings y la
+    llamada al modelo con el cliente asíncrono de Gemini. Las entradas del modelo se
+    preparan en paralelo (ver _prepare_turn). Si la caché semántica tiene la respuesta,
+    no se llama al modelo.
+    """
+    user_msg, response_inputs, answer_lookup, _ = await _prepare_turn(db, conversation_id, user_id, message_text, image_id)
+
+    bot_response = "Lo siento, hubo un error al generar la respuesta."
+    if answer_lookup is not None and answer_lookup.answer is not None:
+        bot_response = answer_lookup.answer
+    elif response_inputs is not None:
+        try:
+            bot_response = await generate_google_ai_response_async(**response_inputs)
+            if answer_lookup is not None:
+                await run_in_io_executor(_with_session, store_answer, answer_lookup, message_text, bot_response)
+        except LLMUnavailableError as e:
+            logger.error(f"LLM no disponible: {e}")
+            bot_response = LLM_UNAVAILABLE_TEXT
+        except AIResponseError as e:
+            # Aviso para el usuario, no una respuesta del modelo: no se cachea
+            bot_response = e.user_message
+        except Exception as e:
+            logger.error(f"Error generating AI response: {e}")
+
+    bot_msg = await run_in_io_executor(add_bot_message, db, conversation_id, bot_response)
+
+    return user_msg, bot_msg
+
+def _commit_and_release(db: Session, user_msg: Message) -> None:
+    """
+    Confirma el mensaje del usuario y cierra la sesión, de modo que no se retiene
+    ninguna conexión de BD mientras llegan los fragmentos del modelo.
+    """
+    db.commit()
+    db.refresh(user_msg)
+    db.close()
+
+async def stream_message_and_generate_response(
+    conversation_id: int,
+    user_id: int,
+    message_text: str = None,
+    image_id: int = None
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Añade un mensaje del usuario y genera la respuesta del bot en streaming.
+
+    Produce eventos (tipo, valor): "user_message" con el mensaje guardado, "token" con
+    cada fragmento de texto y, al completarse el stream, "bot_message" con la respuesta
+    guardada. Usa su propia sesión de BD, ya que la de la petición se cierra antes de
+    enviar el cuerpo de una respuesta en streaming. Si el cliente se desconecta antes
+    de terminar, la respuesta parcial no se guarda. Una respuesta de la caché semántica
+    se envía como un único fragmento.
+    """
+    db = SessionLocal()
+    try:
+        user_msg, response_inputs, answer_lookup, _ = await _prepare_turn(db, conversation_id, user_id, message_text, image_id)
+        await run_in_io_executor(_commit_and_release, db, user_msg)
+        yield "user_message", user_msg
+
+        error_text = "Lo siento, hubo un error al generar la respuesta."
+        response_parts: List[str] = []
+        if answer_lookup is not None and answer_lookup.answer is not None:
+            response_parts.append(answer_lookup.answer)
+            yield "token", answer_lookup.answer
+        elif response_inputs is None:
+            response_parts.append(error_text)
+            yield "token", error_text
+        else:
+            try:
+                async for text in generate_google_ai_response_stream(**response_inputs):
+                    response_parts.append(text)
+                    yield "token", text
+                # Solo se cachean respuestas completas del modelo
+                if answer_lookup is not None:
+                    await run_in_io_executor(_with_session, store_answer, answer_lookup, message_text, "".join(response_parts))
+            except Exception as e:
+                logger.error(f"Error generating streamed AI response: {e}")
+                if not "".join(response_parts).strip():
+                    if isinstance(e, LLMUnavailableError):
+                        fallback = LLM_UNAVAILABLE_TEXT
+                    elif isinstance(e, AIResponseError):
+                        fallback = e.user_message
+                    else:
+                        fallback = error_text
+                    response_parts = [fallback]
+                    yield "token", fallback
+
+        bot_msg = await run_in_io_executor(add_bot_message, db, conversation_id, "".join(response_parts))
+        yield "bot_message", bot_msg
+    finally:
+        db.close()
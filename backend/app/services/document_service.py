@@ -1,8 +1,7 @@
 import os
-import uuid
-from datetime import datetime
 from sqlalchemy.orm import Session
-from app.models.models import Document
+from typing import Tuple
+from app.models.models import Document, IngestionJob
 from app.models.schemas import DocumentCreate
 from fastapi import HTTPException, UploadFile
 import logging
@@ -10,43 +9,35 @@ import logging
 logger = logging.getLogger(__name__)
 from app.core.config import settings
 
-from app.services.embedding_service import create_document_chunks
-from app.services.summary_service import update_document_summary
-from ..utils.document_utils import extract_text_from_pdf
+from app.crud.crud_vector import invalidate_subject_answers
+from app.services.ingestion_service import create_ingestion_job, enqueue_ingestion_job
+from app.utils.content_hash import store_content_addressed
 
 
 
-def save_document(db: Session,pdf_file: UploadFile,document: DocumentCreate):
+def save_document(db: Session,pdf_file: UploadFile,document: DocumentCreate) -> Tuple[Document, IngestionJob]:
     """
-    Guarda el documento en PostgreSQL.
+    Guarda el PDF y el documento en PostgreSQL y encola su ingesta (extracción,
+    división en chunks y embeddings), que se realiza en segundo plano.
     """
    
     if not pdf_file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF.")
 
-    os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
-
-    subfolder_path = os.path.join(settings.UPLOAD_FOLDER, str(document.user_id))
-
-    os.makedirs(subfolder_path, exist_ok=True)
-    
-    # Generamos un nombre único para el archivo
-    file_name, file_ext = os.path.splitext(pdf_file.filename)
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    unique_id = str(uuid.uuid4())[:8]
-    unique_file_name = f"{file_name}_{timestamp}_{unique_id}{file_ext}"
-    
-    file_path = os.path.join(subfolder_path, unique_file_name)
-    
-    with open(file_path, "wb") as buffer:
-        buffer.write(pdf_file.file.read())
-    
+    # Almacenamiento direccionado por contenido: el mismo PDF subido varias veces
+    # (p. ej. a varias asignaturas) se guarda una sola vez
+    file_path, content_hash, reused_file = store_content_addressed(
+        pdf_file.file, os.path.join(settings.UPLOAD_FOLDER, "documents")
+    )
+    if reused_file:
+        logger.info(f"PDF ya almacenado con hash {content_hash[:12]}; se reutiliza el fichero")
     
     topic_id = None if document.topic_id == 0 else document.topic_id
     
     new_document = Document(
         title=document.title,
         file_path=file_path,
+        content_hash=content_hash,
         description=document.description,
         user_id=document.user_id,
         subject_id=document.subject_id,  # Campo obligatorio
@@ -57,23 +48,17 @@ def save_document(db: Session,pdf_file: UploadFile,document: DocumentCreate):
     db.commit()
     db.refresh(new_document)
     
-    content = extract_text_from_pdf(pdf_file)
-
-    if not content:
-        raise HTTPException(status_code=400, detail="No se pudo extraer texto del PDF.")
-    
-    create_document_chunks(db, new_document.id, content)
-    
-    # Generar resumen del documento después de procesar los chunks
+    # La extracción, los chunks, los embeddings y el resumen se hacen en el trabajo de ingesta
+    job = create_ingestion_job(db, new_document.id)
     try:
-        import asyncio
-        asyncio.create_task(update_document_summary(new_document.id, db))
-        logger.info(f"Resumen generado para el documento {new_document.id}")
+        enqueue_ingestion_job(job.id)
     except Exception as e:
-        logger.warning(f"Error al generar resumen para documento {new_document.id}: {e}")
-        
+        # El documento ya está guardado: el trabajo sigue en cola en la BD y se
+        # reanuda en el siguiente arranque o al reintentarlo
+        logger.error(f"No se pudo enviar el trabajo de ingesta {job.id} al pool: {e}")
+    logger.info(f"Documento {new_document.id} guardado; trabajo de ingesta {job.id} en cola")
         
-    return new_document
+    return new_document, job
 
 def list_documents(db: Session, document_id: int):
     """
@@ -157,8 +142,12 @@ def delete_document(db: Session, document_id: int, user_id: int = None, is_admin
         if document.user_id != user_id:
             raise HTTPException(status_code=403, detail="No tienes permiso para eliminar este documento.")
     
-    # Eliminar el archivo físico si existe
-    if document.file_path and os.path.exists(document.file_path):
+    # Eliminar el archivo físico si existe y ningún otro documento lo comparte
+    shared_file = db.query(Document.id).filter(
+        Document.file_path == document.file_path,
+        Document.id != document.id
+    ).first() is not None
+    if document.file_path and not shared_file and os.path.exists(document.file_path):
         try:
             os.remove(document.file_path)
         except OSError as e:
@@ -167,6 +156,8 @@ def delete_document(db: Session, document_id: int, user_id: int = None, is_admin
     
     # Eliminar el documento de la base de datos (los chunks se eliminarán automáticamente por cascade)
     db.delete(document)
+    # Las respuestas en caché de la asignatura pueden citar este documento
+    invalidate_subject_answers(db, document.subject_id)
     db.commit()
     
     return {"id": document_id}
@@ -0,0 +1,85 @@
+"""
+Backends de inferencia de embeddings - Capa base
+Cada backend carga el modelo de embeddings de una forma distinta y devuelve un objeto
+con la interfaz de SentenceTransformer (encode, get_sentence_embedding_dimension), así
+que el resto del código no depende de cuál se use. Se elige con settings.EMBEDDING_BACKEND.
+
+- torch: SentenceTransformer en PyTorch, en GPU si la hay (comportamiento original).
+- torch-int8: cuantización dinámica int8 de las capas lineales, en CPU. No necesita
+  dependencias adicionales.
+- onnx: ONNX Runtime en CPU. Requiere optimum[onnxruntime]; si el repositorio del modelo
+  no trae el fichero ONNX se exporta al cargarlo.
+- onnx-int8: ONNX Runtime con el modelo cuantizado int8 publicado en el repositorio del
+  modelo (settings.EMBEDDING_ONNX_FILE elige la variante, p. ej. avx2 o avx512_vnni).
+"""
+from typing import Callable, Dict, Optional
+import logging
+
+import torch
+from sentence_transformers import SentenceTransformer
+
+from app.core.config import settings
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_ONNX_INT8_FILE = "onnx/model_qint8_avx2.onnx"
+
+
+def _load_torch(model_name: str) -> SentenceTransformer:
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    logger.info(f"Cargando modelo SentenceTransformer: {model_name} en dispositivo: {device}")
+    return SentenceTransformer(model_name, device=device)
+
+
+def _load_torch_int8(model_name: str) -> SentenceTransformer:
+    logger.info(f"Cargando modelo SentenceTransformer: {model_name} cuantizado a int8 en CPU")
+    model = SentenceTransformer(model_name, device="cpu")
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _load_onnx_file(model_name: str, file_name: str) -> SentenceTransformer:
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if file_name:
+        model_kwargs["file_name"] = file_name
+    logger.info(f"Cargando modelo ONNX: {model_name} ({file_name or 'onnx/model.onnx'}) en CPU")
+    return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+
+def _load_onnx(model_name: str) -> SentenceTransformer:
+    return _load_onnx_file(model_name, settings.EMBEDDING_ONNX_FILE)
+
+
+def _load_onnx_int8(model_name: str) -> SentenceTransformer:
+    return _load_onnx_file(model_name, settings.EMBEDDING_ONNX_FILE or DEFAULT_ONNX_INT8_FILE)
+
+
+EMBEDDING_BACKENDS: Dict[str, Callable[[str], SentenceTransformer]] = {
+    "torch": _load_torch,
+    "torch-int8": _load_torch_int8,
+    "onnx": _load_onnx,
+    "onnx-int8": _load_onnx_int8
+}
+
+
+def load_embedding_model(model_name: str, backend: Optional[str] = None) -> SentenceTransformer:
+    """
+    Carga model_name con el backend indicado (por defecto settings.EMBEDDING_BACKEND).
+    Si el backend no es el de PyTorch y falla al cargar (p. ej. falta onnxruntime), se
+    usa PyTorch para no dejar sin embeddings a las consultas.
+    """
+    backend = backend or settings.EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend de embeddings desconocido: {backend}. Opciones: {', '.join(EMBEDDING_BACKENDS)}")
+
+    try:
+        model = EMBEDDING_BACKENDS[backend](model_name)
+    except Exception as e:
+        if backend == "torch":
+            logger.error(f"Error al cargar el modelo SentenceTransformer {model_name}: {e}", exc_info=True)
+            raise
+        logger.error(f"No se pudo cargar {model_name} con el backend '{backend}'; se usa 'torch': {e}")
+        return load_embedding_model(model_name, "torch")
+
+    logger.info(f"Modelo de embeddings {model_name} cargado con el backend '{backend}'")
+    return model
@@ -1,20 +1,37 @@
-from typing import List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from sentence_transformers import SentenceTransformer
-import torch
 import logging
 from llama_index.core.node_parser import SentenceSplitter  # Importamos SentenceSplitter
 from llama_index.core import Document
 from sqlalchemy.orm import Session
-from ..models.models import DocumentChunk
+from app.core.database import SessionLocal
+from app.crud.crud_vector import (
+    bulk_insert_document_chunks,
+    get_active_embedding_model_name,
+    get_chunk_embeddings_by_hash,
+    lock_document_chunks_for_insert
+)
+from app.core.config import settings
+from app.core.executors import run_in_embedding_executor, run_in_io_executor
+from app.services.embedding_backends import load_embedding_model
+from app.utils.content_hash import chunk_content_hash
+from app.utils.embedding_batcher import EmbeddingBatcher
+from app.utils.embedding_cache import EmbeddingCache, normalize_text
 import nltk  # Importamos nltk
 import numpy as np
+import asyncio
+import threading
+import time
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Instancia global del modelo (singleton)
+# Instancia global del modelo activo (singleton) y modelos adicionales cargados para re-embedding
 sentence_transformer_model_instance = None
+sentence_transformer_model_instance_name: Optional[str] = None
+_extra_model_instances: Dict[str, SentenceTransformer] = {}
+_model_lock = threading.Lock()
 # Modelos por dimensiones:
 # all-MiniLM-L6-v2: 384 dimensiones (eficiente, más rápido)
 # all-mpnet-base-v2: 768 dimensiones (balance)
@@ -22,64 +39,198 @@ sentence_transformer_model_instance = None
 # text-embedding-ada-002: 1536 dimensiones (alta precisión)
 # e5-large-v2: 1024 dimensiones (reciente, alta precisión)
 
-EMBEDDING_MODEL_NAME = 'all-mpnet-base-v2'  # Usar modelo de mejor calidad
-def load_sentence_transformer_model_singleton(model_name: str = EMBEDDING_MODEL_NAME):
+# Modelo inicial; el activo puede cambiar tras un trabajo de re-embedding (ver get_active_embedding_model)
+EMBEDDING_MODEL_NAME = settings.EMBEDDING_MODEL_NAME
+
+# Modelo activo leído de la BD: (nombre, instante de la lectura)
+_active_model: Tuple[Optional[str], float] = (None, 0.0)
+
+# Modos para obtener los embeddings de los chunks (ver embed_chunks)
+CHUNK_EMBEDDING_MODES = ("pooled", "auto", "reencode")
+
+# Caché de embeddings de consultas: evita recodificar la misma pregunta
+# (por ejemplo, en add_user_message y get_conversation_context del mismo turno)
+query_embedding_cache = EmbeddingCache(
+    max_bytes=settings.EMBEDDING_CACHE_MAX_BYTES,
+    ttl_seconds=settings.EMBEDDING_CACHE_TTL_SECONDS,
+    disk_dir=settings.EMBEDDING_CACHE_DIR or None
+) if settings.EMBEDDING_CACHE_ENABLED else None
+
+# Caché de embeddings de oraciones de documentos: una versión corregida de un PDF ya
+# indexado solo codifica las oraciones que han cambiado
+sentence_embedding_cache = EmbeddingCache(
+    max_bytes=settings.SENTENCE_EMBEDDING_CACHE_MAX_BYTES,
+    ttl_seconds=settings.SENTENCE_EMBEDDING_CACHE_TTL_SECONDS,
+    disk_dir=settings.SENTENCE_EMBEDDING_CACHE_DIR or None
+) if settings.SENTENCE_EMBEDDING_CACHE_MAX_BYTES > 0 else None
+
+def get_active_embedding_model(refresh: bool = False) -> str:
+    """
+    Devuelve el modelo con el que están codificados los chunks indexados. Se lee de la BD
+    (último trabajo de re-embedding completado) como mucho cada
+    settings.EMBEDDING_MODEL_REFRESH_SECONDS; si no se puede leer se usa EMBEDDING_MODEL_NAME.
+    """
+    global _active_model
+    name, read_at = _active_model
+    if not refresh and name is not None and time.monotonic() - read_at < settings.EMBEDDING_MODEL_REFRESH_SECONDS:
+        return name
+
+    db = SessionLocal()
+    try:
+        name = get_active_embedding_model_name(db) or EMBEDDING_MODEL_NAME
+    except Exception as e:
+        logger.warning(f"No se pudo leer el modelo de embeddings activo; se usa {EMBEDDING_MODEL_NAME}: {e}")
+        name = EMBEDDING_MODEL_NAME
+    finally:
+        db.close()
+    _active_model = (name, time.monotonic())
+    return name
+
+def _load_model(model_name: str) -> SentenceTransformer:
+    # El backend de inferencia (PyTorch, int8, ONNX) se elige con settings.EMBEDDING_BACKEND
+    return load_embedding_model(model_name)
+
+def load_sentence_transformer_model_singleton(model_name: Optional[str] = None):
     """
     Carga el modelo SentenceTransformer como un singleton para evitar 
-    múltiples cargas del mismo modelo.
-    """
-    global sentence_transformer_model_instance
-    if sentence_transformer_model_instance is None:
-        try:
-            device = 'cuda' if torch.cuda.is_available() else 'cpu'
-            logger.info(f"Cargando modelo SentenceTransformer: {model_name} en dispositivo: {device} para codificación de chunks.")
-            sentence_transformer_model_instance = SentenceTransformer(model_name, device=device)
-            logger.info("Modelo SentenceTransformer cargado exitosamente para codificación.")
-        except Exception as e:
-            logger.error(f"Error al cargar el modelo SentenceTransformer {model_name}: {e}", exc_info=True)
-            raise
-    return sentence_transformer_model_instance
-
-def get_embedding_for_query(text: str) -> List[float]:
+    múltiples cargas del mismo modelo. Sin model_name se usa el modelo activo; si el
+    modelo activo cambia, el singleton se sustituye por el nuevo.
+    """
+    global sentence_transformer_model_instance, sentence_transformer_model_instance_name
+    active_name = get_active_embedding_model()
+    model_name = model_name or active_name
+    with _model_lock:
+        if model_name != active_name:
+            # Otro modelo (p. ej. el destino de un re-embedding): se carga aparte
+            if model_name not in _extra_model_instances:
+                _extra_model_instances[model_name] = _load_model(model_name)
+            return _extra_model_instances[model_name]
+
+        if sentence_transformer_model_instance is None or sentence_transformer_model_instance_name != model_name:
+            sentence_transformer_model_instance = (
+                _extra_model_instances.pop(model_name, None) or _load_model(model_name)
+            )
+            sentence_transformer_model_instance_name = model_name
+        return sentence_transformer_model_instance
+
+def _encode_query_batch(model_name: str, texts: List[str]) -> np.ndarray:
+    """
+    Codifica un lote de consultas en una sola pasada del modelo.
+    """
+    model = load_sentence_transformer_model_singleton(model_name)
+    logger.info(f"Codificando lote de {len(texts)} consultas con {model_name}")
+    return model.encode(texts, batch_size=len(texts))
+
+# Agrupador de consultas concurrentes: un hilo codifica juntas las preguntas que llegan
+# dentro de la ventana EMBEDDING_BATCH_MAX_WAIT_MS
+query_embedding_batcher = EmbeddingBatcher(
+    _encode_query_batch,
+    max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+    max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS
+) if settings.EMBEDDING_BATCHING_ENABLED else None
+
+def _lookup_query_embedding(text: str, use_cache: bool) -> Tuple[str, str, Optional[str], Optional[np.ndarray]]:
+    """
+    Normaliza la consulta y la busca en la caché.
+
+    Returns:
+        (texto normalizado, modelo activo, clave de caché o None, embedding en caché o None)
+    """
+    processed_text = normalize_text(text)
+    model_name = get_active_embedding_model()
+    cache_key = None
+    if use_cache and query_embedding_cache is not None:
+        cache_key = query_embedding_cache.make_key(model_name, processed_text)
+        cached_embedding = query_embedding_cache.get(cache_key)
+        if cached_embedding is not None:
+            logger.info(f"Embedding de consulta obtenido de la caché: '{text[:50]}...'")
+            return processed_text, model_name, cache_key, cached_embedding
+    return processed_text, model_name, cache_key, None
+
+def _finish_query_embedding(embedding: np.ndarray, cache_key: Optional[str]) -> List[float]:
+    if cache_key is not None:
+        query_embedding_cache.put(cache_key, embedding)
+
+    # Verificar dimensiones del embedding
+    embedding_list = embedding.tolist()
+    logger.info(f"Embedding generado correctamente: dimensión={len(embedding_list)}")
+    return embedding_list
+
+def get_embedding_for_query(text: str, use_cache: bool = True, use_batcher: bool = True) -> List[float]:
     """
     Genera un embedding para un texto dado utilizando el modelo SentenceTransformer.
+    Con use_cache=False no se consulta ni se rellena la caché de consultas
+    (por ejemplo, para respuestas del bot que no se van a repetir).
+    Si el agrupador está activo, la consulta se codifica junto a las demás que lleguen a la vez.
+    Con use_batcher=False se codifica aparte: los textos largos (p. ej. respuestas del bot)
+    no deben entrar en el lote de las preguntas, que se rellenan hasta el más largo.
     """
     if not text or text.strip() == "":
         logger.warning("Se solicitó embedding para texto vacío")
         return []
     
     try:
-        model = load_sentence_transformer_model_singleton()
-        logger.info(f"Generando embedding para consulta: '{text[:50]}...' (longitud: {len(text)})")
-        
-        # Procesar el texto para mejorar resultados
-        processed_text = text.strip()
+        processed_text, model_name, cache_key, cached_embedding = _lookup_query_embedding(text, use_cache)
+        if cached_embedding is not None:
+            return cached_embedding.tolist()
         
-        # Generar embedding
-        embedding = model.encode(processed_text)
-        
-        # Verificar dimensiones del embedding
-        embedding_list = embedding.tolist()
-        embedding_dim = len(embedding_list)
-        logger.info(f"Embedding generado correctamente: dimensión={embedding_dim}")
+        logger.info(f"Generando embedding para consulta: '{text[:50]}...' (longitud: {len(text)})")
+        if use_batcher and query_embedding_batcher is not None:
+            embedding = query_embedding_batcher.submit(model_name, processed_text).result()
+        else:
+            embedding = load_sentence_transformer_model_singleton(model_name).encode(processed_text)
         
-        return embedding_list
+        return _finish_query_embedding(embedding, cache_key)
     except Exception as e:
         logger.error(f"Error al generar embedding para consulta: {e}")
         return []
 
-def semantic_split_text(
-    text: str,
-    model: SentenceTransformer,
-    similarity_threshold: float = 0.7,
-    max_chunk_length: int = 512,
-) -> List[str]:
+async def get_embedding_for_query_async(text: str, use_cache: bool = True) -> List[float]:
     """
-    Divide semánticamente un texto en chunks más pequeños usando similitud de embeddings.
+    Versión asíncrona de get_embedding_for_query: espera el lote del agrupador sin ocupar
+    un hilo, de modo que todas las peticiones concurrentes caben en el mismo lote. Sin
+    agrupador, la codificación se hace en el pool de embeddings del chat. La búsqueda en la
+    caché va al pool de E/S: puede leer el modelo activo de la BD o la caché en disco.
     """
-    if not text or len(text.strip()) == 0:
+    if query_embedding_batcher is None:
+        return await run_in_embedding_executor(get_embedding_for_query, text, use_cache)
+    if not text or text.strip() == "":
+        logger.warning("Se solicitó embedding para texto vacío")
         return []
 
+    try:
+        processed_text, model_name, cache_key, cached_embedding = await run_in_io_executor(
+            _lookup_query_embedding, text, use_cache
+        )
+        if cached_embedding is not None:
+            return cached_embedding.tolist()
+
+        logger.info(f"Generando embedding para consulta: '{text[:50]}...' (longitud: {len(text)})")
+        embedding = await asyncio.wrap_future(query_embedding_batcher.submit(model_name, processed_text))
+        return _finish_query_embedding(embedding, cache_key)
+    except Exception as e:
+        logger.error(f"Error al generar embedding para consulta: {e}")
+        return []
+
+def shutdown_query_embedding_batcher(wait: bool = True) -> None:
+    """
+    Detiene el agrupador de consultas tras codificar las pendientes.
+    """
+    if query_embedding_batcher is not None:
+        query_embedding_batcher.close(wait=wait)
+
+def get_query_embedding_cache_stats() -> dict:
+    """
+    Devuelve los contadores de la caché de embeddings de consultas y del agrupador.
+    """
+    stats = {"enabled": False} if query_embedding_cache is None else {"enabled": True, **query_embedding_cache.stats()}
+    stats["batching"] = (
+        {"enabled": True, **query_embedding_batcher.stats()} if query_embedding_batcher is not None
+        else {"enabled": False}
+    )
+    return stats
+
+def _split_sentences(text: str) -> List[str]:
     try:
         nltk.data.find("tokenizers/punkt")
         nltk.data.find("tokenizers/punkt_tab/english/")
@@ -87,73 +238,438 @@ def semantic_split_text(
         nltk.download("punkt")
         nltk.download("punkt_tab")
 
-    sentences = nltk.tokenize.sent_tokenize(text)  # Usamos nltk para dividir en oraciones
-    embeddings = model.encode(sentences)
+    return nltk.tokenize.sent_tokenize(text)  # Usamos nltk para dividir en oraciones
 
-    chunks = []
-    current_chunk = ""
-    current_chunk_len = 0
+def adjacent_similarities(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Similitud coseno entre cada oración y la siguiente, calculada de una vez:
+    se normaliza la matriz y se multiplican fila a fila los pares consecutivos.
 
-    for i, sentence in enumerate(sentences):
-        if current_chunk_len + len(sentence) <= max_chunk_length:
-            if current_chunk:
-                similarity = np.dot(embeddings[i - 1], embeddings[i]) / (
-                    np.linalg.norm(embeddings[i - 1]) * np.linalg.norm(embeddings[i])
-                )
-                if similarity >= similarity_threshold:
-                    current_chunk += " " + sentence
-                    current_chunk_len += len(sentence)
-                else:
-                    chunks.append(current_chunk)
-                    current_chunk = sentence
-                    current_chunk_len = len(sentence)
-            else:
-                current_chunk = sentence
-                current_chunk_len = len(sentence)
+    Returns:
+        Array de longitud len(embeddings) - 1
+    """
+    if len(embeddings) < 2:
+        return np.empty(0, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit_embeddings = embeddings / np.maximum(norms, 1e-12)
+    return np.einsum("ij,ij->i", unit_embeddings[:-1], unit_embeddings[1:])
+
+def _group_sentences(
+    sentences: List[str],
+    similarities: np.ndarray,
+    similarity_threshold: float,
+    max_chunk_length: int
+) -> List[Tuple[int, int]]:
+    """
+    Agrupa oraciones consecutivas en chunks a partir de las similitudes ya calculadas.
+    Devuelve los rangos [inicio, fin) de oraciones de cada chunk.
+    """
+    # Los cortes semánticos se deciden de una vez; el bucle solo lleva la longitud acumulada
+    breaks = (similarities < similarity_threshold).tolist()
+    lengths = [len(sentence) for sentence in sentences]
+    groups = []
+    start = 0
+    current_chunk_len = lengths[0] if lengths else 0
+
+    for i in range(1, len(sentences)):
+        if breaks[i - 1] or current_chunk_len + lengths[i] > max_chunk_length:
+            groups.append((start, i))
+            start = i
+            current_chunk_len = lengths[i]
         else:
-            chunks.append(current_chunk)
-            current_chunk = sentence
-            current_chunk_len = len(sentence)
+            current_chunk_len += lengths[i]
+
+    if sentences:
+        groups.append((start, len(sentences)))
+
+    return groups
+
+def encode_sentences(
+    model: SentenceTransformer,
+    sentences: List[str],
+    model_name: Optional[str] = None
+) -> Tuple[np.ndarray, int]:
+    """
+    Codifica oraciones pasando solo por el modelo las que no están en la caché de oraciones
+    (las claves incluyen el nombre del modelo, por defecto el activo).
+
+    Returns:
+        (embeddings de las oraciones, número de oraciones codificadas con el modelo)
+    """
+    if sentence_embedding_cache is None:
+        return np.asarray(model.encode(sentences), dtype=np.float32), len(sentences)
+
+    model_name = model_name or get_active_embedding_model()
+    keys = [sentence_embedding_cache.make_key(model_name, sentence) for sentence in sentences]
+    embeddings = [sentence_embedding_cache.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        encoded = np.asarray(model.encode([sentences[i] for i in missing]), dtype=np.float32)
+        for i, embedding in zip(missing, encoded):
+            sentence_embedding_cache.put(keys[i], embedding)
+            embeddings[i] = embedding
+    return np.vstack(embeddings).astype(np.float32), len(missing)
 
-    if current_chunk:
-        chunks.append(current_chunk)
+def _split_threshold(
+    similarities: np.ndarray,
+    similarity_threshold: float,
+    breakpoint_percentile_threshold: Optional[float] = None
+) -> float:
+    percentile = breakpoint_percentile_threshold
+    if percentile is None:
+        percentile = settings.CHUNK_BREAKPOINT_PERCENTILE
+    if percentile is not None and len(similarities) > 0:
+        # distancia > percentil p  <=>  similitud < percentil (100 - p)
+        return float(np.percentile(similarities, 100 - percentile))
+    return similarity_threshold
 
+def semantic_split_sentences(
+    text: str,
+    model: SentenceTransformer,
+    similarity_threshold: float = 0.7,
+    max_chunk_length: int = 512,
+    breakpoint_percentile_threshold: Optional[float] = None,
+) -> Tuple[List[str], List[Tuple[int, int]], np.ndarray, List[str]]:
+    """
+    Divide semánticamente un texto y conserva lo calculado por el camino.
+
+    Si hay percentil de corte (argumento o settings.CHUNK_BREAKPOINT_PERCENTILE), el umbral
+    no es fijo: se corta donde la distancia entre oraciones consecutivas supera ese
+    percentil de las distancias del documento, como breakpoint_percentile_threshold
+    de llama_index.
+
+    Returns:
+        (chunks, rangos [inicio, fin) de oraciones por chunk, embeddings de las oraciones, oraciones)
+    """
+    if not text or len(text.strip()) == 0:
+        return [], [], np.empty((0, 0), dtype=np.float32), []
+
+    sentences = _split_sentences(text)
+    embeddings = np.asarray(model.encode(sentences), dtype=np.float32)
+    similarities = adjacent_similarities(embeddings)
+
+    threshold = _split_threshold(similarities, similarity_threshold, breakpoint_percentile_threshold)
+    groups = _group_sentences(sentences, similarities, threshold, max_chunk_length)
+    chunks = [" ".join(sentences[start:end]) for start, end in groups]
+    return chunks, groups, embeddings, sentences
+
+def semantic_split_text(
+    text: str,
+    model: SentenceTransformer,
+    similarity_threshold: float = 0.7,
+    max_chunk_length: int = 512,
+) -> List[str]:
+    """
+    Divide semánticamente un texto en chunks más pequeños usando similitud de embeddings.
+    """
+    chunks, _, _, _ = semantic_split_sentences(text, model, similarity_threshold, max_chunk_length)
     return chunks
 
-def create_document_chunks(db: Session, document_id: int, text: str) -> List[DocumentChunk]:
+def pool_chunk_embeddings(
+    groups: List[Tuple[int, int]],
+    sentence_embeddings: np.ndarray,
+    sentence_lengths: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula el embedding de cada chunk como la media de los embeddings de sus oraciones
+    ponderada por la longitud de cada oración, sin volver a pasar el texto por el modelo.
+
+    Returns:
+        (embeddings de los chunks, coherencia de cada chunk). La coherencia es la norma
+        de la media ponderada de las oraciones normalizadas: 1.0 si todas apuntan en la
+        misma dirección (o el chunk tiene una sola oración) y menor cuanto más dispersas.
+    """
+    norms = np.linalg.norm(sentence_embeddings, axis=1, keepdims=True)
+    unit_embeddings = sentence_embeddings / np.maximum(norms, 1e-12)
+    weights = np.maximum(np.asarray(sentence_lengths, dtype=np.float32), 1.0)
+
+    # reduceat sobre [inicio0, fin0, inicio1, fin1, ...] con una fila de relleno al final:
+    # las posiciones pares suman cada rango aunque los grupos no sean contiguos
+    bounds = np.asarray(groups, dtype=np.intp).ravel()
+    weighted = np.vstack([unit_embeddings * weights[:, None], np.zeros((1, unit_embeddings.shape[1]))])
+    weighted_sums = np.add.reduceat(weighted, bounds, axis=0)[::2]
+    weight_totals = np.add.reduceat(np.append(weights, 0.0), bounds)[::2]
+    pooled = weighted_sums / weight_totals[:, None]
+
+    coherence = np.linalg.norm(pooled, axis=1)
+    # Misma escala que los embeddings del modelo (normalizados o no) para que l2 y
+    # producto interno sigan siendo comparables con los de las consultas
+    scale = float(np.mean(norms)) if norms.size else 1.0
+    chunk_embeddings = pooled / np.maximum(coherence, 1e-12)[:, None] * scale
+    return chunk_embeddings.astype(np.float32), coherence
+
+def embed_chunks(
+    model: SentenceTransformer,
+    chunks: List[str],
+    groups: List[Tuple[int, int]],
+    sentence_embeddings: np.ndarray,
+    sentences: List[str],
+    mode: Optional[str] = None,
+    min_coherence: Optional[float] = None
+) -> Tuple[np.ndarray, int]:
+    """
+    Obtiene los embeddings de los chunks según settings.CHUNK_EMBEDDING_MODE:
+
+    - "reencode": codifica de nuevo el texto de cada chunk con el modelo.
+    - "pooled": media ponderada de los embeddings de oraciones ya calculados al dividir.
+    - "auto": como "pooled", pero recodifica los chunks cuya coherencia es menor que
+      settings.CHUNK_REENCODE_MIN_COHERENCE (oraciones poco relacionadas entre sí).
+
+    Returns:
+        (embeddings de los chunks, número de chunks recodificados con el modelo)
+    """
+    mode = mode or settings.CHUNK_EMBEDDING_MODE
+    if mode not in CHUNK_EMBEDDING_MODES:
+        raise ValueError(f"Modo de embeddings de chunks no soportado: {mode}")
+
+    if mode == "reencode":
+        return np.asarray(model.encode(chunks), dtype=np.float32), len(chunks)
+
+    sentence_lengths = np.array([len(sentence) for sentence in sentences])
+    embeddings, coherence = pool_chunk_embeddings(groups, sentence_embeddings, sentence_lengths)
+    if mode == "pooled":
+        return embeddings, 0
+
+    threshold = settings.CHUNK_REENCODE_MIN_COHERENCE if min_coherence is None else min_coherence
+    low_coherence = np.flatnonzero(coherence < threshold)
+    if low_coherence.size:
+        embeddings[low_coherence] = model.encode([chunks[i] for i in low_coherence])
+    return embeddings, int(low_coherence.size)
+
+def _lock_for_insert(
+    db: Session,
+    model_name: str,
+    chunks: List[str],
+    content_hashes: List[str],
+    embeddings: np.ndarray
+) -> Tuple[np.ndarray, str]:
+    """
+    Bloquea document_chunks para inserciones y vuelve a leer el modelo activo con el
+    bloqueo tomado (ver lock_document_chunks_for_insert). Si un re-embedding activó otro
+    modelo mientras se dividía y codificaba el documento, recodifica los chunks con el
+    nuevo, reutilizando los embeddings que ya estén guardados con él.
+
+    Returns:
+        (embeddings de los chunks, modelo con el que están codificados)
+    """
+    lock_document_chunks_for_insert(db)
+    active_name = get_active_embedding_model(refresh=True)
+    if active_name == model_name:
+        return embeddings, model_name
+
+    logger.info(f"El modelo activo cambió de {model_name} a {active_name} durante la ingesta; se recodifican los chunks")
+    stored = get_chunk_embeddings_by_hash(db, content_hashes, active_name)
+    missing = [i for i, content_hash in enumerate(content_hashes) if content_hash not in stored]
+    reencoded = {}
+    if missing:
+        model = load_sentence_transformer_model_singleton(active_name)
+        reencoded = dict(zip(missing, np.asarray(model.encode([chunks[i] for i in missing]), dtype=np.float32)))
+    rows = [reencoded[i] if i in reencoded else stored[content_hash] for i, content_hash in enumerate(content_hashes)]
+    return np.vstack(rows).astype(np.float32), active_name
+
+def create_document_chunks(
+    db: Session,
+    document_id: int,
+    text: str,
+    on_stage: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
     """
     Divide el texto de un documento en chunks semánticos, genera embeddings para cada uno
-    y los almacena en la base de datos.
+    y los almacena en la base de datos con una única carga masiva (COPY binario).
+    Si se indica on_stage, se llama con "chunking" y "embedding" al empezar cada etapa.
+
+    Returns:
+        Métricas de la ingesta del documento (chunks, tiempos y rendimiento de la carga)
     """
     if not text:
-        return []
+        return {"document_id": document_id, "chunks": 0}
 
-    # Cargar el modelo *una vez* al inicio (o usar el singleton)
-    model = load_sentence_transformer_model_singleton()
+    # La tabla se bloquea para inserciones después de codificar (ver _lock_for_insert)
+    model_name = get_active_embedding_model(refresh=True)
+    model = load_sentence_transformer_model_singleton(model_name)
 
     # Dividir el texto en chunks semánticos
-    chunks = semantic_split_text(text, model)
+    if on_stage:
+        on_stage("chunking")
+    start = time.perf_counter()
+    chunks, groups, sentence_embeddings, sentences = semantic_split_sentences(text, model)
+    split_seconds = time.perf_counter() - start
 
     if not chunks:
         logger.warning(f"No se pudieron crear chunks para el documento {document_id}")
-        return []
+        return {"document_id": document_id, "chunks": 0}
 
-  
-    embeddings = model.encode(chunks)  
-    print(f"Chunks: {embeddings}")
-    db_chunks = []
-    for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings)):
-        chunk = DocumentChunk(
-            document_id=document_id,
-            content=chunk_text,
-            embedding=embedding.tolist(),
-            chunk_number=i,
-        )
-        db_chunks.append(chunk)
+    if on_stage:
+        on_stage("embedding")
+    start = time.perf_counter()
+    embeddings, reencoded = embed_chunks(model, chunks, groups, sentence_embeddings, sentences)
+    encode_seconds = time.perf_counter() - start
 
     # Guardar en la base de datos
-    db.add_all(db_chunks)
-    db.flush()
+    content_hashes = [chunk_content_hash(chunk) for chunk in chunks]
+    embeddings, model_name = _lock_for_insert(db, model_name, chunks, content_hashes, embeddings)
+    stats = bulk_insert_document_chunks(
+        db, document_id, chunks, embeddings, content_hashes=content_hashes, embedding_model=model_name
+    )
+    db.commit()
+
+    stats["split_seconds"] = round(split_seconds, 4)
+    stats["encode_seconds"] = round(encode_seconds, 4)
+    stats["embedding_mode"] = settings.CHUNK_EMBEDDING_MODE
+    stats["reencoded_chunks"] = reencoded
+    logger.info(
+        f"Guardados {stats['chunks']} chunks para el documento {document_id} "
+        f"({stats['method']}, {stats['bytes']} bytes en {stats['seconds']}s, "
+        f"{stats['chunks_per_second']} chunks/s; división {stats['split_seconds']}s, "
+        f"codificación {stats['encode_seconds']}s, modo {stats['embedding_mode']}, "
+        f"{stats['reencoded_chunks']} chunks recodificados)"
+    )
+    return stats
+
+def create_document_chunks_from_pages(
+    db: Session,
+    document_id: int,
+    pages: Iterable[Tuple[int, str]],
+    on_stage: Optional[Callable[[str], None]] = None,
+    similarity_threshold: float = 0.7,
+    max_chunk_length: int = 512
+) -> Dict[str, Any]:
+    """
+    Versión en streaming de create_document_chunks: consume (número de página, texto)
+    según se extraen y divide y codifica los chunks en ventanas de
+    settings.CHUNK_STREAM_SENTENCES oraciones, sin esperar al final de la extracción.
+    Cada chunk guarda la página en la que empieza.
+
+    El último chunk de cada ventana puede continuar en la siguiente, así que se arrastra
+    (con sus embeddings) y no se emite hasta ver la ventana siguiente. Con percentil de
+    corte, el percentil se calcula por ventana.
+
+    Solo se codifica lo que ha cambiado respecto a lo ya indexado: las oraciones pasan por
+    la caché de oraciones y los chunks cuyo texto (por hash) ya existe en la BD reutilizan
+    su embedding.
+
+    Los chunks se cargan de una vez al final: solo entonces se bloquea document_chunks
+    para inserciones y se vuelve a leer el modelo activo (ver _lock_for_insert), así el
+    bloqueo no dura la división y la codificación y un re-embedding no puede activar otro
+    modelo antes del commit.
+
+    Returns:
+        Métricas de la ingesta del documento (chunks, páginas, tiempos y rendimiento de la carga)
+    """
+    model_name = get_active_embedding_model(refresh=True)
+    model = load_sentence_transformer_model_singleton(model_name)
+    window_size = max(settings.CHUNK_STREAM_SENTENCES, 1)
+
+    sentences: List[str] = []
+    sentence_pages: List[int] = []
+    embeddings = np.empty((0, 0), dtype=np.float32)
+    stats = {
+        "document_id": document_id, "chunks": 0, "pages": 0, "bytes": 0,
+        "encoded_sentences": 0, "reused_chunks": 0, "reencoded_chunks": 0
+    }
+    timings = {"split_seconds": 0.0, "encode_seconds": 0.0}
+    # Chunks ya codificados, pendientes de cargar
+    ready_chunks: List[str] = []
+    ready_pages: List[int] = []
+    ready_hashes: List[str] = []
+    ready_embeddings: List[np.ndarray] = []
+
+    def process_window(final: bool) -> None:
+        nonlocal sentences, sentence_pages, embeddings
+        if not sentences:
+            return
+
+        started = time.perf_counter()
+        # Solo se codifican las oraciones nuevas; las arrastradas ya tienen embedding
+        if len(sentences) > len(embeddings):
+            new_embeddings, encoded = encode_sentences(model, sentences[len(embeddings):], model_name)
+            stats["encoded_sentences"] += encoded
+            embeddings = new_embeddings if len(embeddings) == 0 else np.vstack([embeddings, new_embeddings])
+        similarities = adjacent_similarities(embeddings)
+        threshold = _split_threshold(similarities, similarity_threshold)
+        groups = _group_sentences(sentences, similarities, threshold, max_chunk_length)
+        timings["split_seconds"] += time.perf_counter() - started
+
+        ready = groups if final else groups[:-1]
+        if ready:
+            if stats["chunks"] == 0 and on_stage:
+                on_stage("embedding")
+            end = ready[-1][1]
+            chunks = [" ".join(sentences[first:last]) for first, last in ready]
+
+            started = time.perf_counter()
+            content_hashes = [chunk_content_hash(chunk) for chunk in chunks]
+            stored = get_chunk_embeddings_by_hash(db, content_hashes, model_name)
+            missing = [i for i, content_hash in enumerate(content_hashes) if content_hash not in stored]
+            chunk_embeddings = np.empty((len(chunks), embeddings.shape[1]), dtype=np.float32)
+            for i, content_hash in enumerate(content_hashes):
+                if content_hash in stored:
+                    chunk_embeddings[i] = stored[content_hash]
+            reencoded = 0
+            if missing:
+                chunk_embeddings[missing], reencoded = embed_chunks(
+                    model, [chunks[i] for i in missing], [ready[i] for i in missing],
+                    embeddings[:end], sentences[:end]
+                )
+            stats["reused_chunks"] += len(chunks) - len(missing)
+            timings["encode_seconds"] += time.perf_counter() - started
+
+            ready_chunks.extend(chunks)
+            ready_pages.extend(sentence_pages[first] for first, _ in ready)
+            ready_hashes.extend(content_hashes)
+            ready_embeddings.append(chunk_embeddings)
+            stats["chunks"] += len(chunks)
+            stats["reencoded_chunks"] += reencoded
+
+            sentences, sentence_pages = sentences[end:], sentence_pages[end:]
+            embeddings = embeddings[end:]
+
+    for page_number, page_text in pages:
+        page_sentences = _split_sentences(page_text)
+        if not page_sentences:
+            continue
+        if stats["pages"] == 0 and on_stage:
+            on_stage("chunking")
+        stats["pages"] += 1
+        sentences.extend(page_sentences)
+        sentence_pages.extend([page_number] * len(page_sentences))
+        if len(sentences) >= window_size:
+            process_window(final=False)
+    process_window(final=True)
+
+    if stats["chunks"] == 0:
+        logger.warning(f"No se pudieron crear chunks para el documento {document_id}")
+        return stats
+
+    chunk_embeddings, model_name = _lock_for_insert(
+        db, model_name, ready_chunks, ready_hashes, np.vstack(ready_embeddings)
+    )
+    load_stats = bulk_insert_document_chunks(
+        db, document_id, ready_chunks, chunk_embeddings,
+        page_numbers=ready_pages,
+        content_hashes=ready_hashes,
+        embedding_model=model_name
+    )
     db.commit()
-    logger.info(f"Guardados {len(db_chunks)} chunks para el documento {document_id}")
-    return db_chunks
\ No newline at end of file
+
+    seconds = load_stats["seconds"]
+    stats.update({
+        "bytes": load_stats["bytes"],
+        "method": load_stats["method"],
+        "seconds": round(seconds, 4),
+        "chunks_per_second": round(stats["chunks"] / seconds, 1) if seconds else None,
+        "mb_per_second": round(stats["bytes"] / seconds / (1024 * 1024), 2) if seconds else None,
+        "split_seconds": round(timings["split_seconds"], 4),
+        "encode_seconds": round(timings["encode_seconds"], 4),
+        "embedding_mode": settings.CHUNK_EMBEDDING_MODE,
+        "embedding_model": model_name
+    })
+    logger.info(
+        f"Guardados {stats['chunks']} chunks de {stats['pages']} páginas para el documento {document_id} "
+        f"({stats['method']}, {stats['bytes']} bytes en {stats['seconds']}s, "
+        f"{stats['chunks_per_second']} chunks/s; división {stats['split_seconds']}s, "
+        f"codificación {stats['encode_seconds']}s, modo {stats['embedding_mode']}, "
+        f"{stats['encoded_sentences']} oraciones codificadas, {stats['reused_chunks']} chunks reutilizados, "
+        f"{stats['reencoded_chunks']} chunks recodificados)"
+    )
+    return stats
@@ -0,0 +1,373 @@
+"""
+Servicio de Ingesta de Documentos - Capa intermedia
+Procesa los PDFs subidos fuera del ciclo petición/respuesta. Cada documento tiene un
+trabajo persistente (tabla ingestion_jobs) que recorre los estados
+queued → extracting → chunking → embedding → indexed, o termina en failed tras agotar
+los reintentos. Los trabajos se ejecutan en un pool de procesos para repartir la
+extracción y la codificación entre varios núcleos.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import multiprocessing
+import threading
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.crud.crud_vector import clone_document_chunks, find_indexed_duplicate, invalidate_subject_answers
+from app.models.models import Document, DocumentChunk, IngestionJob
+from app.services.embedding_service import create_document_chunks_from_pages
+from app.services.summary_service import update_document_summary
+from app.utils.pdf_utils import iter_pdf_pages
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+INGESTION_STATES = ("queued", "extracting", "chunking", "embedding", "indexed", "failed")
+ACTIVE_STATES = ("extracting", "chunking", "embedding")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # "spawn" evita heredar el estado de torch, hilos y conexiones del proceso web
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.INGESTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor) -> None:
+    """
+    Descarta un pool roto (un proceso murió, p. ej. por falta de memoria), que ya no
+    acepta trabajos; el siguiente envío crea uno nuevo.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not executor:
+            # Otro hilo ya lo sustituyó
+            return
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+    logger.warning("Pool de ingesta roto: se creará uno nuevo")
+
+
+# --- Ejecución del trabajo (dentro de un proceso del pool) ---
+
+def _set_job_status(job_id: int, status: str, **fields: Any) -> None:
+    """
+    Actualiza el estado de un trabajo con una sesión propia, para que el progreso sea
+    visible aunque la transacción de la carga de chunks siga abierta.
+    """
+    db = SessionLocal()
+    try:
+        db.query(IngestionJob).filter(IngestionJob.id == job_id).update(
+            {IngestionJob.status: status, **{getattr(IngestionJob, key): value for key, value in fields.items()}},
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _claim_job(db: Session, job_id: int) -> Optional[IngestionJob]:
+    """
+    Marca el trabajo como en curso solo si sigue en cola, de modo que un mismo trabajo
+    encolado dos veces (p. ej. por varios workers web al arrancar) se procese una sola vez.
+    """
+    claimed = db.query(IngestionJob).filter(
+        IngestionJob.id == job_id,
+        IngestionJob.status == "queued"
+    ).update(
+        {
+            IngestionJob.status: "extracting",
+            IngestionJob.attempts: IngestionJob.attempts + 1,
+            IngestionJob.started_at: func.now(),
+            IngestionJob.finished_at: None
+        },
+        synchronize_session=False
+    )
+    db.commit()
+    if not claimed:
+        return None
+    return db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+
+
+def _invalidate_answer_cache(subject_id: Optional[int]) -> None:
+    """
+    Invalida las respuestas en caché de la asignatura: ya pueden citar el documento nuevo.
+    """
+    db = SessionLocal()
+    try:
+        invalidate_subject_answers(db, subject_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Error al invalidar la caché de respuestas de la asignatura {subject_id}: {e}")
+    finally:
+        db.close()
+
+
+def _generate_summary(document_id: int) -> None:
+    db = SessionLocal()
+    try:
+        asyncio.run(update_document_summary(document_id, db))
+    except Exception as e:
+        logger.warning(f"Error al generar resumen para documento {document_id}: {e}")
+    finally:
+        db.close()
+
+
+def _clone_duplicate(db: Session, document: Document, source_id: int) -> Dict[str, Any]:
+    """
+    Indexa un PDF idéntico a otro ya indexado copiando sus chunks y su resumen, sin
+    extraer texto ni calcular embeddings.
+    """
+    chunk_count = clone_document_chunks(db, source_id, document.id)
+    if not document.summary:
+        document.summary = db.query(Document.summary).filter(Document.id == source_id).scalar()
+    db.commit()
+    logger.info(f"Documento {document.id} idéntico al documento {source_id}: {chunk_count} chunks copiados")
+    return {"document_id": document.id, "chunks": chunk_count, "method": "clone", "source_document_id": source_id}
+
+
+def run_ingestion_job(job_id: int) -> Dict[str, Any]:
+    """
+    Procesa un trabajo de ingesta: extrae el texto del PDF página a página y, en paralelo,
+    lo divide, genera los embeddings y carga los chunks. Se ejecuta en un proceso del
+    pool de ingesta.
+
+    Returns:
+        {"status": estado final, "attempts": intentos realizados}. El estado es
+        "queued" si el trabajo falló pero se reintentará, y "skipped" si no estaba en cola.
+    """
+    db = SessionLocal()
+    try:
+        job = _claim_job(db, job_id)
+        if job is None:
+            logger.info(f"Trabajo de ingesta {job_id} omitido: ya no está en cola")
+            return {"status": "skipped", "attempts": 0}
+        attempts, max_attempts, document_id = job.attempts, job.max_attempts, job.document_id
+
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document or not document.file_path:
+                raise ValueError(f"Documento {document_id} no encontrado o sin fichero")
+
+            # Un reintento reemplaza los chunks de un intento anterior en la misma transacción
+            db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete(
+                synchronize_session=False
+            )
+            source_id = find_indexed_duplicate(db, document_id, document.content_hash)
+            if source_id is not None:
+                stats = _clone_duplicate(db, document, source_id)
+            else:
+                stats = create_document_chunks_from_pages(
+                    db, document_id, iter_pdf_pages(document.file_path),
+                    on_stage=lambda stage: _set_job_status(job_id, stage)
+                )
+                if not stats.get("pages"):
+                    raise ValueError("No se pudo extraer texto del PDF.")
+            has_summary, subject_id = bool(document.summary), document.subject_id
+        except Exception as e:
+            db.rollback()
+            status = "queued" if attempts < max_attempts else "failed"
+            logger.error(f"Error en el trabajo de ingesta {job_id} (intento {attempts}/{max_attempts}): {e}")
+            _set_job_status(
+                job_id, status,
+                error=f"{type(e).__name__}: {e}"[:2000],
+                finished_at=func.now() if status == "failed" else None
+            )
+            return {"status": status, "attempts": attempts}
+    finally:
+        db.close()
+
+    _set_job_status(job_id, "indexed", chunk_count=stats.get("chunks", 0), error=None, finished_at=func.now())
+    logger.info(f"Trabajo de ingesta {job_id} completado: documento {document_id} indexado")
+    _invalidate_answer_cache(subject_id)
+
+    # El resumen no bloquea la indexación: el documento ya es consultable
+    if not has_summary:
+        _generate_summary(document_id)
+    return {"status": "indexed", "attempts": attempts}
+
+
+# --- Cola de trabajos (proceso web) ---
+
+def _recover_crashed_job(job_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve a la cola un trabajo cuyo proceso murió a mitad (el intento ya se contó al
+    reclamarlo), o lo marca como fallido si agotó los intentos. Un trabajo que aún no se
+    había reclamado sigue en cola sin cambios.
+
+    Returns:
+        Estado e intentos del trabajo, o None si ya no está pendiente
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None or job.status not in ("queued",) + ACTIVE_STATES:
+            return None
+        if job.status in ACTIVE_STATES:
+            job.status = "queued" if job.attempts < job.max_attempts else "failed"
+            job.error = "El proceso de ingesta terminó de forma anómala (p. ej. por falta de memoria)"
+            if job.status == "failed":
+                job.finished_at = func.now()
+            db.commit()
+        return {"status": job.status, "attempts": job.attempts}
+    finally:
+        db.close()
+
+
+def _on_job_done(job_id: int, future: Future, executor: Optional[ProcessPoolExecutor] = None) -> None:
+    try:
+        result = future.result()
+    except BrokenProcessPool as e:
+        # Un proceso del pool murió: el pool queda inservible y se sustituye, y el
+        # trabajo vuelve a la cola contando el intento
+        logger.error(f"El trabajo de ingesta {job_id} terminó de forma anómala: {e}")
+        if executor is not None:
+            _discard_executor(executor)
+        result = _recover_crashed_job(job_id)
+        if result is None:
+            return
+    except Exception as e:
+        # No se pudo completar el trabajo: queda en la BD y se recupera al arrancar
+        # como trabajo abandonado
+        logger.error(f"El trabajo de ingesta {job_id} terminó de forma anómala: {e}")
+        return
+
+    if result["status"] == "queued":
+        delay = settings.INGESTION_RETRY_BACKOFF_SECONDS * 2 ** max(result["attempts"] - 1, 0)
+        logger.info(f"Reintentando el trabajo de ingesta {job_id} en {delay}s")
+        enqueue_ingestion_job(job_id, delay_seconds=delay)
+
+
+def _enqueue_later(job_id: int) -> None:
+    try:
+        enqueue_ingestion_job(job_id)
+    except Exception as e:
+        # Sigue en cola en la BD y se reanuda en el siguiente arranque
+        logger.error(f"No se pudo reencolar el trabajo de ingesta {job_id}: {e}")
+
+
+def enqueue_ingestion_job(job_id: int, delay_seconds: float = 0) -> None:
+    """
+    Envía un trabajo en cola al pool de procesos de ingesta, opcionalmente tras una espera.
+    Si el pool está roto se sustituye por uno nuevo antes de enviarlo.
+    """
+    if delay_seconds > 0:
+        timer = threading.Timer(delay_seconds, _enqueue_later, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+        return
+
+    executor = _get_executor()
+    try:
+        future = executor.submit(run_ingestion_job, job_id)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        executor = _get_executor()
+        future = executor.submit(run_ingestion_job, job_id)
+    future.add_done_callback(partial(_on_job_done, job_id, executor=executor))
+
+
+def create_ingestion_job(db: Session, document_id: int) -> IngestionJob:
+    """
+    Crea el trabajo de ingesta de un documento en estado 'queued'.
+    """
+    job = IngestionJob(
+        document_id=document_id,
+        status="queued",
+        attempts=0,
+        max_attempts=settings.INGESTION_MAX_ATTEMPTS
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_latest_ingestion_job(db: Session, document_id: int) -> Optional[IngestionJob]:
+    """
+    Obtiene el último trabajo de ingesta de un documento.
+    """
+    return db.query(IngestionJob).filter(
+        IngestionJob.document_id == document_id
+    ).order_by(IngestionJob.id.desc()).first()
+
+
+def retry_ingestion_job(db: Session, document_id: int) -> IngestionJob:
+    """
+    Vuelve a encolar el último trabajo de ingesta fallido de un documento.
+    """
+    job = get_latest_ingestion_job(db, document_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="El documento no tiene trabajos de ingesta")
+    if job.status != "failed":
+        raise HTTPException(status_code=400, detail="Solo se pueden reintentar trabajos fallidos")
+
+    job.status = "queued"
+    job.attempts = 0
+    job.error = None
+    job.finished_at = None
+    db.commit()
+    db.refresh(job)
+
+    enqueue_ingestion_job(job.id)
+    return job
+
+
+def resume_ingestion_jobs() -> List[int]:
+    """
+    Vuelve a encolar al arrancar los trabajos pendientes y los abandonados en curso
+    (sin actualizar durante INGESTION_STALE_SECONDS, p. ej. tras un reinicio).
+
+    Returns:
+        IDs de los trabajos encolados
+    """
+    db = SessionLocal()
+    try:
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=settings.INGESTION_STALE_SECONDS)
+        db.query(IngestionJob).filter(
+            IngestionJob.status.in_(ACTIVE_STATES),
+            IngestionJob.updated_at < stale_before
+        ).update({IngestionJob.status: "queued"}, synchronize_session=False)
+        db.commit()
+
+        job_ids = [job_id for (job_id,) in db.query(IngestionJob.id).filter(
+            IngestionJob.status == "queued"
+        ).order_by(IngestionJob.id).all()]
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        enqueue_ingestion_job(job_id)
+    if job_ids:
+        logger.info(f"Reanudados {len(job_ids)} trabajos de ingesta pendientes")
+    return job_ids
+
+
+def shutdown_ingestion_workers() -> None:
+    """
+    Detiene el pool de ingesta. Los trabajos aún no iniciados siguen en cola en la BD
+    y se reanudan en el siguiente arranque.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,345 @@
+"""
+Proveedores de LLM - Capa base
+Cada proveedor genera texto a partir del contenido del prompt (texto e imagen opcional)
+con la misma interfaz, así que api_service no depende de cuál se use. Se elige con
+settings.LLM_PROVIDER.
+
+- gemini: Google AI Studio (google.generativeai) con settings.GOOGLE_AI_MODEL_NAME.
+- fake: proveedor local y determinista, sin red ni clave de API. Devuelve un texto que
+  depende solo del prompt y simula la latencia de un modelo (tiempo hasta el primer token,
+  que crece con el tamaño del prompt, y tokens por segundo) según un perfil. Sirve para
+  pruebas de carga de todo el flujo del chat sin depender del proveedor real.
+"""
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+import asyncio
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+
+import google.generativeai as genai
+
+from app.core.config import settings
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+Contents = Union[str, List[Any]]
+
+
+class LLMProvider(ABC):
+    """
+    Interfaz de los proveedores. timeout es el tiempo máximo del intento en segundos (lo
+    fija la pasarela del LLM). instructions_key indica que las instrucciones fijas ya se
+    registraron con use_instructions y no van en contents. Un proveedor que no implemente
+    generate, generate_async y open_stream no se puede instanciar.
+    """
+
+    name = "base"
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def use_instructions(self, key: str, instructions: str) -> bool:
+        """
+        Prepara el proveedor para enviar por su cuenta las instrucciones fijas identificadas
+        por key. Devuelve False si no lo admite y hay que incluirlas en el prompt.
+        """
+        return False
+
+    @abstractmethod
+    def generate(self, contents: Contents, timeout: float, instructions_key: Optional[str] = None) -> str:
+        """Genera la respuesta completa."""
+
+    @abstractmethod
+    async def generate_async(self, contents: Contents, timeout: float, instructions_key: Optional[str] = None) -> str:
+        """Variante asíncrona de generate."""
+
+    @abstractmethod
+    async def open_stream(
+        self, contents: Contents, timeout: float, instructions_key: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Inicia la generación en streaming y devuelve un iterador asíncrono de fragmentos de texto."""
+
+
+def _response_text(response: Any) -> str:
+    # response.text lanza ValueError si la respuesta no tiene partes de texto
+    # (p. ej. bloqueada por los filtros de seguridad)
+    try:
+        return response.text or ""
+    except ValueError:
+        return ""
+
+
+# Reintentos de la creación de clientes con instrucciones fijas: espera base y máxima
+_INSTRUCTIONS_RETRY_SECONDS = 30
+_INSTRUCTIONS_RETRY_MAX_SECONDS = 600
+
+
+def _start_background(target: Callable[..., None], *args: Any) -> None:
+    threading.Thread(target=target, args=args, daemon=True).start()
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Google AI Studio. Con GOOGLE_AI_SYSTEM_INSTRUCTION las instrucciones fijas de cada
+    plantilla van como system_instruction de un cliente propio y, si además
+    GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS > 0, se guardan en la caché de contexto de Gemini.
+    La caché se crea (y se renueva antes de caducar) en un hilo aparte, sin bloquear las
+    peticiones: mientras no está lista, o si su creación falla, se envían en el prompt y la
+    creación se reintenta con espera exponencial.
+    """
+
+    name = "gemini"
+
+    def __init__(self, client: Any = None, model_name: Optional[str] = None):
+        self.model_name = model_name or settings.GOOGLE_AI_MODEL_NAME
+        self.client = client if client is not None else self._create_client()
+        # Clientes con instrucciones fijas: clave -> (cliente, instante en que caduca su
+        # caché de contexto o None)
+        self._instruction_clients: Dict[str, Tuple[Any, Optional[float]]] = {}
+        # Claves en creación y, tras un fallo, (fallos seguidos, instante del siguiente intento)
+        self._creating: set = set()
+        self._retries: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def _create_client(self) -> Any:
+        if not settings.GOOGLE_AI_API_KEY:
+            logger.error("FATAL ERROR: GOOGLE_AI_API_KEY no configurada. Cliente Google AI no disponible.")
+            return None
+        try:
+            logger.info("Configurando Google AI Studio client")
+            genai.configure(api_key=settings.GOOGLE_AI_API_KEY)
+            client = genai.GenerativeModel(self.model_name)
+            logger.info("Google AI Studio client configurado exitosamente")
+            return client
+        except Exception as e:
+            logger.error(f"Error configurando Google AI Studio client: {type(e).__name__} - {e}")
+            return None
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    def _instructions_ready(self, key: str, now: float) -> bool:
+        entry = self._instruction_clients.get(key)
+        return entry is not None and (entry[1] is None or now < entry[1])
+
+    def use_instructions(self, key: str, instructions: str) -> bool:
+        if not settings.GOOGLE_AI_SYSTEM_INSTRUCTION:
+            return False
+
+        ttl = settings.GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS
+        now = time.monotonic()
+        with self._lock:
+            entry = self._instruction_clients.get(key)
+            # La caché de contexto se renueva cuando le queda el 10% de su vida
+            stale = entry is None or (entry[1] is not None and now >= entry[1] - ttl * 0.1)
+            start = stale and key not in self._creating and now >= self._retries.get(key, (0, 0.0))[1]
+            if start:
+                self._creating.add(key)
+
+        if start:
+            if ttl > 0:
+                # Llamada de red: fuera de la petición
+                _start_background(self._create_instructions_client, key, instructions, ttl)
+            else:
+                # Sin caché de contexto el cliente se crea en local, sin llamadas de red
+                self._create_instructions_client(key, instructions, ttl)
+        return self._instructions_ready(key, time.monotonic())
+
+    def _create_instructions_client(self, key: str, instructions: str, ttl: int) -> None:
+        started = time.monotonic()
+        try:
+            if ttl > 0:
+                cached_content = genai.caching.CachedContent.create(
+                    model=self.model_name,
+                    display_name=f"tutor-{key}",
+                    system_instruction=instructions,
+                    ttl=timedelta(seconds=ttl)
+                )
+                client = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+                # Caduca en el proveedor ttl segundos después de crearse
+                expires_at = started + ttl
+                logger.info(f"Instrucciones de la plantilla '{key}' guardadas en la caché de contexto")
+            else:
+                client = genai.GenerativeModel(self.model_name, system_instruction=instructions)
+                expires_at = None
+        except Exception as e:
+            with self._lock:
+                failures = self._retries.get(key, (0, 0.0))[0] + 1
+                delay = min(_INSTRUCTIONS_RETRY_SECONDS * 2 ** (failures - 1), _INSTRUCTIONS_RETRY_MAX_SECONDS)
+                self._retries[key] = (failures, time.monotonic() + delay)
+                self._creating.discard(key)
+            logger.error(
+                f"No se pudo crear el cliente con instrucciones de sistema para la plantilla '{key}'; "
+                f"se envía el prompt completo y se reintentará en {delay}s: {type(e).__name__} - {e}"
+            )
+            return
+
+        with self._lock:
+            self._instruction_clients[key] = (client, expires_at)
+            self._retries.pop(key, None)
+            self._creating.discard(key)
+
+    def _client_for(self, instructions_key: Optional[str]) -> Any:
+        if instructions_key is not None:
+            entry = self._instruction_clients.get(instructions_key)
+            if entry is not None and entry[0] is not None:
+                return entry[0]
+        return self.client
+
+    def generate(self, contents: Contents, timeout: float, instructions_key: Optional[str] = None) -> str:
+        response = self._client_for(instructions_key).generate_content(
+            contents, request_options={"timeout": timeout}
+        )
+        return _response_text(response)
+
+    async def generate_async(self, contents: Contents, timeout: float, instructions_key: Optional[str] = None) -> str:
+        response = await self._client_for(instructions_key).generate_content_async(
+            contents, request_options={"timeout": timeout}
+        )
+        return _response_text(response)
+
+    async def open_stream(
+        self, contents: Contents, timeout: float, instructions_key: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        response = await self._client_for(instructions_key).generate_content_async(
+            contents, stream=True, request_options={"timeout": timeout}
+        )
+
+        async def texts() -> AsyncIterator[str]:
+            async for chunk in response:
+                # Los fragmentos sin partes de texto (p. ej. solo metadatos de seguridad) se omiten
+                text = _response_text(chunk)
+                if text:
+                    yield text
+
+        return texts()
+
+
+class LatencyProfile(NamedTuple):
+    """
+    Latencia simulada: tiempo hasta el primer token (más prefill_ms_per_1k_tokens por cada
+    1000 tokens del prompt) y velocidad de generación (0 = sin límite).
+    """
+    time_to_first_token_ms: float
+    tokens_per_second: float
+    prefill_ms_per_1k_tokens: float = 0.0
+
+
+FAKE_LATENCY_PROFILES: Dict[str, LatencyProfile] = {
+    "instant": LatencyProfile(0, 0),
+    "flash": LatencyProfile(350, 180, 40),
+    "gemma": LatencyProfile(700, 60, 90),
+    "slow": LatencyProfile(2000, 25, 150)
+}
+
+_WORD = re.compile(r"[^\W\d_]{4,}")
+_FALLBACK_WORDS = ["tutor", "respuesta", "asignatura", "concepto", "ejemplo", "material"]
+# Tokens por fragmento del stream simulado
+_STREAM_CHUNK_TOKENS = 8
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Proveedor local determinista: el mismo prompt produce siempre el mismo texto de
+    output_tokens palabras (un token por palabra) y la misma latencia. Las palabras salen
+    del propio prompt. Si la latencia simulada supera el timeout, espera el timeout y
+    lanza TimeoutError, como un proveedor real que no responde a tiempo.
+    """
+
+    name = "fake"
+
+    def __init__(self, profile: Union[str, LatencyProfile] = "flash", output_tokens: int = 200):
+        if isinstance(profile, str):
+            if profile not in FAKE_LATENCY_PROFILES:
+                raise ValueError(
+                    f"Perfil de latencia desconocido: {profile}. Opciones: {', '.join(FAKE_LATENCY_PROFILES)}"
+                )
+            profile = FAKE_LATENCY_PROFILES[profile]
+        self.profile = profile
+        self.output_tokens = max(1, output_tokens)
+
+    @classmethod
+    def from_settings(cls) -> "FakeLLMProvider":
+        return cls(settings.LLM_FAKE_PROFILE, settings.LLM_FAKE_OUTPUT_TOKENS)
+
+    @staticmethod
+    def _prompt_text(contents: Contents) -> str:
+        if isinstance(contents, str):
+            return contents
+        return "\n".join(part for part in contents if isinstance(part, str))
+
+    def _words(self, prompt: str) -> List[str]:
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        vocabulary = _WORD.findall(prompt[-4000:]) or _FALLBACK_WORDS
+        return ["Respuesta", "simulada:"] + [rng.choice(vocabulary) for _ in range(self.output_tokens - 2)]
+
+    def first_token_seconds(self, prompt: str) -> float:
+        """Tiempo hasta el primer token para prompt (tokens del prompt estimados a 4 caracteres)."""
+        prompt_tokens = len(prompt) / 4
+        return (self.profile.time_to_first_token_ms + self.profile.prefill_ms_per_1k_tokens * prompt_tokens / 1000) / 1000
+
+    def _generation_seconds(self, tokens: int) -> float:
+        return tokens / self.profile.tokens_per_second if self.profile.tokens_per_second > 0 else 0.0
+
+    def latency_seconds(self, prompt: str) -> float:
+        """Latencia total simulada para prompt."""
+        return self.first_token_seconds(prompt) + self._generation_seconds(self.output_tokens)
+
+    def generate(self, contents: Contents, timeout: float, instructions_key: Optional[str] = None) -> str:
+        prompt = self._prompt_text(contents)
+        latency = self.latency_seconds(prompt)
+        time.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError(f"El proveedor simulado tarda {latency:.2f}s (timeout {timeout:.2f}s)")
+        return " ".join(self._words(prompt))
+
+    async def generate_async(self, contents: Contents, timeout: float, instructions_key: Optional[str] = None) -> str:
+        prompt = self._prompt_text(contents)
+        latency = self.latency_seconds(prompt)
+        await asyncio.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError(f"El proveedor simulado tarda {latency:.2f}s (timeout {timeout:.2f}s)")
+        return " ".join(self._words(prompt))
+
+    async def open_stream(
+        self, contents: Contents, timeout: float, instructions_key: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        prompt = self._prompt_text(contents)
+        first_token = self.first_token_seconds(prompt)
+        await asyncio.sleep(min(first_token, timeout))
+        if first_token > timeout:
+            raise TimeoutError(f"El proveedor simulado tarda {first_token:.2f}s en empezar (timeout {timeout:.2f}s)")
+        words = self._words(prompt)
+
+        async def texts() -> AsyncIterator[str]:
+            for start in range(0, len(words), _STREAM_CHUNK_TOKENS):
+                chunk = words[start:start + _STREAM_CHUNK_TOKENS]
+                if start:
+                    await asyncio.sleep(self._generation_seconds(len(chunk)))
+                yield (" " if start else "") + " ".join(chunk)
+
+        return texts()
+
+
+LLM_PROVIDERS: Dict[str, Callable[[], LLMProvider]] = {
+    "gemini": GeminiProvider,
+    "fake": FakeLLMProvider.from_settings
+}
+
+
+def load_llm_provider(name: Optional[str] = None) -> LLMProvider:
+    """Crea el proveedor indicado (por defecto settings.LLM_PROVIDER)."""
+    name = name or settings.LLM_PROVIDER
+    if name not in LLM_PROVIDERS:
+        raise ValueError(f"Proveedor de LLM desconocido: {name}. Opciones: {', '.join(LLM_PROVIDERS)}")
+    provider = LLM_PROVIDERS[name]()
+    logger.info(f"Proveedor de LLM: {provider.name}")
+    return provider
@@ -0,0 +1,433 @@
+"""
+Servicio de Re-embedding - Capa intermedia
+Cambia el modelo de embeddings de los chunks sin borrarlos. Un trabajo persistente
+(tabla reembedding_jobs) recodifica los chunks por lotes en una tabla auxiliar
+(chunk_reembeddings) y, cuando están todos, vuelca los vectores nuevos en
+document_chunks y activa el modelo en una sola transacción. Hasta entonces la búsqueda
+sigue usando los vectores y el modelo anteriores.
+
+Tras el volcado, cada proceso web sigue codificando las preguntas con el modelo anterior
+hasta refrescar el modelo activo (como mucho EMBEDDING_MODEL_REFRESH_SECONDS). Por eso el
+volcado intercambia los vectores: los del modelo anterior quedan en chunk_reembeddings y
+la búsqueda recurre a ellos cuando no hay chunks del modelo de la pregunta. Se borran
+pasado REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS. El proceso que lanzó el trabajo
+cambia de modelo en cuanto termina.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, List, Optional
+import logging
+import multiprocessing
+import threading
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import func, insert, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.crud.crud_vector import delete_previous_embeddings, get_active_embedding_model_name
+from app.models.models import ChunkReembedding, DocumentChunk, ReembeddingJob
+from app.services.embedding_service import (
+    EMBEDDING_MODEL_NAME,
+    get_active_embedding_model,
+    load_sentence_transformer_model_singleton
+)
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+REEMBEDDING_STATES = ("queued", "running", "swapped", "failed", "cancelled")
+ACTIVE_STATES = ("queued", "running")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Un solo proceso: los trabajos de re-embedding se ejecutan de uno en uno
+            _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+# --- Ejecución del trabajo (dentro del proceso de re-embedding) ---
+
+def _claim_job(db: Session, job_id: int) -> Optional[ReembeddingJob]:
+    """
+    Marca el trabajo como en curso solo si sigue en cola (ver ingestion_service._claim_job).
+    """
+    claimed = db.query(ReembeddingJob).filter(
+        ReembeddingJob.id == job_id,
+        ReembeddingJob.status == "queued"
+    ).update(
+        {
+            ReembeddingJob.status: "running",
+            ReembeddingJob.started_at: func.coalesce(ReembeddingJob.started_at, func.now())
+        },
+        synchronize_session=False
+    )
+    db.commit()
+    if not claimed:
+        return None
+    return db.query(ReembeddingJob).filter(ReembeddingJob.id == job_id).first()
+
+
+def _pending_chunks_query(db: Session, job: ReembeddingJob):
+    return db.query(DocumentChunk.id, DocumentChunk.content).filter(
+        DocumentChunk.id > job.last_chunk_id,
+        DocumentChunk.embedding_model.is_distinct_from(job.target_model)
+    ).order_by(DocumentChunk.id)
+
+
+def _embed_next_batch(db: Session, job: ReembeddingJob, model) -> int:
+    """
+    Recodifica el siguiente lote de chunks pendientes y lo guarda en chunk_reembeddings,
+    avanzando el cursor del trabajo. No hace commit.
+
+    Returns:
+        Número de chunks del lote (0 si no quedan)
+    """
+    rows = _pending_chunks_query(db, job).limit(settings.REEMBEDDING_BATCH_SIZE).all()
+    if not rows:
+        return 0
+
+    embeddings = np.asarray(model.encode([row.content for row in rows]), dtype=np.float32)
+    dimensions = DocumentChunk.__table__.c.embedding.type.dimensions
+    if embeddings.shape[1] != dimensions:
+        raise ValueError(
+            f"El modelo {job.target_model} genera vectores de {embeddings.shape[1]} dimensiones "
+            f"y la columna de embeddings es de {dimensions}; hace falta una migración"
+        )
+
+    db.execute(
+        insert(ChunkReembedding.__table__),
+        [
+            {"job_id": job.id, "chunk_id": row.id, "embedding": embedding}
+            for row, embedding in zip(rows, embeddings)
+        ]
+    )
+    job.last_chunk_id = rows[-1].id
+    job.processed_chunks += len(rows)
+    return len(rows)
+
+
+def _swap_embeddings(db: Session, job: ReembeddingJob, model) -> None:
+    """
+    Vuelca los embeddings nuevos en document_chunks y activa el modelo en una transacción.
+    El bloqueo impide insertar chunks mientras tanto (las búsquedas siguen funcionando) y
+    los chunks añadidos desde el último lote se recodifican antes del volcado.
+
+    Los vectores del modelo que estaba activo no se pierden: se intercambian con los nuevos
+    en chunk_reembeddings, donde la búsqueda los usa durante el periodo de gracia. Los de
+    chunks codificados con otros modelos (que la búsqueda ya no usaba) se descartan.
+
+    El UPDATE recorre todo el corpus y mantiene los índices vectoriales, así que la
+    transacción va sin statement_timeout (igual que la construcción de índices en
+    vector_index_service); la espera por el bloqueo se limita con lock_timeout.
+    """
+    db.execute(text("SET LOCAL statement_timeout = 0"))
+    db.execute(text(f"SET LOCAL lock_timeout = {int(settings.REEMBEDDING_SWAP_LOCK_TIMEOUT_MS)}"))
+    db.execute(text("LOCK TABLE document_chunks IN SHARE ROW EXCLUSIVE MODE"))
+    while _embed_next_batch(db, job, model):
+        pass
+
+    previous_model = get_active_embedding_model_name(db) or EMBEDDING_MODEL_NAME
+    params = {"model": job.target_model, "previous_model": previous_model, "job_id": job.id}
+    # Chunks de otros modelos: se vuelcan y se descarta su fila auxiliar
+    db.execute(
+        text(
+            "UPDATE document_chunks AS c SET embedding = r.embedding, embedding_model = :model "
+            "FROM chunk_reembeddings AS r WHERE r.chunk_id = c.id AND r.job_id = :job_id "
+            "AND c.embedding_model IS DISTINCT FROM :previous_model"
+        ),
+        params
+    )
+    db.execute(
+        text(
+            "DELETE FROM chunk_reembeddings AS r USING document_chunks AS c "
+            "WHERE r.chunk_id = c.id AND r.job_id = :job_id AND c.embedding_model = :model"
+        ),
+        params
+    )
+    # Chunks del modelo activo: el vector nuevo pasa a document_chunks y el anterior a
+    # chunk_reembeddings (el alias "old" lee la fila antes de la actualización)
+    db.execute(
+        text(
+            "WITH swapped AS ("
+            "UPDATE document_chunks AS c SET embedding = r.embedding, embedding_model = :model "
+            "FROM chunk_reembeddings AS r JOIN document_chunks AS old ON old.id = r.chunk_id "
+            "WHERE r.chunk_id = c.id AND r.job_id = :job_id "
+            "RETURNING c.id, old.embedding) "
+            "UPDATE chunk_reembeddings AS r SET embedding = swapped.embedding "
+            "FROM swapped WHERE r.chunk_id = swapped.id AND r.job_id = :job_id"
+        ),
+        params
+    )
+    # Solo se conservan los vectores del último cambio de modelo
+    delete_previous_embeddings(db)
+    job.previous_model = previous_model
+    job.status = "swapped"
+    job.finished_at = func.now()
+    db.commit()
+
+
+def discard_previous_embeddings(job_id: Optional[int] = None) -> int:
+    """
+    Borra los vectores del modelo anterior que conserva el trabajo job_id, o los de todos
+    los trabajos volcados hace más de REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS.
+
+    Returns:
+        Número de vectores borrados
+    """
+    db = SessionLocal()
+    try:
+        if job_id is not None:
+            deleted = delete_previous_embeddings(db, job_id=job_id)
+        else:
+            deleted = delete_previous_embeddings(db, finished_before=datetime.now(timezone.utc) - timedelta(
+                seconds=settings.REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS
+            ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"No se pudieron borrar los vectores del modelo anterior: {e}")
+        return 0
+    finally:
+        db.close()
+    if deleted:
+        logger.info(f"Borrados {deleted} vectores del modelo anterior tras el periodo de gracia")
+    return deleted
+
+
+def run_reembedding_job(job_id: int) -> Dict[str, Any]:
+    """
+    Procesa un trabajo de re-embedding: recodifica los chunks por lotes (confirmando cada
+    lote, así se reanuda donde se quedó) y al terminar activa el nuevo modelo. Si el
+    volcado falla en la BD (p. ej. lock_timeout mientras se ingesta un PDF grande) el
+    trabajo vuelve a la cola con sus lotes; cualquier otro error lo deja en failed y
+    descarta los embeddings ya calculados.
+
+    Returns:
+        {"status": estado final, "processed_chunks": chunks recodificados}
+    """
+    db = SessionLocal()
+    try:
+        job = _claim_job(db, job_id)
+        if job is None:
+            logger.info(f"Trabajo de re-embedding {job_id} omitido: ya no está en cola")
+            return {"status": "skipped", "processed_chunks": 0}
+
+        swapping = False
+        try:
+            model = load_sentence_transformer_model_singleton(job.target_model)
+            if job.total_chunks is None:
+                job.total_chunks = _pending_chunks_query(db, job).count()
+                db.commit()
+
+            while True:
+                db.refresh(job)
+                if job.status != "running":
+                    # Cancelado mientras se procesaba: se descarta también el último lote
+                    db.query(ChunkReembedding).filter(ChunkReembedding.job_id == job_id).delete(
+                        synchronize_session=False
+                    )
+                    db.commit()
+                    logger.info(f"Trabajo de re-embedding {job_id} detenido: estado '{job.status}'")
+                    return {"status": job.status, "processed_chunks": job.processed_chunks}
+                if not _embed_next_batch(db, job, model):
+                    break
+                db.commit()
+                logger.info(f"Re-embedding {job_id}: {job.processed_chunks}/{job.total_chunks} chunks")
+
+            swapping = True
+            _swap_embeddings(db, job, model)
+        except Exception as e:
+            db.rollback()
+            if swapping and isinstance(e, OperationalError):
+                logger.warning(f"No se pudo completar el volcado del re-embedding {job_id}; se reintentará: {e}")
+                db.query(ReembeddingJob).filter(
+                    ReembeddingJob.id == job_id,
+                    ReembeddingJob.status == "running"
+                ).update(
+                    {
+                        ReembeddingJob.status: "queued",
+                        ReembeddingJob.error: f"{type(e).__name__}: {e}"[:2000]
+                    },
+                    synchronize_session=False
+                )
+                db.commit()
+                return {"status": "queued", "processed_chunks": job.processed_chunks}
+
+            logger.error(f"Error en el trabajo de re-embedding {job_id}: {e}")
+            db.query(ChunkReembedding).filter(ChunkReembedding.job_id == job_id).delete(
+                synchronize_session=False
+            )
+            db.query(ReembeddingJob).filter(ReembeddingJob.id == job_id).update(
+                {
+                    ReembeddingJob.status: "failed",
+                    ReembeddingJob.error: f"{type(e).__name__}: {e}"[:2000],
+                    ReembeddingJob.finished_at: func.now()
+                },
+                synchronize_session=False
+            )
+            db.commit()
+            return {"status": "failed", "processed_chunks": job.processed_chunks}
+
+        logger.info(f"Trabajo de re-embedding {job_id} completado: modelo activo {job.target_model}")
+        return {"status": "swapped", "processed_chunks": job.processed_chunks}
+    finally:
+        db.close()
+
+
+# --- Gestión de trabajos (proceso web) ---
+
+def _on_job_done(job_id: int, future: Future) -> None:
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.error(f"El trabajo de re-embedding {job_id} terminó de forma anómala: {e}")
+        return
+    if result["status"] == "swapped":
+        # Este proceso empieza a usar el nuevo modelo sin esperar al refresco periódico; los
+        # demás lo harán antes de que acabe el periodo de gracia de los vectores anteriores
+        get_active_embedding_model(refresh=True)
+        timer = threading.Timer(
+            settings.REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS, discard_previous_embeddings, args=(job_id,)
+        )
+        timer.daemon = True
+        timer.start()
+    elif result["status"] == "queued":
+        logger.info(f"Reintentando el volcado del re-embedding {job_id} en {settings.REEMBEDDING_SWAP_RETRY_SECONDS}s")
+        enqueue_reembedding_job(job_id, delay_seconds=settings.REEMBEDDING_SWAP_RETRY_SECONDS)
+
+
+def enqueue_reembedding_job(job_id: int, delay_seconds: float = 0) -> None:
+    """
+    Envía un trabajo en cola al proceso de re-embedding, opcionalmente tras una espera.
+    """
+    if delay_seconds > 0:
+        timer = threading.Timer(delay_seconds, enqueue_reembedding_job, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+        return
+
+    future = _get_executor().submit(run_reembedding_job, job_id)
+    future.add_done_callback(partial(_on_job_done, job_id))
+
+
+def start_reembedding(db: Session, target_model: str) -> ReembeddingJob:
+    """
+    Crea y encola un trabajo que recodifica todos los chunks con target_model. Con el
+    modelo activo solo se admite si quedan chunks codificados con otro modelo, que son los
+    que se recodifican.
+    """
+    target_model = (target_model or "").strip()
+    if not target_model:
+        raise HTTPException(status_code=400, detail="Hay que indicar el modelo de destino")
+    if target_model == get_active_embedding_model(refresh=True) and not db.query(DocumentChunk.id).filter(
+        DocumentChunk.embedding_model.is_distinct_from(target_model)
+    ).first():
+        raise HTTPException(
+            status_code=400,
+            detail=f"El modelo {target_model} ya es el modelo activo y todos los chunks están codificados con él"
+        )
+    if db.query(ReembeddingJob).filter(ReembeddingJob.status.in_(ACTIVE_STATES)).first():
+        raise HTTPException(status_code=409, detail="Ya hay un trabajo de re-embedding en curso")
+
+    job = ReembeddingJob(target_model=target_model, status="queued", processed_chunks=0, last_chunk_id=0)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    enqueue_reembedding_job(job.id)
+    return job
+
+
+def get_reembedding_job(db: Session, job_id: int) -> ReembeddingJob:
+    """
+    Obtiene un trabajo de re-embedding por su ID.
+    """
+    job = db.query(ReembeddingJob).filter(ReembeddingJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de re-embedding no encontrado")
+    return job
+
+
+def cancel_reembedding_job(db: Session, job_id: int) -> ReembeddingJob:
+    """
+    Cancela un trabajo en cola o en curso y descarta los embeddings nuevos ya calculados.
+    El modelo activo no cambia.
+    """
+    job = get_reembedding_job(db, job_id)
+    if job.status not in ACTIVE_STATES:
+        raise HTTPException(status_code=400, detail="Solo se pueden cancelar trabajos en cola o en curso")
+
+    job.status = "cancelled"
+    job.finished_at = func.now()
+    db.query(ChunkReembedding).filter(ChunkReembedding.job_id == job.id).delete(synchronize_session=False)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_embedding_model_status(db: Session) -> Dict[str, Any]:
+    """
+    Modelo activo y número de chunks por modelo de embedding.
+    """
+    counts = db.query(DocumentChunk.embedding_model, func.count(DocumentChunk.id)).group_by(
+        DocumentChunk.embedding_model
+    ).all()
+    return {
+        "active_model": get_active_embedding_model(refresh=True),
+        "chunks_by_model": {model or "desconocido": count for model, count in counts}
+    }
+
+
+def resume_reembedding_jobs() -> List[int]:
+    """
+    Vuelve a encolar al arrancar los trabajos pendientes y los interrumpidos (en curso sin
+    actualizar durante INGESTION_STALE_SECONDS). Continúan desde su último lote confirmado.
+    También borra los vectores del modelo anterior cuyo periodo de gracia ya pasó.
+
+    Returns:
+        IDs de los trabajos encolados
+    """
+    db = SessionLocal()
+    try:
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=settings.INGESTION_STALE_SECONDS)
+        db.query(ReembeddingJob).filter(
+            ReembeddingJob.status == "running",
+            ReembeddingJob.updated_at < stale_before
+        ).update({ReembeddingJob.status: "queued"}, synchronize_session=False)
+        db.commit()
+
+        job_ids = [job_id for (job_id,) in db.query(ReembeddingJob.id).filter(
+            ReembeddingJob.status == "queued"
+        ).order_by(ReembeddingJob.id).all()]
+    finally:
+        db.close()
+
+    discard_previous_embeddings()
+    for job_id in job_ids:
+        enqueue_reembedding_job(job_id)
+    if job_ids:
+        logger.info(f"Reanudados {len(job_ids)} trabajos de re-embedding pendientes")
+    return job_ids
+
+
+def shutdown_reembedding_workers() -> None:
+    """
+    Detiene el proceso de re-embedding. Un trabajo interrumpido conserva sus lotes
+    confirmados y se reanuda en el siguiente arranque.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
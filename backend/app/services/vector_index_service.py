@@ -0,0 +1,170 @@
+"""
+Servicio de Índices Vectoriales - Capa base
+Este servicio gestiona los índices ANN (HNSW / IVFFlat) de pgvector sobre
+document_chunks.embedding: creación, reconstrucción y reindexado tras cargas masivas.
+"""
+from typing import Any, Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import logging
+
+from app.core.config import settings
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_TABLE = "document_chunks"
+VECTOR_INDEX_COLUMN = "embedding"
+VECTOR_INDEX_TYPES = ("hnsw", "ivfflat")
+
+# Métrica de similitud -> índice y clase de operadores de pgvector.
+# Cada operador (<=>, <->, <#>) solo puede usar un índice de su misma clase.
+VECTOR_INDEX_METRICS: Dict[str, Dict[str, str]] = {
+    "cosine": {"index_name": "ix_document_chunks_embedding_cosine", "opclass": "vector_cosine_ops"},
+    "l2": {"index_name": "ix_document_chunks_embedding_l2", "opclass": "vector_l2_ops"},
+    "inner_product": {"index_name": "ix_document_chunks_embedding_ip", "opclass": "vector_ip_ops"},
+}
+
+
+def _validate_metrics(metrics: Optional[List[str]]) -> List[str]:
+    if not metrics:
+        return list(VECTOR_INDEX_METRICS.keys())
+    invalid = [m for m in metrics if m not in VECTOR_INDEX_METRICS]
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Métricas no soportadas: {', '.join(invalid)}. Usa: {', '.join(VECTOR_INDEX_METRICS)}"
+        )
+    return metrics
+
+
+def _validate_index_type(index_type: Optional[str]) -> str:
+    index_type = (index_type or settings.VECTOR_INDEX_TYPE).lower()
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de índice no soportado: {index_type}. Usa: {', '.join(VECTOR_INDEX_TYPES)}"
+        )
+    return index_type
+
+
+def build_create_index_sql(
+    metric: str,
+    index_type: Optional[str] = None,
+    index_name: Optional[str] = None,
+    concurrently: bool = True
+) -> str:
+    """
+    Construye la sentencia CREATE INDEX para una métrica y un tipo de índice.
+
+    Args:
+        metric: Métrica de similitud ("cosine", "l2", "inner_product")
+        index_type: "hnsw" o "ivfflat" (por defecto settings.VECTOR_INDEX_TYPE)
+        index_name: Nombre del índice (por defecto el nombre canónico de la métrica)
+        concurrently: Si se crea sin bloquear escrituras en la tabla
+
+    Returns:
+        Sentencia SQL
+    """
+    metric = _validate_metrics([metric])[0]
+    index_type = _validate_index_type(index_type)
+    index_info = VECTOR_INDEX_METRICS[metric]
+    index_name = index_name or index_info["index_name"]
+
+    if index_type == "hnsw":
+        with_clause = f"m = {settings.HNSW_M}, ef_construction = {settings.HNSW_EF_CONSTRUCTION}"
+    else:
+        with_clause = f"lists = {settings.IVFFLAT_LISTS}"
+
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{index_name} "
+        f"ON {VECTOR_INDEX_TABLE} USING {index_type} ({VECTOR_INDEX_COLUMN} {index_info['opclass']}) "
+        f"WITH ({with_clause})"
+    )
+
+
+def _execute_autocommit(db: Session, statements: List[str]) -> None:
+    """
+    CREATE/DROP/REINDEX ... CONCURRENTLY no pueden ejecutarse dentro de una transacción,
+    así que se usa una conexión aparte en modo AUTOCOMMIT. Se desactiva el
+    statement_timeout de la conexión, ya que construir un índice puede tardar minutos.
+    """
+    engine = db.get_bind().engine
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("SET statement_timeout = 0"))
+        try:
+            for statement in statements:
+                logger.info(f"Ejecutando: {statement}")
+                connection.execute(text(statement))
+        finally:
+            # Vuelve al valor configurado al conectar antes de devolver la conexión al pool
+            connection.execute(text("RESET statement_timeout"))
+
+
+def list_vector_indexes(db: Session) -> List[Dict[str, Any]]:
+    """
+    Lista los índices vectoriales de document_chunks con su definición y tamaño.
+    """
+    rows = db.execute(text(
+        """
+        SELECT i.indexname, i.indexdef, pg_relation_size(c.oid) AS size_bytes
+        FROM pg_indexes i
+        JOIN pg_class c ON c.relname = i.indexname
+        WHERE i.tablename = :table AND i.indexdef ILIKE '%vector_%_ops%'
+        ORDER BY i.indexname
+        """
+    ), {"table": VECTOR_INDEX_TABLE}).all()
+
+    return [
+        {
+            "name": row.indexname,
+            "definition": row.indexdef,
+            "size_bytes": row.size_bytes
+        }
+        for row in rows
+    ]
+
+
+def rebuild_vector_indexes(
+    db: Session,
+    index_type: Optional[str] = None,
+    metrics: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Reconstruye los índices vectoriales (por ejemplo, para cambiar de HNSW a IVFFlat
+    o recalcular los centroides de IVFFlat tras una carga masiva).
+
+    El índice nuevo se construye con un nombre temporal y después sustituye al antiguo,
+    de forma que las búsquedas siguen usando el índice anterior mientras dura la construcción.
+    """
+    metrics = _validate_metrics(metrics)
+    index_type = _validate_index_type(index_type)
+
+    for metric in metrics:
+        index_name = VECTOR_INDEX_METRICS[metric]["index_name"]
+        tmp_name = f"{index_name}_new"
+        _execute_autocommit(db, [
+            f"DROP INDEX CONCURRENTLY IF EXISTS {tmp_name}",
+            build_create_index_sql(metric, index_type, index_name=tmp_name),
+            f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}",
+            f"ALTER INDEX {tmp_name} RENAME TO {index_name}",
+        ])
+        logger.info(f"Índice {index_name} reconstruido como {index_type}")
+
+    return list_vector_indexes(db)
+
+
+def reindex_vector_indexes(db: Session, metrics: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Reindexa los índices vectoriales existentes sin bloquear lecturas ni escrituras.
+    """
+    metrics = _validate_metrics(metrics)
+
+    _execute_autocommit(db, [
+        f"REINDEX INDEX CONCURRENTLY {VECTOR_INDEX_METRICS[metric]['index_name']}"
+        for metric in metrics
+    ])
+    logger.info(f"Índices vectoriales reindexados: {', '.join(metrics)}")
+
+    return list_vector_indexes(db)
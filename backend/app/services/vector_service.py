@@ -4,27 +4,79 @@ Este servicio maneja las operaciones con vectores y búsqueda semántica.
 Solo puede depender de servicios de la capa base (embedding_service, document_service).
 """
 from fastapi import HTTPException
-from sqlalchemy import  select, literal_column
 from sqlalchemy.orm import Session
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 import logging
 
+from app.core.config import settings
 from ..models.models import (
-    Document, 
-    DocumentChunk,
     Conversation, 
     Message, 
     User
 )
-from app.services.embedding_service import get_embedding_for_query
+from app.services.embedding_service import get_active_embedding_model, get_embedding_for_query
+from app.services.background_embedding_service import enqueue_message_embedding
+from app.crud.crud_vector import (
+    RetrievedChunk,
+    search_similar_chunks_db,
+    count_total_chunks,
+    count_chunks_by_subject_id,
+    count_chunks_by_document_id,
+    get_documents_by_subject_id,
+    get_embedding_dimension_by_document_id
+)
+
+# Configuración de logging
+logger = logging.getLogger(__name__)
+
+def get_retrieval_diagnostics(db: Session, subject_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Obtiene información de diagnóstico sobre los chunks disponibles para la búsqueda.
+    Hace varias consultas por documento, por lo que no debe usarse en cada mensaje.
+    
+    Args:
+        db: Sesión de SQLAlchemy
+        subject_id: ID de la asignatura (opcional)
+        
+    Returns:
+        Diccionario con conteos de chunks y dimensión de los embeddings por documento
+    """
+    diagnostics: Dict[str, Any] = {"total_chunks": count_total_chunks(db)}
+    
+    if subject_id:
+        documents_info = []
+        for doc in get_documents_by_subject_id(db, subject_id):
+            chunk_count = count_chunks_by_document_id(db, doc.id)
+            embedding_dim = None
+            if chunk_count > 0:
+                embedding_dim = get_embedding_dimension_by_document_id(db, doc.id)
+            documents_info.append({
+                "id": doc.id,
+                "title": doc.title,
+                "chunks": chunk_count,
+                "embedding_dimension": embedding_dim
+            })
+        
+        diagnostics.update({
+            "subject_id": subject_id,
+            "documents_count": len(documents_info),
+            "subject_chunks": count_chunks_by_subject_id(db, subject_id),
+            "documents": documents_info
+        })
+    
+    return diagnostics
 
 def search_similar_chunks(db: Session,
                           query_embedding: List[float],
                           subject_id: Optional[int] = None,
                           limit: int = 10,
-                          similarity_metric: str = "cosine") -> List[Tuple[DocumentChunk, float]]:
+                          similarity_metric: str = "cosine",
+                          ef_search: Optional[int] = None,
+                          probes: Optional[int] = None) -> List[Tuple[RetrievedChunk, float]]:
     """
-    Busca chunks similares a un embedding de consulta usando pgvector
+    Busca chunks similares a un embedding de consulta usando pgvector.
+    Solo se ejecuta la consulta de similitud; las consultas de diagnóstico se activan
+    con settings.RETRIEVAL_DIAGNOSTICS o desde el endpoint /retrieval/diagnostics.
     
     Args:
         db: Sesión de SQLAlchemy
@@ -32,120 +84,69 @@ def search_similar_chunks(db: Session,
         subject_id: ID de la asignatura (opcional)
         limit: Número máximo de chunks a devolver
         similarity_metric: Métrica de similitud a usar ("cosine", "l2", "inner_product")
+        ef_search: Candidatos explorados por el índice HNSW en esta consulta (opcional)
+        probes: Listas visitadas por el índice IVFFlat en esta consulta (opcional)
         
     Returns:
-        Lista de tuplas (chunk, score) ordenadas por similitud
+        Lista de tuplas (RetrievedChunk, score) ordenadas por similitud; cada chunk
+        incluye el título de su documento y no carga el embedding
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Log para depuración
     logger.info(f"Buscando chunks similares, subject_id={subject_id}, limit={limit}")
     
     if not query_embedding or len(query_embedding) == 0:
         logger.error("query_embedding es None o vacío en search_similar_chunks")
         return []
-        
-    # Log de dimensiones del embedding
-    logger.info(f"Dimensión del embedding de consulta: {len(query_embedding)}")
-        
-    embedding_str = f"CAST(ARRAY[{', '.join(map(str, query_embedding))}] AS vector)"
-
-    try:
-        if similarity_metric == "cosine":
-            # Usamos directamente la sintaxis SQL de pgvector para la distancia coseno
-            distance_expression = literal_column(f"({DocumentChunk.embedding.key} <=> {embedding_str})")
-            convert_score = lambda x: 1.0 - x
-        elif similarity_metric == "l2":
-            # Usamos directamente la sintaxis SQL de pgvector para la distancia euclidiana
-            distance_expression = literal_column(f"({DocumentChunk.embedding.key} <-> {embedding_str})")
-            convert_score = lambda x: 1.0 / (1.0 + x)
-        else:
-            # Inner product negativo (más alto = más similar)
-            distance_expression = literal_column(f"({DocumentChunk.embedding.key} <#> {embedding_str})")
-            convert_score = lambda x: -x
-        
-        logger.info(f"Expresión de distancia creada correctamente: {distance_expression}")
-    except Exception as e:
-        logger.error(f"Error al crear la expresión de distancia: {str(e)}")
-        raise
-
-    # Construir la consulta base
-    query = select(
-        DocumentChunk,
-        distance_expression.label("distance")
-    )
-    
-    
-    # Si se proporciona subject_id, filtrar por los documentos de esa asignatura
-    if subject_id:
-        query = query.join(Document, DocumentChunk.document_id == Document.id)
-        query = query.filter(Document.subject_id == subject_id)
-        
-        # Log para verificar documentos de asignatura
-        doc_count = db.query(Document).filter(Document.subject_id == subject_id).count()
-        logger.info(f"Documentos encontrados para subject_id={subject_id}: {doc_count}")
-        
-        # Verificar si los documentos tienen chunks
-        for doc in db.query(Document).filter(Document.subject_id == subject_id).all():
-            chunk_count = db.query(DocumentChunk).filter(DocumentChunk.document_id == doc.id).count()
-            logger.info(f"Documento id={doc.id}, título='{doc.title}' tiene {chunk_count} chunks")
-            
-            # Verificar si los chunks tienen embeddings válidos
-            if chunk_count > 0:
-                sample_chunk = db.query(DocumentChunk).filter(DocumentChunk.document_id == doc.id).first()
-                if sample_chunk and sample_chunk.embedding:
-                    embedding_dim = len(sample_chunk.embedding)
-                    logger.info(f"Un chunk del documento {doc.id} tiene un embedding de dimensión {embedding_dim}")
-                else:
-                    logger.warning(f"Los chunks del documento {doc.id} no tienen embeddings válidos")
-        
-        if limit > 1:
-            # Obtener primero los documentos de la asignatura
-            documents = db.query(Document.id).filter(Document.subject_id == subject_id).all()
-            doc_ids = [doc[0] for doc in documents]
-            
-            if len(doc_ids) > 1:
-                # Si hay varios documentos, podemos intentar obtener diversidad
-                # Sin embargo, mantenemos la query original porque es más simple y general
-                pass
     
-    # Ordenar por distancia y limitar resultados
-    query = query.order_by("distance").limit(limit)
-
-    results = db.execute(query).all()
+    embedding_model = get_active_embedding_model()
+    results = search_similar_chunks_db(
+        db=db,
+        query_embedding=query_embedding,
+        subject_id=subject_id,
+        limit=limit,
+        similarity_metric=similarity_metric,
+        ef_search=ef_search,
+        probes=probes,
+        embedding_model=embedding_model
+    )
+    if not results:
+        # Justo después de un cambio de modelo, este proceso puede seguir codificando las
+        # preguntas con el anterior hasta refrescarlo: sus vectores se conservan un tiempo
+        results = search_similar_chunks_db(
+            db=db,
+            query_embedding=query_embedding,
+            subject_id=subject_id,
+            limit=limit,
+            similarity_metric=similarity_metric,
+            embedding_model=embedding_model,
+            previous_vectors=True
+        )
+        if results:
+            logger.info(f"Búsqueda resuelta con los vectores conservados del modelo anterior {embedding_model}")
     
-    # Log del número de resultados encontrados
     logger.info(f"Resultados encontrados: {len(results)}")
     
-    # Si no hay resultados, hacer log del query SQL para depuración
-    if len(results) == 0:
-        logger.warning(f"No se encontraron chunks similares. Query SQL: {query}")
-        
-        # Verificar si hay chunks en la base de datos
-        chunk_count = db.query(DocumentChunk).count()
-        logger.info(f"Total de chunks en la base de datos: {chunk_count}")
-        
-        # Si hay subject_id, verificar que hay chunks relacionados
-        if subject_id:
-            related_chunks = db.query(DocumentChunk).\
-                join(Document, DocumentChunk.document_id == Document.id).\
-                filter(Document.subject_id == subject_id).count()
-            logger.info(f"Chunks relacionados con subject_id={subject_id}: {related_chunks}")
-
-    return [(row.DocumentChunk, convert_score(row.distance)) for row in results]
-
+    if settings.RETRIEVAL_DIAGNOSTICS:
+        logger.info(f"Diagnóstico de recuperación: {get_retrieval_diagnostics(db, subject_id)}")
+    elif not results:
+        logger.warning(
+            f"No se encontraron chunks similares para subject_id={subject_id}. "
+            "Activa RETRIEVAL_DIAGNOSTICS o consulta /retrieval/diagnostics para más detalle."
+        )
+    
+    return results
 
 
 def add_user_message(
     db: Session,
     conversation_id: int,
     message_text: str = None,
-    image_id: int = None
+    image_id: int = None,
+    question_embedding: Optional[List[float]] = None
 ) -> Message:
     """
     Añade un mensaje del usuario a una conversación existente.
     Se puede proporcionar texto, imagen o ambos.
+    Si ya se calculó el embedding de la pregunta (question_embedding) se reutiliza.
     """
     # Verificar que la conversación existe
     conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
@@ -153,7 +154,8 @@ def add_user_message(
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
     
     # Crear embedding para el mensaje si hay texto
-    question_embedding = get_embedding_for_query(message_text) if message_text else None
+    if question_embedding is None and message_text:
+        question_embedding = get_embedding_for_query(message_text)
     
     # Crear el mensaje del usuario
     user_msg = Message(
@@ -177,27 +179,27 @@ def add_bot_message(
 ) -> Message:
     """
     Añade un mensaje del bot a una conversación existente.
+    El embedding de la respuesta se calcula en segundo plano después de confirmar
+    el mensaje (o no se calcula si settings.EMBED_BOT_MESSAGES está desactivado).
     """
     # Verificar que la conversación existe
     conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
     
-    # Crear embedding para el mensaje
-    bot_embedding = get_embedding_for_query(message_text)
-    
     # Crear el mensaje del bot
     bot_msg = Message(
         text=message_text,
         is_bot=True,
-        conversation_id=conversation_id,
-        embedding=bot_embedding
+        conversation_id=conversation_id
     )
     
     db.add(bot_msg)
     db.commit()
     db.refresh(bot_msg)
     
+    enqueue_message_embedding(bot_msg.id, message_text)
+    
     return bot_msg
 
 def get_conversation_context(
@@ -205,7 +207,8 @@ def get_conversation_context(
     message_text: str = None,
     subject_id: int = None,
     limit: int = 10,
-    similarity_metric: str = "cosine"
+    similarity_metric: str = "cosine",
+    query_embedding: Optional[List[float]] = None
 ) -> str:
     """
     Obtiene el contexto de todos los documentos de una asignatura
@@ -217,6 +220,7 @@ def get_conversation_context(
         subject_id: ID de la asignatura (opcional)
         limit: Número máximo de chunks a devolver
         similarity_metric: Métrica de similitud a usar ("cosine", "l2", "inner_product")
+        query_embedding: Embedding ya calculado del mensaje (opcional)
         
     Returns:
         Contexto como string concatenado
@@ -234,7 +238,8 @@ def get_conversation_context(
     
     logger.info(f"Generando contexto para pregunta: '{message_text[:50]}...', subject_id={subject_id}]")
         
-    query_embedding = get_embedding_for_query(message_text)
+    if query_embedding is None:
+        query_embedding = get_embedding_for_query(message_text)
     logger.debug(f"Embedding generado con tamaño: {len(query_embedding)}")
     
     similar_chunks = search_similar_chunks(
@@ -256,15 +261,15 @@ def get_conversation_context(
         logger.info(f"Procesando {len(similar_chunks)} chunks para generar contexto")
         
         for i, (chunk, score) in enumerate(similar_chunks):
-            # Obtenemos el título del documento
-            document_title = db.query(Document.title).filter(Document.id == chunk.document_id).first()
-            title_str = document_title[0] if document_title else "Documento desconocido"
+            # El título del documento ya viene en la misma consulta de similitud
+            title_str = chunk.document_title or "Documento desconocido"
             
             # Log de la puntuación de similitud
             logger.info(f"Chunk {i+1}: score={score:.4f}, documento='{title_str}', longitud={len(chunk.content)}")
             
             # Formateamos el chunk con información del documento
-            context_parts.append(f"[Del documento '{title_str}']: {chunk.content}")
+            source = f"'{title_str}', pág. {chunk.page_number}" if chunk.page_number else f"'{title_str}'"
+            context_parts.append(f"[Del documento {source}]: {chunk.content}")
         
         context = "\n\n".join(context_parts)
         logger.info(f"Contexto generado con {len(context_parts)} chunks, longitud total: {len(context)} caracteres")
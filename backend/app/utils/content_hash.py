@@ -0,0 +1,49 @@
+"""
+Hashes de contenido - Capa utilitaria
+Direccionamiento por contenido de los PDFs subidos y de los textos de los chunks, para
+guardar cada fichero una sola vez y reutilizar embeddings de contenido idéntico.
+"""
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Tuple
+
+from app.utils.embedding_cache import normalize_text
+
+# Tamaño de bloque al copiar y hashear los ficheros subidos
+COPY_BLOCK_BYTES = 1024 * 1024
+
+
+def chunk_content_hash(text: str) -> str:
+    """SHA-256 del texto normalizado, para que chunks que solo difieren en espacios coincidan."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def store_content_addressed(stream: BinaryIO, folder: str, extension: str = ".pdf") -> Tuple[str, str, bool]:
+    """
+    Copia un fichero a folder/<ab>/<sha256><extension> calculando el hash mientras se copia.
+    Si ya existe un fichero con el mismo contenido, se descarta la copia y se reutiliza.
+
+    Returns:
+        (ruta del fichero, hash del contenido, True si el fichero ya existía)
+    """
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            for block in iter(lambda: stream.read(COPY_BLOCK_BYTES), b""):
+                digest.update(block)
+                buffer.write(block)
+
+        content_hash = digest.hexdigest()
+        blob_folder = os.path.join(folder, content_hash[:2])
+        os.makedirs(blob_folder, exist_ok=True)
+        file_path = os.path.join(blob_folder, f"{content_hash}{extension}")
+        if os.path.exists(file_path):
+            return file_path, content_hash, True
+        os.replace(tmp_path, file_path)
+        return file_path, content_hash, False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
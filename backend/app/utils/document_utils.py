@@ -2,33 +2,50 @@ import pypdf
 from sentence_transformers import SentenceTransformer
 import torch
 import logging
-from typing import List
+from typing import List, Optional
 from llama_index.core.node_parser import SemanticSplitterNodeParser
 from llama_index.core import Document
 
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from app.services.embedding_service import get_active_embedding_model
 from app.services.embedding_service import load_sentence_transformer_model_singleton as load_embedding_model
+from app.utils.pdf_utils import iter_pdf_pages, page_text
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_sentence_transformer_model_singleton(model_name: str = 'multi-qa-mpnet-base-dot-v1'):
+def load_sentence_transformer_model_singleton(model_name: Optional[str] = None):
     """
     Usa el modelo singleton del servicio de embedding para mantener consistencia.
     Esta función se mantiene para compatibilidad con el código existente.
     """
     return load_embedding_model(model_name)
 
+def _extract_text_from_stream(stream) -> str:
+    try:
+        pdf_reader = pypdf.PdfReader(stream)
+        texts = (page_text(page) for page in pdf_reader.pages)
+        return " ".join(text for text in texts if text)
+    except Exception as e:
+        logger.error(f"Error al extraer texto del PDF: {e}", exc_info=True)
+        return ""
+
 def extract_text_from_pdf(pdf_file) -> str:
+    return _extract_text_from_stream(pdf_file.file)
+
+def extract_text_from_pdf_path(file_path: str) -> str:
+    """
+    Extrae el texto de un PDF ya guardado en disco.
+    """
     try:
-        pdf_reader = pypdf.PdfReader(pdf_file.file)
-        text = " ".join([page.extract_text() for page in pdf_reader.pages if page.extract_text()])
-        return text.strip()
+        return " ".join(text for _, text in iter_pdf_pages(file_path))
     except Exception as e:
         logger.error(f"Error al extraer texto del PDF: {e}", exc_info=True)
         return ""
 
-def process_document_and_embed_chunks_semantic(document_id: int, text: str, db, model_name_for_embedding: str = 'multi-qa-mpnet-base-dot-v1'):
+def process_document_and_embed_chunks_semantic(document_id: int, text: str, db, model_name_for_embedding: Optional[str] = None):
+    # Por defecto el modelo activo, el mismo con el que se codifican las consultas
+    model_name_for_embedding = model_name_for_embedding or get_active_embedding_model()
     st_encoder_model = load_sentence_transformer_model_singleton(model_name=model_name_for_embedding)
     if st_encoder_model is None:
         logger.error("No se puede procesar el documento porque el modelo SentenceTransformer para codificación no está cargado.")
@@ -105,7 +122,8 @@ def process_document_and_embed_chunks_semantic(document_id: int, text: str, db,
             document_id=document_id,
             content=chunk_content,
             embedding=embedding_list,
-            chunk_number=i
+            chunk_number=i,
+            embedding_model=model_name_for_embedding
         )
         db.add(db_chunk_entry)
         created_chunks_in_db.append(db_chunk_entry)
@@ -113,13 +131,13 @@ def process_document_and_embed_chunks_semantic(document_id: int, text: str, db,
     logger.info(f"Proceso completado para documento ID: {document_id}. {len(created_chunks_in_db)} chunks preparados para añadir a la sesión de BBDD.")
     return created_chunks_in_db
 
-def get_embedding_for_query(query: str, model_name: str = 'multi-qa-mpnet-base-dot-v1') -> List[float]:
+def get_embedding_for_query(query: str, model_name: Optional[str] = None) -> List[float]:
     """
     Obtiene el embedding para una consulta de usuario.
 
     Args:
         query: La pregunta del usuario.
-        model_name: El nombre del modelo de embedding a utilizar.
+        model_name: El nombre del modelo de embedding a utilizar (por defecto, el activo).
 
     Returns:
         El embedding como una lista de floats, o una lista vacía en caso de error.
@@ -0,0 +1,141 @@
+"""
+Agrupador de embeddings - Capa utilitaria
+Reúne en un solo lote los textos que llegan casi a la vez desde peticiones concurrentes,
+de modo que el modelo hace una pasada por lote en lugar de una por texto. Cada llamada
+recibe un Future con su embedding.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Marca de parada del hilo de codificación
+_STOP = object()
+
+
+class EmbeddingBatcher:
+    """
+    Cola de textos con un hilo que los codifica por lotes.
+
+    El hilo toma el primer texto pendiente y espera como mucho max_wait_ms a que lleguen
+    más, hasta max_batch_size. Los textos de un lote se agrupan por modelo y los repetidos
+    se codifican una sola vez. encode_batch(model_name, texts) debe devolver una fila por texto.
+    """
+
+    def __init__(
+        self,
+        encode_batch: Callable[[str, List[str]], Any],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0
+    ):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(0.0, max_wait_ms) / 1000
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def submit(self, model_name: str, text: str) -> Future:
+        """
+        Encola un texto y devuelve el Future de su embedding (np.ndarray float32).
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("El agrupador de embeddings está detenido")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            self._queue.put((model_name, text, future))
+        return future
+
+    def _collect(self) -> Tuple[List[Tuple[str, str, Future]], bool]:
+        """
+        Espera al primer texto y reúne los que lleguen dentro de la ventana.
+
+        Returns:
+            (lote, parar) donde parar indica que se recibió la marca de parada
+        """
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _process(self, batch: List[Tuple[str, str, Future]]) -> None:
+        by_model: Dict[str, Dict[str, List[Future]]] = {}
+        for model_name, text, future in batch:
+            # Un Future cancelado por quien lo pidió no se codifica
+            if future.set_running_or_notify_cancel():
+                by_model.setdefault(model_name, {}).setdefault(text, []).append(future)
+
+        for model_name, futures_by_text in by_model.items():
+            texts = list(futures_by_text)
+            try:
+                embeddings = np.asarray(self.encode_batch(model_name, texts), dtype=np.float32)
+            except Exception as e:
+                logger.error(f"Error al codificar un lote de {len(texts)} textos con {model_name}: {e}")
+                for futures in futures_by_text.values():
+                    for future in futures:
+                        future.set_exception(e)
+                continue
+
+            for embedding, futures in zip(embeddings, futures_by_text.values()):
+                for future in futures:
+                    future.set_result(embedding)
+            self.batches += 1
+            self.items += len(texts)
+            self.largest_batch = max(self.largest_batch, len(texts))
+
+    def _run(self) -> None:
+        # La marca de parada se encola tras el último texto aceptado, así que todo lo
+        # encolado antes de cerrar se codifica
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if batch:
+                self._process(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "largest_batch": self.largest_batch,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "pending": self._queue.qsize()
+        }
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Deja de aceptar textos y detiene el hilo tras codificar los pendientes.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None and wait:
+            thread.join()
@@ -0,0 +1,153 @@
+"""
+Caché de embeddings - Capa utilitaria
+Caché LRU + TTL en memoria, limitada por tamaño en bytes, con un nivel opcional en disco.
+Las claves se derivan del nombre del modelo y del texto normalizado.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Coste aproximado en memoria de una entrada además del propio array (clave, tupla, nodo del dict)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza Unicode y espacios para que textos equivalentes compartan entrada."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings con expulsión LRU por tamaño en bytes y caducidad por TTL.
+
+    Si se indica disk_dir, cada embedding se guarda también como fichero .npy, de modo
+    que sobrevive a reinicios y se comparte entre workers del mismo servidor.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: int, disk_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.npy")
+
+    def _remove(self, key: str) -> None:
+        _, array = self._entries.pop(key)
+        self.current_bytes -= array.nbytes + ENTRY_OVERHEAD_BYTES
+
+    def _store(self, key: str, array: np.ndarray, expires_at: float) -> None:
+        size = array.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, array)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def _load_from_disk(self, key: str) -> Optional[np.ndarray]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            modified_at = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - modified_at > self.ttl_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            array = np.load(path)
+        except Exception as e:
+            logger.warning(f"No se pudo leer el embedding cacheado en disco {path}: {e}")
+            return None
+        self._store(key, array, modified_at + self.ttl_seconds)
+        return array
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Devuelve el embedding cacheado o None si no existe o ha caducado."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, array = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return array
+                self._remove(key)
+
+        array = self._load_from_disk(key)
+        with self._lock:
+            if array is not None:
+                self.hits += 1
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        return array
+
+    def put(self, key: str, embedding: Any) -> None:
+        """Guarda un embedding (lista o array) en memoria y, si está configurado, en disco."""
+        array = np.asarray(embedding, dtype=np.float32)
+        self._store(key, array, time.time() + self.ttl_seconds)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"No se pudo guardar el embedding en disco {path}: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_dir": self.disk_dir
+            }
@@ -0,0 +1,398 @@
+"""
+Pasarela de llamadas al modelo de lenguaje - Capa utilitaria
+Envuelve las llamadas al proveedor del LLM con:
+- un plazo por llamada (y un tiempo máximo por intento),
+- reintentos con espera exponencial y jitter para errores transitorios (429, 5xx, timeouts),
+- un circuit breaker que, tras varios fallos transitorios seguidos, rechaza las llamadas de
+  inmediato durante un tiempo en lugar de dejar a los workers esperando al proveedor,
+- un límite de llamadas simultáneas (semáforo), para que las ráfagas esperen turno en lugar
+  de provocar errores de cuota,
+- métricas de todo lo anterior.
+No depende del cliente concreto: recibe funciones que hacen la llamada con un timeout.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Códigos HTTP de errores transitorios del proveedor
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailableError(Exception):
+    """El LLM no está disponible: circuito abierto o plazo de la llamada agotado."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """El circuit breaker está abierto y la llamada se rechaza sin contactar al proveedor."""
+
+
+class LLMTimeoutError(LLMUnavailableError, TimeoutError):
+    """Se agotó el plazo de la llamada al LLM."""
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    Errores transitorios que merece la pena reintentar: timeouts, errores de conexión y
+    respuestas HTTP 408/429/5xx (las excepciones de google.api_core llevan el código en .code).
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por fallos consecutivos. Cerrado: las llamadas pasan. Tras
+    failure_threshold fallos seguidos se abre durante recovery_seconds y rechaza las
+    llamadas. Pasado ese tiempo queda semiabierto y deja pasar una llamada de prueba: si
+    sale bien se cierra y si falla se vuelve a abrir.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_seconds: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_seconds = recovery_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Indica si una llamada puede pasar; en semiabierto solo pasa la de prueba."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Circuit breaker del LLM abierto tras {self._failures} fallos consecutivos")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Libera la llamada de prueba si terminó con un error que no cuenta como fallo."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class LLMGateway:
+    """
+    Ejecuta llamadas al LLM con plazo, reintentos, circuit breaker y límite de concurrencia.
+
+    Las funciones que se pasan reciben el timeout en segundos del intento, para
+    trasladarlo al cliente (p. ej. request_options={"timeout": timeout}). En las llamadas
+    asíncronas además se corta la espera con asyncio.wait_for. El límite de concurrencia
+    se aplica por separado a las llamadas síncronas (hilos) y a las de cada event loop.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 8,
+        attempt_timeout_seconds: float = 30.0,
+        deadline_seconds: float = 60.0,
+        max_attempts: int = 3,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 8.0,
+        failure_threshold: int = 5,
+        recovery_seconds: float = 30.0,
+        is_retryable: Callable[[BaseException], bool] = is_retryable_error
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.is_retryable = is_retryable
+        self.breaker = CircuitBreaker(failure_threshold, recovery_seconds)
+        self._thread_slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._loop_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "rejected_open_circuit": 0,
+            "cancelled": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "latency_ms_total": 0.0,
+            "wait_ms_total": 0.0
+        }
+
+    # Métricas
+
+    def _count(self, stat: str, amount: float = 1) -> None:
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    def _enter_queue(self) -> float:
+        with self._stats_lock:
+            self._stats["waiting"] += 1
+            self._stats["max_waiting"] = max(self._stats["max_waiting"], self._stats["waiting"])
+        return time.perf_counter()
+
+    def _enter_slot(self, queued_at: float) -> None:
+        with self._stats_lock:
+            self._stats["waiting"] -= 1
+            self._stats["wait_ms_total"] += (time.perf_counter() - queued_at) * 1000
+            self._stats["in_flight"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+
+    def _leave_slot(self) -> None:
+        self._count("in_flight", -1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        finished = stats["succeeded"] + stats["failed"]
+        stats["mean_latency_ms"] = round(stats.pop("latency_ms_total") / finished, 1) if finished else 0.0
+        stats["mean_wait_ms"] = round(stats.pop("wait_ms_total") / stats["calls"], 1) if stats["calls"] else 0.0
+        stats["circuit_state"] = self.breaker.state
+        stats["circuit_opened"] = self.breaker.times_opened
+        stats["max_concurrency"] = self.max_concurrency
+        return stats
+
+    # Concurrencia
+
+    def _slot_timeout(self) -> None:
+        self._count("waiting", -1)
+        self._count("timeouts")
+        self._count("failed")
+        raise LLMTimeoutError(f"Plazo de {self.deadline_seconds}s agotado esperando turno para llamar a {self.name}")
+
+    @contextmanager
+    def _thread_slot(self, deadline: float) -> Iterator[None]:
+        queued_at = self._enter_queue()
+        if not self._thread_slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            self._slot_timeout()
+        self._enter_slot(queued_at)
+        try:
+            yield
+        finally:
+            self._leave_slot()
+            self._thread_slots.release()
+
+    @asynccontextmanager
+    async def _async_slot(self, deadline: float) -> AsyncIterator[None]:
+        loop = asyncio.get_running_loop()
+        semaphore = self._loop_slots.get(loop)
+        if semaphore is None:
+            semaphore = self._loop_slots.setdefault(loop, asyncio.Semaphore(self.max_concurrency))
+        queued_at = self._enter_queue()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), max(deadline - time.monotonic(), 0))
+        except (TimeoutError, asyncio.TimeoutError):
+            self._slot_timeout()
+        except BaseException:
+            self._count("waiting", -1)
+            raise
+        self._enter_slot(queued_at)
+        try:
+            yield
+        finally:
+            self._leave_slot()
+            semaphore.release()
+
+    # Política de reintentos
+
+    def _attempt_timeout(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count("timeouts")
+            raise LLMTimeoutError(f"Plazo de {self.deadline_seconds}s agotado en la llamada a {self.name}")
+        return min(self.attempt_timeout_seconds, remaining)
+
+    def _check_circuit(self) -> None:
+        if not self.breaker.allow():
+            self._count("rejected_open_circuit")
+            raise CircuitOpenError(f"Circuit breaker de {self.name} abierto: llamada rechazada")
+
+    def _after_failure(self, error: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        """
+        Registra el fallo de un intento y devuelve la espera antes de reintentar, o None
+        si no hay que reintentar (error no transitorio, sin intentos o sin plazo).
+        """
+        if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+            self._count("timeouts")
+        if not self.is_retryable(error):
+            # Un error de la petición (p. ej. 400) no indica que el proveedor esté caído
+            self.breaker.release_probe()
+            return None
+        self.breaker.record_failure()
+        if attempt >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1)))
+        if time.monotonic() + delay >= deadline:
+            return None
+        logger.warning(
+            f"Intento {attempt} de {self.name} fallido ({type(error).__name__}: {error}); "
+            f"reintento en {delay:.2f}s"
+        )
+        self._count("retries")
+        return delay
+
+    def _finish(self, started: float, succeeded: bool) -> None:
+        self._count("latency_ms_total", (time.perf_counter() - started) * 1000)
+        self._count("succeeded" if succeeded else "failed")
+
+    def call(self, fn: Callable[[float], T]) -> T:
+        """Ejecuta fn(timeout) de forma síncrona con la política de la pasarela."""
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline_seconds
+        with self._thread_slot(deadline):
+            started = time.perf_counter()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    timeout = self._attempt_timeout(deadline)
+                    self._check_circuit()
+                    result = fn(timeout)
+                except Exception as e:
+                    delay = None if isinstance(e, LLMUnavailableError) else self._after_failure(e, attempt, deadline)
+                    if delay is None:
+                        self._finish(started, False)
+                        raise
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                self._finish(started, True)
+                return result
+
+    async def call_async(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """Espera fn(timeout) con la política de la pasarela, sin bloquear el event loop."""
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline_seconds
+        async with self._async_slot(deadline):
+            started = time.perf_counter()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    timeout = self._attempt_timeout(deadline)
+                    self._check_circuit()
+                    result = await asyncio.wait_for(fn(timeout), timeout)
+                except asyncio.CancelledError:
+                    # Quien llamó ya no espera la respuesta (p. ej. el cliente se desconectó)
+                    self.breaker.release_probe()
+                    self._count("cancelled")
+                    raise
+                except Exception as e:
+                    delay = None if isinstance(e, LLMUnavailableError) else self._after_failure(e, attempt, deadline)
+                    if delay is None:
+                        self._finish(started, False)
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                self._finish(started, True)
+                return result
+
+    async def stream_async(self, open_stream: Callable[[float], Awaitable[Any]]) -> AsyncIterator[Any]:
+        """
+        Itera un stream del LLM (open_stream(timeout) devuelve un iterable asíncrono)
+        ocupando un hueco de concurrencia mientras dura. Se reintenta hasta recibir el
+        primer fragmento; después los errores se propagan, porque ya se ha enviado parte
+        de la respuesta. Cada fragmento debe llegar en menos del timeout por intento.
+        """
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline_seconds
+        async with self._async_slot(deadline):
+            started = time.perf_counter()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    timeout = self._attempt_timeout(deadline)
+                    self._check_circuit()
+                    iterator = (await asyncio.wait_for(open_stream(timeout), timeout)).__aiter__()
+                    first = await asyncio.wait_for(iterator.__anext__(), timeout)
+                except StopAsyncIteration:
+                    self.breaker.record_success()
+                    self._finish(started, True)
+                    return
+                except asyncio.CancelledError:
+                    self.breaker.release_probe()
+                    self._count("cancelled")
+                    raise
+                except Exception as e:
+                    delay = None if isinstance(e, LLMUnavailableError) else self._after_failure(e, attempt, deadline)
+                    if delay is None:
+                        self._finish(started, False)
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                break
+
+            self.breaker.record_success()
+            try:
+                yield first
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), self.attempt_timeout_seconds)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+            except (TimeoutError, asyncio.TimeoutError):
+                self._count("timeouts")
+                self._finish(started, False)
+                raise LLMTimeoutError(f"El stream de {self.name} dejó de enviar fragmentos")
+            except (GeneratorExit, asyncio.CancelledError):
+                # El consumidor dejó de leer el stream antes de terminar
+                self._count("cancelled")
+                raise
+            except Exception:
+                self._finish(started, False)
+                raise
+            self._finish(started, True)
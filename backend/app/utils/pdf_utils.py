@@ -0,0 +1,69 @@
+"""
+Extracción de PDFs por páginas - Capa utilitaria
+Módulo ligero (solo pypdf) para que los procesos que extraen páginas en paralelo no
+tengan que importar los modelos de embeddings.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+import logging
+import multiprocessing
+
+import pypdf
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def page_text(page) -> str:
+    # extract_text() es lo más costoso de la lectura: se llama una sola vez por página
+    return (page.extract_text() or "").strip()
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    Extrae las páginas [start, end) de un PDF (se ejecuta en un proceso del pool).
+    Devuelve (número de página empezando en 1, texto) de las páginas con texto.
+    """
+    with open(file_path, "rb") as pdf_stream:
+        pdf_reader = pypdf.PdfReader(pdf_stream)
+        pages = []
+        for index in range(start, end):
+            text = page_text(pdf_reader.pages[index])
+            if text:
+                pages.append((index + 1, text))
+        return pages
+
+
+def iter_pdf_pages(file_path: str, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Genera (número de página, texto) de un PDF guardado en disco a medida que se extrae,
+    sin construir el texto completo en memoria.
+
+    Los PDFs de menos de settings.PDF_PARALLEL_MIN_PAGES páginas se leen en el propio
+    proceso. Los grandes se reparten en lotes de páginas entre varios procesos; como mucho
+    hay dos lotes por proceso en vuelo, así la memoria no crece con el tamaño del PDF y
+    las páginas se devuelven en orden según van estando listas.
+    """
+    workers = settings.PDF_EXTRACTION_WORKERS if workers is None else workers
+    with open(file_path, "rb") as pdf_stream:
+        pdf_reader = pypdf.PdfReader(pdf_stream)
+        page_count = len(pdf_reader.pages)
+        if workers <= 1 or page_count < settings.PDF_PARALLEL_MIN_PAGES:
+            for index, page in enumerate(pdf_reader.pages):
+                text = page_text(page)
+                if text:
+                    yield index + 1, text
+            return
+
+    batch = max(settings.PDF_PAGES_PER_TASK, 1)
+    ranges = deque((start, min(start + batch, page_count)) for start in range(0, page_count, batch))
+    logger.info(f"Extrayendo {page_count} páginas de {file_path} con {workers} procesos")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = deque()
+        while ranges or pending:
+            while ranges and len(pending) < workers * 2:
+                start, end = ranges.popleft()
+                pending.append(executor.submit(_extract_page_range, file_path, start, end))
+            yield from pending.popleft().result()
@@ -0,0 +1,279 @@
+"""
+Presupuesto de tokens del prompt - Capa utilitaria
+Ajusta el historial de la conversación y el material de la asignatura a un número máximo
+de tokens antes de enviarlos al modelo. Los turnos antiguos del historial se resumen
+(y, si aun así no caben, se descartan) y del material se descartan primero los chunks con
+menor similitud. Devuelve los tokens de cada sección del prompt.
+"""
+import logging
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# get_conversation_context une los chunks, ya ordenados por similitud descendente, con
+# "\n\n" y una cabecera "[Del documento ...]"; el contenido de un chunk puede tener saltos
+_CHUNK_BOUNDARY = re.compile(r"\n\n(?=\[Del documento )")
+# get_conversation_history escribe un turno por mensaje con el prefijo "Usuario: " o "Bot: "
+_TURN_BOUNDARY = re.compile(r"\n(?=(?:Usuario|Bot): )")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+SUMMARY_HEADER = "Resumen de turnos anteriores:"
+# Tokens máximos de cada turno resumido
+SUMMARY_TURN_TOKENS = 40
+
+_tokenizer_lock = threading.Lock()
+_tokenizer: Any = None
+_tokenizer_unavailable = False
+
+_stats_lock = threading.Lock()
+_stats = {
+    "prompts": 0,
+    "chunks_dropped": 0,
+    "turns_summarized": 0,
+    "turns_dropped": 0,
+    "over_budget": 0,
+    "section_tokens": {}
+}
+
+
+class FittedSections(NamedTuple):
+    """
+    Historial y material ajustados al presupuesto, con los tokens de cada uno y lo que
+    se ha recortado para que quepan.
+    """
+    conversation_history: str
+    context: str
+    history_tokens: int
+    context_tokens: int
+    chunks_kept: int
+    chunks_dropped: int
+    turns_summarized: int
+    turns_dropped: int
+
+
+def _get_tokenizer() -> Any:
+    """
+    Carga una sola vez el tokenizador de settings.PROMPT_TOKENIZER_NAME. Devuelve None
+    si no se puede cargar (sin transformers, sin red o sin acceso al modelo).
+    """
+    global _tokenizer, _tokenizer_unavailable
+    if _tokenizer is not None or _tokenizer_unavailable:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None and not _tokenizer_unavailable:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(settings.PROMPT_TOKENIZER_NAME)
+                logger.info(f"Tokenizador del prompt cargado: {settings.PROMPT_TOKENIZER_NAME}")
+            except Exception as e:
+                _tokenizer_unavailable = True
+                logger.error(
+                    f"No se pudo cargar el tokenizador {settings.PROMPT_TOKENIZER_NAME}: el presupuesto "
+                    f"del prompt usará una ESTIMACIÓN de {settings.PROMPT_CHARS_PER_TOKEN} caracteres por "
+                    f"token, no el recuento real. {type(e).__name__}: {e}"
+                )
+    return _tokenizer
+
+
+def load_prompt_tokenizer() -> bool:
+    """
+    Carga el tokenizador del prompt (se llama al arrancar, para que la descarga no ocurra
+    dentro de una petición). Devuelve False si se usará la estimación por caracteres.
+    """
+    return _get_tokenizer() is not None
+
+
+def _encode(text: str) -> Optional[List[int]]:
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return None
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+def count_tokens(text: str) -> int:
+    """Número de tokens de text según el tokenizador del modelo (o su estimación)."""
+    if not text:
+        return 0
+    ids = _encode(text)
+    if ids is None:
+        return int(len(text) / settings.PROMPT_CHARS_PER_TOKEN + 0.5)
+    return len(ids)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Corta text para que no pase de max_tokens, terminando en "…" si se ha cortado."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    ids = _encode(text)
+    if ids is None:
+        cut = text[:int(max(max_tokens - 1, 0) * settings.PROMPT_CHARS_PER_TOKEN)]
+    else:
+        cut = _get_tokenizer().decode(ids[:max(max_tokens - 1, 0)])
+    return cut.rstrip() + "…"
+
+
+def split_context_chunks(context: str) -> List[str]:
+    """Separa el contexto de get_conversation_context en sus chunks, en el mismo orden."""
+    if not context or not context.strip():
+        return []
+    return _CHUNK_BOUNDARY.split(context)
+
+
+def split_history_turns(conversation_history: str) -> List[str]:
+    """Separa el historial de get_conversation_history en turnos, del más antiguo al más reciente."""
+    if not conversation_history or not conversation_history.strip():
+        return []
+    return _TURN_BOUNDARY.split(conversation_history.strip())
+
+
+def summarize_turn(turn: str, max_tokens: int = SUMMARY_TURN_TOKENS) -> str:
+    """
+    Resumen extractivo de un turno: el interlocutor y la primera oración del mensaje,
+    en una sola línea y con como mucho max_tokens tokens.
+    """
+    speaker, _, text = turn.partition(": ")
+    text = " ".join(text.split())
+    first_sentence = _SENTENCE_END.split(text, maxsplit=1)[0]
+    return truncate_to_tokens(f"- {speaker}: {first_sentence}", max_tokens)
+
+
+def fit_history(conversation_history: str, max_tokens: int, recent_turns: int) -> Tuple[str, int, int, int]:
+    """
+    Ajusta el historial a max_tokens. Se conservan literales los recent_turns turnos más
+    recientes que quepan; los anteriores se resumen, del más reciente al más antiguo,
+    mientras quepan, y el resto se descarta. El último turno (la pregunta actual) se
+    conserva siempre, recortado si hace falta.
+
+    Returns:
+        (historial, tokens, turnos resumidos, turnos descartados)
+    """
+    turns = split_history_turns(conversation_history)
+    if not turns:
+        return "", 0, 0, 0
+    if max_tokens <= 0:
+        return "", 0, 0, len(turns)
+
+    # Cada turno ocupa su texto más el salto de línea que lo separa del siguiente
+    newest = truncate_to_tokens(turns[-1], max_tokens)
+    used = count_tokens(newest)
+    verbatim = [newest]
+    index = len(turns) - 2
+    while index >= 0 and len(verbatim) < max(recent_turns, 1):
+        cost = count_tokens(turns[index]) + 1
+        if used + cost > max_tokens:
+            break
+        verbatim.insert(0, turns[index])
+        used += cost
+        index -= 1
+
+    summaries: List[str] = []
+    if index >= 0:
+        used += count_tokens(SUMMARY_HEADER) + 1
+        while index >= 0:
+            summary = summarize_turn(turns[index])
+            cost = count_tokens(summary) + 1
+            if used + cost > max_tokens:
+                break
+            summaries.insert(0, summary)
+            used += cost
+            index -= 1
+        if not summaries:
+            used -= count_tokens(SUMMARY_HEADER) + 1
+
+    parts = ([SUMMARY_HEADER] + summaries if summaries else []) + verbatim
+    return "\n".join(parts), used, len(summaries), index + 1
+
+
+def fit_context(context: str, max_tokens: int) -> Tuple[str, int, int, int]:
+    """
+    Ajusta el material a max_tokens conservando los chunks en orden de similitud hasta
+    que el siguiente no cabe; los de menor similitud se descartan. Si ni el primero
+    cabe, se recorta.
+
+    Returns:
+        (contexto, tokens, chunks conservados, chunks descartados)
+    """
+    chunks = split_context_chunks(context)
+    if not chunks:
+        return context or "", 0, 0, 0
+    if max_tokens <= 0:
+        return "", 0, 0, len(chunks)
+
+    kept: List[str] = []
+    used = 0
+    for chunk in chunks:
+        cost = count_tokens(chunk) + (1 if kept else 0)
+        if used + cost > max_tokens:
+            break
+        kept.append(chunk)
+        used += cost
+
+    if not kept:
+        kept = [truncate_to_tokens(chunks[0], max_tokens)]
+        used = count_tokens(kept[0])
+    return "\n\n".join(kept), used, len(kept), len(chunks) - len(kept)
+
+
+def fit_prompt_sections(
+    fixed_tokens: int,
+    context: str,
+    conversation_history: str = "",
+    budget: Optional[int] = None,
+    history_budget: Optional[int] = None,
+    recent_turns: Optional[int] = None
+) -> FittedSections:
+    """
+    Reparte el presupuesto del prompt entre historial y material una vez descontados
+    los fixed_tokens de las partes que no se recortan (instrucciones, asignatura y
+    pregunta). El historial se ajusta primero a su propio límite y el material ocupa
+    lo que quede.
+    """
+    budget = settings.PROMPT_TOKEN_BUDGET if budget is None else budget
+    history_budget = settings.PROMPT_HISTORY_TOKEN_BUDGET if history_budget is None else history_budget
+    recent_turns = settings.PROMPT_HISTORY_RECENT_TURNS if recent_turns is None else recent_turns
+
+    available = max(budget - fixed_tokens, 0)
+    history, history_tokens, summarized, turns_dropped = fit_history(
+        conversation_history, min(history_budget, available), recent_turns
+    )
+    context, context_tokens, kept, chunks_dropped = fit_context(context, available - history_tokens)
+    return FittedSections(
+        history, context, history_tokens, context_tokens, kept, chunks_dropped, summarized, turns_dropped
+    )
+
+
+def record_prompt_tokens(section_tokens: Dict[str, int], fitted: Optional[FittedSections] = None) -> None:
+    """Acumula los tokens por sección de un prompt enviado al modelo."""
+    with _stats_lock:
+        _stats["prompts"] += 1
+        for section, tokens in section_tokens.items():
+            _stats["section_tokens"][section] = _stats["section_tokens"].get(section, 0) + tokens
+        if section_tokens.get("total", 0) > settings.PROMPT_TOKEN_BUDGET:
+            _stats["over_budget"] += 1
+        if fitted is not None:
+            _stats["chunks_dropped"] += fitted.chunks_dropped
+            _stats["turns_summarized"] += fitted.turns_summarized
+            _stats["turns_dropped"] += fitted.turns_dropped
+
+
+def get_prompt_token_stats() -> Dict[str, Any]:
+    """
+    Tokens medios por sección de los prompts de este proceso, recortes aplicados y
+    prompts que superaron el presupuesto (p. ej. instrucciones más largas que él).
+    """
+    with _stats_lock:
+        prompts = _stats["prompts"]
+        stats = {key: value for key, value in _stats.items() if key != "section_tokens"}
+        stats["mean_section_tokens"] = {
+            section: round(tokens / prompts, 1) for section, tokens in _stats["section_tokens"].items()
+        } if prompts else {}
+    stats["budget"] = settings.PROMPT_TOKEN_BUDGET
+    stats["history_budget"] = settings.PROMPT_HISTORY_TOKEN_BUDGET
+    stats["tokenizer"] = settings.PROMPT_TOKENIZER_NAME if _tokenizer is not None else "estimación por caracteres"
+    return stats
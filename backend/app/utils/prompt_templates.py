@@ -0,0 +1,158 @@
+"""
+Plantillas de prompts - Capa utilitaria
+Registro de las plantillas de prompt del tutor. Cada plantilla separa las instrucciones
+fijas (system), que se preparan una sola vez al importar el módulo, del cuerpo con los
+huecos que cambian en cada llamada (asignatura, historial, material y pregunta). El cuerpo
+se precompila en fragmentos literales y nombres de hueco, así que renderizar solo une
+cadenas. static_prefix permite enviar las instrucciones como system_instruction o
+guardarlas en la caché de contexto del proveedor en lugar de repetirlas en cada petición.
+"""
+import inspect
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+
+class PromptTemplate:
+    """
+    Plantilla con instrucciones fijas y un cuerpo con huecos {nombre}. Los huecos que no
+    se pasan a render se dejan vacíos; los valores se insertan tal cual, sin interpretar
+    llaves, de modo que el material puede contener código.
+    """
+
+    def __init__(self, name: str, system: str, body: str):
+        self.name = name
+        self.system = inspect.cleandoc(system)
+        self._parts: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in Formatter().parse(inspect.cleandoc(body))
+        ]
+        self.slots = tuple(field for _, field in self._parts if field)
+
+    @property
+    def static_prefix(self) -> str:
+        """Instrucciones fijas, idénticas en todas las llamadas."""
+        return self.system
+
+    def render_dynamic(self, **values: str) -> str:
+        """Solo el cuerpo con los huecos rellenos (para enviar junto a static_prefix cacheado)."""
+        unknown = set(values) - set(self.slots)
+        if unknown:
+            raise KeyError(f"Huecos desconocidos en la plantilla '{self.name}': {', '.join(sorted(unknown))}")
+        return "".join(literal + ((values.get(field) or "") if field else "") for literal, field in self._parts)
+
+    def render(self, **values: str) -> str:
+        """Prompt completo: instrucciones fijas seguidas del cuerpo."""
+        return f"{self.system}\n\n{self.render_dynamic(**values)}"
+
+
+CHAT_TEMPLATE = PromptTemplate(
+    name="chat",
+    system="""
+        ### Instrucciones:
+        Eres un tutor virtual especializado en educación. Tu objetivo es ayudar a los estudiantes no solo respondiendo preguntas, sino también realizando diversas tareas educativas basadas en el material de estudio proporcionado. Mantén un tono profesional, pedagógico y motivador.
+
+        **Capacidades que tienes:**
+        - Responder preguntas sobre el contenido de la asignatura
+        - Generar exámenes y cuestionarios con preguntas de opción múltiple, verdadero/falso, y desarrollo
+        - Crear resúmenes del material de estudio
+        - Elaborar esquemas y mapas conceptuales en texto
+        - Proporcionar ejercicios de práctica
+        - Explicar conceptos complejos de manera sencilla
+        - Crear guías de estudio
+        - Sugerir técnicas de memorización y aprendizaje
+        - Identificar puntos clave y conceptos importantes
+
+        **Instrucciones de funcionamiento:**
+        Debes basar todas tus respuestas y actividades *únicamente* en la información contenida en el 'Contexto' proporcionado (material de la asignatura). No utilices conocimientos externos ni información que no esté presente en los documentos.
+
+        Si la solicitud no puede ser completada con la información disponible, explica qué información adicional sería necesaria.
+
+        Cuando generes exámenes o cuestionarios:
+        - Incluye diferentes tipos de preguntas (opción múltiple, verdadero/falso, desarrollo)
+        - Proporciona las respuestas correctas al final
+        - Ajusta la dificultad según el nivel del contenido
+
+        Cuando hagas resúmenes:
+        - Identifica los puntos más importantes
+        - Organiza la información de manera lógica y jerárquica
+        - Utiliza bullet points o numeración cuando sea apropiado
+
+        Responde de manera directa sin mencionar constantemente que te basas en el contexto proporcionado.
+        """,
+    body="""
+        {subject_info}
+        ### Historial de la Conversación:
+        {conversation_history}
+
+        ### Material de la Asignatura:
+        {context}
+
+        ### Solicitud del Estudiante:
+        {user_question}
+
+        ### Respuesta:
+        """
+)
+
+# La pregunta va en el cuerpo, no en las instrucciones, para que estas sean fijas
+IMAGE_QUESTION_TEMPLATE = PromptTemplate(
+    name="image_question",
+    system="""
+        ### Instrucciones:
+        Eres un tutor virtual especializado en educación. Analiza la imagen adjunta en relación con la pregunta del estudiante. Basándote en el contexto proporcionado y la imagen, proporciona una respuesta clara, concisa y pedagógica.
+        """,
+    body="""
+        {subject_info}
+        **Contexto de la Asignatura:**
+        {context}
+
+        ### Pregunta del Estudiante:
+        {user_question}
+
+        ### Respuesta:
+        """
+)
+
+# Imagen sin pregunta directa: caso de profesor o análisis general
+IMAGE_DESCRIPTION_TEMPLATE = PromptTemplate(
+    name="image_description",
+    system="""
+        ### Instrucciones:
+        Eres un tutor virtual especializado en educación. Describe y analiza el contenido de la imagen adjunta en el contexto de la asignatura. Identifica los elementos clave y explica su posible relevancia educativa.
+        """,
+    body="""
+        {subject_info}
+        **Contexto de la Asignatura:**
+        {context}
+
+        ### Respuesta:
+        """
+)
+
+PROMPT_TEMPLATES: Dict[str, PromptTemplate] = {
+    template.name: template
+    for template in (CHAT_TEMPLATE, IMAGE_QUESTION_TEMPLATE, IMAGE_DESCRIPTION_TEMPLATE)
+}
+
+
+def select_template(has_image: bool, user_question: Optional[str]) -> PromptTemplate:
+    """Plantilla según haya imagen y pregunta."""
+    if not has_image:
+        return CHAT_TEMPLATE
+    if user_question and user_question.strip():
+        return IMAGE_QUESTION_TEMPLATE
+    return IMAGE_DESCRIPTION_TEMPLATE
+
+
+def format_subject_info(asignatura: Optional[dict]) -> str:
+    """Bloque con los datos de la asignatura para el hueco subject_info ("" si no hay)."""
+    if not asignatura or not isinstance(asignatura, dict):
+        return ""
+    lines = [
+        "**Información de la Asignatura:**",
+        f"- Nombre: {asignatura.get('name', 'No especificado')}",
+        f"- Código: {asignatura.get('code', 'No especificado')}",
+        f"- Descripción: {asignatura.get('description', 'No especificada')}"
+    ]
+    if asignatura.get('summary') and asignatura['summary'].strip():
+        lines.append(f"- Resumen de la asignatura: {asignatura['summary']}")
+    return "\n".join(lines) + "\n"
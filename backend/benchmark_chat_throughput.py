@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Benchmark de rendimiento del flujo completo del chat con el proveedor de LLM simulado.
+
+Simula N estudiantes que envían preguntas a la vez, cada uno en su propia conversación de
+la asignatura indicada, y recorre el mismo camino que las rutas del chat (embedding de la
+pregunta, recuperación de contexto, historial, prompt, pasarela del LLM y guardado de los
+mensajes). El LLM es el proveedor "fake", con la latencia del perfil elegido, así que no
+hace falta clave de API y el resultado mide el coste propio de la aplicación. Muestra:
+- el rendimiento (turnos/s) y la latencia p50/p95 de cada turno,
+- el tiempo hasta el primer fragmento (modo stream),
+- el tiempo propio antes de llamar al LLM (p50/p95), que es la sobrecarga de la aplicación,
+- las métricas de la pasarela del LLM y los tokens medios por sección del prompt.
+
+La caché semántica de respuestas se desactiva (las preguntas se repiten) salvo con
+--answer-cache. Las conversaciones creadas se borran al terminar salvo con --keep.
+Requiere la base de datos y una asignatura con documentos indexados.
+
+Uso:
+    python benchmark_chat_throughput.py --user-id 1 --subject-id 3 [--concurrency 16] [--turns 128]
+        [--profile flash] [--output-tokens 200] [--mode stream|async] [--answer-cache] [--keep]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import os
+import sys
+import time
+sys.path.append('.')
+
+import numpy as np
+
+TOPICS = ["una pila", "una cola", "un árbol AVL", "un grafo dirigido", "una tabla hash", "un montículo"]
+
+# Instantes del turno en curso de cada tarea (inicio y llamada al LLM)
+turn_marks = contextvars.ContextVar("turn_marks")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark del flujo del chat con el LLM simulado")
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--subject-id", type=int, required=True)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=128)
+    parser.add_argument("--profile", default="flash")
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--mode", choices=["stream", "async"], default="stream")
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--keep", action="store_true")
+    return parser.parse_args()
+
+
+def make_question(i):
+    return f"¿Cómo se implementa {TOPICS[i % len(TOPICS)]} y qué coste tienen sus operaciones? (pregunta {i})"
+
+
+def percentiles(values):
+    return np.percentile(np.array(values) * 1000, [50, 95]) if values else (0.0, 0.0)
+
+
+def main():
+    args = parse_args()
+    # La configuración se lee al importar la aplicación
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["LLM_FAKE_PROFILE"] = args.profile
+    os.environ["LLM_FAKE_OUTPUT_TOKENS"] = str(args.output_tokens)
+    if not args.answer_cache:
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+    from app.core.database import SessionLocal
+    from app.services import api_service
+    from app.services.chat_service import (
+        add_message_and_generate_response_async,
+        create_conversation,
+        delete_conversation,
+        stream_message_and_generate_response
+    )
+    from app.services.answer_cache_service import get_answer_cache_stats
+    from app.utils.prompt_budget import get_prompt_token_stats
+
+    provider = api_service.llm_provider
+
+    # Marca el instante en que cada turno llega al LLM
+    def marked(method):
+        async def wrapper(*call_args, **kwargs):
+            turn_marks.get()["llm"] = time.perf_counter()
+            return await method(*call_args, **kwargs)
+        return wrapper
+
+    provider.generate_async = marked(provider.generate_async)
+    provider.open_stream = marked(provider.open_stream)
+
+    db = SessionLocal()
+    conversation_ids = [create_conversation(db, args.user_id, args.subject_id).id for _ in range(args.concurrency)]
+    db.close()
+
+    latencies, first_tokens, before_llm = [], [], []
+
+    async def run_turn(conversation_id, question):
+        marks = {"start": time.perf_counter()}
+        turn_marks.set(marks)
+        if args.mode == "stream":
+            async for event, _ in stream_message_and_generate_response(conversation_id, args.user_id, question):
+                if event == "token" and "first_token" not in marks:
+                    marks["first_token"] = time.perf_counter()
+        else:
+            session = SessionLocal()
+            try:
+                await add_message_and_generate_response_async(session, conversation_id, args.user_id, question)
+                session.commit()
+            finally:
+                session.close()
+        end = time.perf_counter()
+        latencies.append(end - marks["start"])
+        if "first_token" in marks:
+            first_tokens.append(marks["first_token"] - marks["start"])
+        if "llm" in marks:
+            before_llm.append(marks["llm"] - marks["start"])
+
+    async def student(index, turns):
+        for turn in turns:
+            await run_turn(conversation_ids[index], make_question(turn))
+
+    async def run_all():
+        assignments = [list(range(i, args.turns, args.concurrency)) for i in range(args.concurrency)]
+        await asyncio.gather(*(student(i, turns) for i, turns in enumerate(assignments)))
+
+    try:
+        start = time.perf_counter()
+        asyncio.run(run_all())
+        elapsed = time.perf_counter() - start
+    finally:
+        if not args.keep:
+            db = SessionLocal()
+            for conversation_id in conversation_ids:
+                delete_conversation(db, conversation_id)
+            db.close()
+
+    print(f"{args.turns} turnos, {args.concurrency} estudiantes concurrentes, modo {args.mode}, "
+          f"perfil '{args.profile}' ({args.output_tokens} tokens por respuesta)")
+    print(f"\nRendimiento: {args.turns / elapsed:.2f} turnos/s en {elapsed:.1f}s")
+    print(f"\n{'medida':<28}{'p50 (ms)':>12}{'p95 (ms)':>12}")
+    for name, values in (("turno completo", latencies), ("primer fragmento", first_tokens),
+                         ("antes de llamar al LLM", before_llm)):
+        if values:
+            p50, p95 = percentiles(values)
+            print(f"{name:<28}{p50:>12.1f}{p95:>12.1f}")
+
+    print(f"\nPasarela del LLM: {api_service.llm_gateway.stats()}")
+    print(f"Tokens del prompt: {get_prompt_token_stats()['mean_section_tokens']}")
+    if args.answer_cache:
+        print(f"Caché de respuestas: {get_answer_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
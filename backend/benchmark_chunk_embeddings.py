@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los modos de embeddings de chunks (pooled / auto / reencode).
+
+Divide un texto (o PDF) con semantic_split_sentences y compara, para cada modo:
+- el tiempo de cálculo de los embeddings de los chunks,
+- la calidad de recuperación: cada oración de un chunk se usa como consulta y se mide
+  recall@k y MRR del chunk al que pertenece (similitud coseno en memoria),
+- la similitud coseno entre el embedding del modo y el recodificado con el modelo.
+
+Uso:
+    python benchmark_chunk_embeddings.py documento.pdf [--k 5] [--min-coherence 0.85]
+"""
+
+import argparse
+import sys
+import time
+sys.path.append('.')
+
+import numpy as np
+
+from app.services.embedding_service import (
+    CHUNK_EMBEDDING_MODES,
+    embed_chunks,
+    load_sentence_transformer_model_singleton,
+    semantic_split_sentences
+)
+from app.utils.document_utils import extract_text_from_pdf_path
+
+
+def load_text(path):
+    if path.lower().endswith(".pdf"):
+        return extract_text_from_pdf_path(path)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def normalize(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def retrieval_quality(chunk_embeddings, sentence_embeddings, groups, k):
+    """recall@k y MRR usando cada oración como consulta de su propio chunk"""
+    owners = np.concatenate([np.full(end - start, i) for i, (start, end) in enumerate(groups)])
+    scores = normalize(sentence_embeddings) @ normalize(chunk_embeddings).T
+    ranking = np.argsort(-scores, axis=1)
+    ranks = np.argmax(ranking == owners[:, None], axis=1) + 1
+    return float(np.mean(ranks <= k)), float(np.mean(1.0 / ranks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de embeddings de chunks")
+    parser.add_argument("path", help="Fichero de texto o PDF")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--min-coherence", type=float, default=0.85)
+    args = parser.parse_args()
+
+    text = load_text(args.path)
+    model = load_sentence_transformer_model_singleton()
+
+    start = time.perf_counter()
+    chunks, groups, sentence_embeddings, sentences = semantic_split_sentences(text, model)
+    split_seconds = time.perf_counter() - start
+    print(f"{len(sentences)} oraciones, {len(chunks)} chunks (división: {split_seconds:.2f}s)")
+    if not chunks:
+        return
+
+    results = {}
+    for mode in CHUNK_EMBEDDING_MODES:
+        start = time.perf_counter()
+        embeddings, reencoded = embed_chunks(
+            model, chunks, groups, sentence_embeddings, sentences,
+            mode=mode, min_coherence=args.min_coherence
+        )
+        results[mode] = (embeddings, reencoded, time.perf_counter() - start)
+
+    reference = normalize(results["reencode"][0])
+    print(f"\n{'modo':<10}{'tiempo (s)':>12}{'recodif.':>10}{'recall@' + str(args.k):>12}{'MRR':>8}{'cos vs reencode':>18}")
+    for mode, (embeddings, reencoded, seconds) in results.items():
+        recall, mrr = retrieval_quality(embeddings, sentence_embeddings, groups, args.k)
+        agreement = float(np.mean(np.sum(normalize(embeddings) * reference, axis=1)))
+        print(f"{mode:<10}{seconds:>12.3f}{reencoded:>10}{recall:>12.3f}{mrr:>8.3f}{agreement:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
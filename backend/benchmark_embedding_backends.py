@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los backends de inferencia de embeddings (torch / torch-int8 / onnx / onnx-int8).
+
+Agrupa las oraciones de un texto (o PDF) en chunks y usa oraciones sueltas como consultas.
+Para cada backend mide:
+- el rendimiento al codificar los chunks por lotes (textos/s),
+- la latencia de una consulta suelta (p50/p95), que es lo que espera cada mensaje del chat,
+- recall@k frente a PyTorch: fracción de los k chunks más similares a cada consulta según
+  PyTorch que el backend también devuelve entre sus k primeros,
+- la similitud coseno media entre los embeddings del backend y los de PyTorch.
+
+Los backends que no se pueden cargar (p. ej. sin onnxruntime) se omiten.
+
+Uso:
+    python benchmark_embedding_backends.py documento.pdf [--k 5] [--queries 200] [--backends torch onnx-int8]
+"""
+
+import argparse
+import sys
+import time
+sys.path.append('.')
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embedding_backends import EMBEDDING_BACKENDS
+from app.services.embedding_service import _split_sentences
+from app.utils.document_utils import extract_text_from_pdf_path
+
+
+def load_text(path):
+    if path.lower().endswith(".pdf"):
+        return extract_text_from_pdf_path(path)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def normalize(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def top_k(query_embeddings, chunk_embeddings, k):
+    scores = normalize(query_embeddings) @ normalize(chunk_embeddings).T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def measure(model, chunks, queries):
+    model.encode(queries[:8])
+    start = time.perf_counter()
+    chunk_embeddings = np.asarray(model.encode(chunks, batch_size=32), dtype=np.float32)
+    throughput = len(chunks) / (time.perf_counter() - start)
+
+    latencies, query_embeddings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_embeddings.append(model.encode(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return chunk_embeddings, np.asarray(query_embeddings, dtype=np.float32), throughput, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de embeddings")
+    parser.add_argument("path", help="Fichero de texto o PDF")
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--sentences-per-chunk", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS))
+    args = parser.parse_args()
+
+    sentences = [sentence for sentence in _split_sentences(load_text(args.path)) if len(sentence) > 20]
+    size = args.sentences_per_chunk
+    chunks = [" ".join(sentences[i:i + size]) for i in range(0, len(sentences), size)]
+    rng = np.random.default_rng(0)
+    queries = [sentences[i] for i in rng.choice(len(sentences), min(args.queries, len(sentences)), replace=False)]
+    print(f"{len(chunks)} chunks, {len(queries)} consultas, modelo {args.model}")
+
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    results = {}
+    for backend in backends:
+        try:
+            model = EMBEDDING_BACKENDS[backend](args.model)
+        except Exception as e:
+            print(f"Backend '{backend}' omitido: {e}")
+            continue
+        results[backend] = measure(model, chunks, queries)
+
+    reference_chunks, reference_queries = results["torch"][0], results["torch"][1]
+    reference_top = top_k(reference_queries, reference_chunks, args.k)
+
+    print(f"\n{'backend':<12}{'textos/s':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'recall@' + str(args.k):>11}{'cos vs torch':>14}")
+    for backend, (chunk_embeddings, query_embeddings, throughput, latencies) in results.items():
+        backend_top = top_k(query_embeddings, chunk_embeddings, args.k)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(reference_top, backend_top)])
+        agreement = float(np.mean(np.sum(normalize(chunk_embeddings) * normalize(reference_chunks), axis=1)))
+        p50, p95 = np.percentile(latencies, [50, 95])
+        print(f"{backend:<12}{throughput:>10.1f}{p50:>10.1f}{p95:>10.1f}{recall:>11.3f}{agreement:>14.4f}")
+
+
+if __name__ == "__main__":
+    main()
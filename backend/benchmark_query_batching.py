@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark del agrupador de embeddings de consultas.
+
+Lanza N hilos que codifican preguntas distintas a la vez y compara:
+- sin agrupar: cada hilo llama a model.encode(texto), un lote de uno por pregunta,
+- agrupado: cada hilo envía la pregunta al EmbeddingBatcher y espera su Future.
+
+Para cada caso muestra el rendimiento (consultas/s), la latencia p50/p95 por consulta
+y, en el agrupado, el tamaño medio de lote.
+
+Uso:
+    python benchmark_query_batching.py [--concurrency 32] [--queries 512] [--max-batch 32] [--wait-ms 5]
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append('.')
+
+import numpy as np
+
+from app.services.embedding_service import load_sentence_transformer_model_singleton
+from app.utils.embedding_batcher import EmbeddingBatcher
+
+TOPICS = ["una pila", "una cola", "un árbol AVL", "un grafo dirigido", "una tabla hash", "un montículo"]
+
+
+def make_queries(count):
+    return [f"¿Cómo se implementa {TOPICS[i % len(TOPICS)]} en el ejercicio {i}?" for i in range(count)]
+
+
+def run(queries, concurrency, encode_one):
+    latencies = []
+
+    def timed(query):
+        start = time.perf_counter()
+        encode_one(query)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, queries))
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return len(queries) / elapsed, np.percentile(latencies_ms, 50), np.percentile(latencies_ms, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de micro-lotes de embeddings de consultas")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    model = load_sentence_transformer_model_singleton()
+    model.encode(["calentamiento"])
+    queries = make_queries(args.queries)
+
+    batcher = EmbeddingBatcher(
+        lambda model_name, texts: model.encode(texts, batch_size=len(texts)),
+        max_batch_size=args.max_batch,
+        max_wait_ms=args.wait_ms
+    )
+    results = {
+        "sin agrupar": run(queries, args.concurrency, model.encode),
+        "agrupado": run(queries, args.concurrency, lambda query: batcher.submit("modelo", query).result())
+    }
+    batcher.close()
+
+    print(f"{args.queries} consultas, {args.concurrency} hilos concurrentes")
+    print(f"\n{'modo':<14}{'consultas/s':>14}{'p50 (ms)':>12}{'p95 (ms)':>12}")
+    for mode, (throughput, p50, p95) in results.items():
+        print(f"{mode:<14}{throughput:>14.1f}{p50:>12.1f}{p95:>12.1f}")
+    stats = batcher.stats()
+    print(f"\nLotes: {stats['batches']}, tamaño medio {stats['mean_batch']}, máximo {stats['largest_batch']}")
+    print(f"Mejora de rendimiento: x{results['agrupado'][0] / results['sin agrupar'][0]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.core.database import InstrumentedQueuePool, _connection_options, pool_metrics
+
+class TestInstrumentedPool:
+    """Tests para las métricas del pool de conexiones"""
+
+    def setup_method(self):
+        pool_metrics.reset()
+
+    def test_wait_time_is_recorded(self):
+        """Cada obtención de conexión registra su tiempo de espera"""
+        pool = InstrumentedQueuePool(creator=MagicMock, pool_size=1, max_overflow=0)
+
+        connection = pool.connect()
+        connection.close()
+
+        snapshot = pool_metrics.snapshot()
+        assert snapshot["wait_ms_max"] >= 0.0
+        assert snapshot["timeouts"] == 0
+
+    def test_saturated_pool_counts_timeouts(self):
+        """Con el pool agotado, la espera termina en timeout y se contabiliza"""
+        pool = InstrumentedQueuePool(creator=MagicMock, pool_size=1, max_overflow=0, timeout=0.05)
+        held = pool.connect()
+
+        with pytest.raises(PoolTimeoutError):
+            pool.connect()
+
+        snapshot = pool_metrics.snapshot()
+        assert snapshot["timeouts"] == 1
+        assert snapshot["wait_ms_max"] >= 50
+        held.close()
+
+    def test_connection_options_include_statement_timeout(self):
+        """El statement_timeout se envía al conectar solo si está configurado"""
+        with patch('app.core.database.settings.DB_STATEMENT_TIMEOUT_MS', 5000):
+            assert "-c statement_timeout=5000" in _connection_options()
+        with patch('app.core.database.settings.DB_STATEMENT_TIMEOUT_MS', 0):
+            assert "statement_timeout" not in _connection_options()
@@ -0,0 +1,36 @@
+import re
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models.models import DocumentChunk, Message, Vector
+
+class TestVectorType:
+    """Pruebas para el tipo Vector y la carga diferida de embeddings"""
+
+    def test_result_processor_returns_float32_array(self):
+        """El texto de pgvector se decodifica a un array NumPy float32"""
+        process = Vector(3).result_processor(postgresql.dialect(), None)
+
+        result = process("[0.5,-1.25,3]")
+
+        assert isinstance(result, np.ndarray)
+        assert result.dtype == np.float32
+        assert result.tolist() == [0.5, -1.25, 3.0]
+        assert process(None) is None
+
+    def test_bind_processor_accepts_numpy_arrays(self):
+        """Los arrays NumPy se envían con el formato de texto de pgvector"""
+        process = Vector(2).bind_processor(postgresql.dialect())
+
+        assert process(np.array([0.5, 1.0], dtype=np.float32)) == "[0.5,1.0]"
+        assert process([1, 2]) == "[1,2]"
+
+    def test_embeddings_are_deferred(self):
+        """Las consultas ORM por defecto no cargan los embeddings"""
+        chunk_sql = str(select(DocumentChunk).compile(dialect=postgresql.dialect()))
+        message_sql = str(select(Message).compile(dialect=postgresql.dialect()))
+
+        assert not re.search(r"\.embedding\b", chunk_sql)
+        assert not re.search(r"\.embedding\b", message_sql)
@@ -0,0 +1,106 @@
+from unittest.mock import MagicMock, patch
+
+from app.crud.crud_vector import AnswerLookup, invalidate_subject_answers
+from app.services.answer_cache_service import (
+    AnswerCacheLookup,
+    get_answer_cache_stats,
+    lookup_cached_answer,
+    store_answer
+)
+
+EMBEDDING = [0.1] * 768
+QUESTION = "¿Qué es un tipo abstracto de datos?"
+
+@patch('app.services.answer_cache_service.get_active_embedding_model', return_value='modelo')
+@patch('app.services.answer_cache_service.settings.SEMANTIC_CACHE_MIN_SIMILARITY', 0.95)
+class TestLookupCachedAnswer:
+    """Tests para la consulta de la caché semántica de respuestas"""
+
+    @patch('app.services.answer_cache_service.record_cached_answer_hit')
+    @patch('app.services.answer_cache_service.find_cached_answer', return_value=AnswerLookup(4, 9, "Un TAD es...", 0.97))
+    def test_similar_question_is_a_hit(self, mock_find, mock_hit, mock_active):
+        """Una pregunta por encima del umbral devuelve la respuesta guardada"""
+        before = get_answer_cache_stats()
+        db = MagicMock()
+
+        lookup = lookup_cached_answer(db, 3, QUESTION, EMBEDDING)
+
+        assert lookup.answer == "Un TAD es..."
+        assert lookup.documents_version == 4
+        mock_find.assert_called_once()
+        assert mock_find.call_args[0][1:4] == (3, EMBEDDING, "modelo")
+        mock_hit.assert_called_once_with(db, 9)
+        assert get_answer_cache_stats()["hits"] == before["hits"] + 1
+
+    @patch('app.services.answer_cache_service.record_cached_answer_hit')
+    @patch('app.services.answer_cache_service.find_cached_answer', return_value=AnswerLookup(4, 9, "Otra respuesta", 0.90))
+    def test_below_threshold_is_a_miss(self, mock_find, mock_hit, mock_active):
+        """Por debajo del umbral hay que generar la respuesta, con la versión leída"""
+        lookup = lookup_cached_answer(MagicMock(), 3, QUESTION, EMBEDDING)
+
+        assert lookup.answer is None
+        assert (lookup.subject_id, lookup.documents_version, lookup.embedding_model) == (3, 4, "modelo")
+        mock_hit.assert_not_called()
+
+    @patch('app.services.answer_cache_service.find_cached_answer')
+    def test_uncacheable_questions_skip_the_cache(self, mock_find, mock_active):
+        """Sin asignatura, con imagen o con preguntas muy cortas no se consulta la caché"""
+        db = MagicMock()
+
+        assert lookup_cached_answer(db, None, QUESTION, EMBEDDING) is None
+        assert lookup_cached_answer(db, 3, QUESTION, EMBEDDING, has_image=True) is None
+        assert lookup_cached_answer(db, 3, "¿y un ejemplo?", EMBEDDING) is None
+        assert lookup_cached_answer(db, 3, QUESTION, []) is None
+        mock_find.assert_not_called()
+
+    @patch('app.services.answer_cache_service.find_cached_answer', side_effect=Exception("BD caída"))
+    def test_errors_do_not_block_the_answer(self, mock_find, mock_active):
+        """Un fallo de la caché se trata como pregunta no cacheable"""
+        db = MagicMock()
+
+        assert lookup_cached_answer(db, 3, QUESTION, EMBEDDING) is None
+        db.rollback.assert_called_once()
+
+class TestStoreAnswer:
+    """Tests para el guardado de respuestas en la caché"""
+
+    @patch('app.services.answer_cache_service.save_cached_answer')
+    def test_miss_is_stored_with_the_version_read_before_generating(self, mock_save):
+        """La respuesta se guarda con la versión de los documentos de la consulta"""
+        db = MagicMock()
+
+        store_answer(db, AnswerCacheLookup(3, 4, "modelo", EMBEDDING), QUESTION, "Un TAD es...")
+
+        kwargs = mock_save.call_args.kwargs
+        assert (kwargs["subject_id"], kwargs["documents_version"], kwargs["embedding_model"]) == (3, 4, "modelo")
+        assert kwargs["question_embedding"] == EMBEDDING
+        assert kwargs["answer"] == "Un TAD es..."
+
+    @patch('app.services.answer_cache_service.save_cached_answer')
+    def test_hits_and_uncacheable_turns_are_not_stored(self, mock_save):
+        """No se guarda lo que ya venía de la caché ni las preguntas no cacheables"""
+        store_answer(MagicMock(), AnswerCacheLookup(3, 4, "modelo", EMBEDDING, "Un TAD es...", 0.99), QUESTION, "Un TAD es...")
+        store_answer(MagicMock(), None, QUESTION, "Respuesta")
+
+        mock_save.assert_not_called()
+
+class TestInvalidateSubjectAnswers:
+    """Tests para la invalidación de la caché al cambiar los documentos"""
+
+    def test_version_is_bumped_and_answers_deleted(self):
+        """Se incrementa la versión de la asignatura y se borran sus respuestas sin confirmar"""
+        db = MagicMock()
+
+        invalidate_subject_answers(db, 3)
+
+        db.query.return_value.filter.return_value.update.assert_called_once()
+        db.query.return_value.filter.return_value.delete.assert_called_once()
+        db.commit.assert_not_called()
+
+    def test_documents_without_subject_are_ignored(self):
+        """Un documento sin asignatura no invalida nada"""
+        db = MagicMock()
+
+        invalidate_subject_answers(db, None)
+
+        db.query.assert_not_called()
@@ -1,19 +1,32 @@
+import threading
+
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from app.services.llm_providers import FakeLLMProvider, GeminiProvider
+from app.services.api_service import (
+    AIResponseError,
+    EMPTY_RESPONSE_TEXT,
+    generate_ai_response,
+    generate_google_ai_response_async,
+    generate_google_ai_response_stream
+)
 
-from app.services.api_service import generate_ai_response
+def _gemini_provider():
+    """Proveedor de Gemini con un cliente simulado (accesible como mock_provider.client)"""
+    return GeminiProvider(client=MagicMock())
 
 class TestApiService:
     """Tests para el servicio de API (Google AI)"""
     
-    @patch('app.services.api_service.google_client')
-    def test_generate_ai_response(self, mock_google_client):
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    def test_generate_ai_response(self, mock_provider):
         """Test para generación de respuestas a través de la API de Google AI"""
         # Configurar el mock
         mock_response = MagicMock()
         mock_response.text = "Python es un lenguaje de programación interpretado de alto nivel."
         
-        mock_google_client.generate_content.return_value = mock_response
+        mock_provider.client.generate_content.return_value = mock_response
         
         # Llamar a la función
         result = generate_ai_response(
@@ -26,15 +39,15 @@ class TestApiService:
         
         # Verificar resultado
         assert result == "Python es un lenguaje de programación interpretado de alto nivel."
-        mock_google_client.generate_content.assert_called_once()
+        mock_provider.client.generate_content.assert_called_once()
         
         # Verificar que los parámetros incluyen el contexto y la conversación
-        args, kwargs = mock_google_client.generate_content.call_args
+        args, kwargs = mock_provider.client.generate_content.call_args
         prompt = args[0]
         assert "Python es un lenguaje de programación" in prompt
         assert "Usuario: Hola\nBot: Hola, ¿en qué puedo ayudarte?" in prompt
     
-    @patch('app.services.api_service.google_client', None)
+    @patch('app.services.api_service.llm_provider', GeminiProvider(client=None))
     def test_generate_ai_response_with_no_client(self):
         """Test para manejo de error cuando no hay cliente Google AI configurado"""
         result = generate_ai_response(
@@ -47,12 +60,12 @@ class TestApiService:
         
         assert "Lo siento, la configuración del servicio de IA no es correcta" in result
     
-    @patch('app.services.api_service.google_client')
-    def test_generate_ai_response_api_error(self, mock_google_client):
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    def test_generate_ai_response_api_error(self, mock_provider):
         """Test para manejo de errores de la API"""
         # Configurar el mock para lanzar una excepción
         error = Exception("API quota exceeded")
-        mock_google_client.generate_content.side_effect = error
+        mock_provider.client.generate_content.side_effect = error
         
         # Llamar a la función
         result = generate_ai_response(
@@ -66,3 +79,174 @@ class TestApiService:
         # Verificar que se maneja el error
         assert "Lo siento, hubo un error con la API de Google AI" in result
         assert "API quota exceeded" in result
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.log_google_context')
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    async def test_generate_google_ai_response_async(self, mock_provider, mock_log):
+        """La variante asíncrona usa generate_content_async con el mismo prompt"""
+        mock_response = MagicMock()
+        mock_response.text = " Respuesta asíncrona "
+        mock_provider.client.generate_content_async = AsyncMock(return_value=mock_response)
+
+        result = await generate_google_ai_response_async(
+            user_question="¿Qué es Python?",
+            context="Python es un lenguaje de programación",
+            conversation_id=1
+        )
+
+        assert result == "Respuesta asíncrona"
+        mock_provider.client.generate_content.assert_not_called()
+        content_parts = mock_provider.client.generate_content_async.call_args[0][0]
+        assert "Python es un lenguaje de programación" in content_parts[-1]
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    async def test_prompt_is_built_off_the_event_loop(self, mock_provider):
+        """El registro del contexto en disco y el recuento de tokens no bloquean el bucle de eventos"""
+        mock_provider.client.generate_content_async = AsyncMock(return_value=MagicMock(text="ok"))
+        threads = []
+
+        async def chunks():
+            yield MagicMock(text="ok")
+
+        with patch('app.services.api_service.log_google_context',
+                   side_effect=lambda *args, **kwargs: threads.append(threading.current_thread())):
+            await generate_google_ai_response_async(user_question="¿Qué es Python?", context="Python", conversation_id=1)
+            mock_provider.client.generate_content_async = AsyncMock(return_value=chunks())
+            [text async for text in generate_google_ai_response_stream(
+                user_question="¿Qué es Python?", context="Python", conversation_id=1
+            )]
+
+        assert len(threads) == 2
+        assert threading.main_thread() not in threads
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.log_google_context')
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    async def test_empty_async_response_raises(self, mock_provider, mock_log):
+        """Una respuesta vacía o bloqueada no se devuelve como texto del modelo"""
+        mock_provider.client.generate_content_async = AsyncMock(return_value=MagicMock(text="  "))
+
+        with pytest.raises(AIResponseError) as exc:
+            await generate_google_ai_response_async(user_question="¿Qué es Python?", context="Python")
+        assert exc.value.user_message == EMPTY_RESPONSE_TEXT
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.llm_provider', GeminiProvider(client=None))
+    async def test_async_and_stream_without_provider_raise(self):
+        """Sin proveedor configurado las variantes asíncronas lanzan en lugar de devolver el aviso"""
+        with pytest.raises(AIResponseError):
+            await generate_google_ai_response_async(user_question="¿Qué es Python?", context="Python")
+        with pytest.raises(AIResponseError):
+            [text async for text in generate_google_ai_response_stream(user_question="¿Qué es Python?", context="Python")]
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.log_google_context')
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    async def test_generate_google_ai_response_stream(self, mock_provider, mock_log):
+        """El streaming devuelve los fragmentos con texto y omite los vacíos"""
+        class EmptyChunk:
+            @property
+            def text(self):
+                raise ValueError("sin partes de texto")
+
+        async def chunks():
+            for chunk in (MagicMock(text="Hola, "), EmptyChunk(), MagicMock(text="estudiante")):
+                yield chunk
+
+        mock_provider.client.generate_content_async = AsyncMock(return_value=chunks())
+
+        result = [text async for text in generate_google_ai_response_stream(
+            user_question="¿Qué es Python?",
+            context="Python es un lenguaje de programación"
+        )]
+
+        assert result == ["Hola, ", "estudiante"]
+        assert mock_provider.client.generate_content_async.call_args.kwargs["stream"] is True
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.log_google_context')
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    async def test_google_ai_prompt_fits_token_budget(self, mock_provider, mock_log):
+        """El prompt descarta los chunks de menor similitud que no caben en el presupuesto"""
+        mock_provider.client.generate_content_async = AsyncMock(return_value=MagicMock(text="ok"))
+        context = "\n\n".join(
+            f"[Del documento 'Tema {i}']: " + "contenido " * 200 for i in range(3)
+        )
+
+        with patch('app.utils.prompt_budget._get_tokenizer', return_value=None), \
+             patch('app.services.api_service.count_tokens', side_effect=lambda text: len(text.split())), \
+             patch('app.utils.prompt_budget.count_tokens', side_effect=lambda text: len(text.split())), \
+             patch('app.utils.prompt_budget.settings.PROMPT_TOKEN_BUDGET', 700):
+            await generate_google_ai_response_async(
+                user_question="¿Qué es Python?",
+                context=context,
+                conversation_history="Usuario: ¿Qué es Python?"
+            )
+
+        prompt = mock_provider.client.generate_content_async.call_args[0][0][-1]
+        assert "'Tema 0'" in prompt
+        assert "'Tema 2'" not in prompt
+        assert "Usuario: ¿Qué es Python?" in prompt
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.log_google_context')
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    async def test_google_ai_system_instruction_sends_only_dynamic_part(self, mock_provider, mock_log):
+        """Con instrucciones de sistema, el cliente de la plantilla las lleva y solo se envían los huecos"""
+        template_client = MagicMock()
+        template_client.generate_content_async = AsyncMock(return_value=MagicMock(text="ok"))
+
+        with patch('app.services.llm_providers.settings.GOOGLE_AI_SYSTEM_INSTRUCTION', True), \
+             patch('app.services.llm_providers.settings.GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS', 0), \
+             patch('app.services.llm_providers.genai') as mock_genai:
+            mock_genai.GenerativeModel.return_value = template_client
+            for _ in range(2):
+                await generate_google_ai_response_async(
+                    user_question="¿Qué es Python?",
+                    context="Python es un lenguaje de programación"
+                )
+
+        # El cliente con las instrucciones se crea una sola vez por plantilla
+        mock_genai.GenerativeModel.assert_called_once()
+        assert mock_genai.GenerativeModel.call_args.kwargs["system_instruction"].startswith("### Instrucciones:")
+        mock_provider.client.generate_content_async.assert_not_called()
+        sent = template_client.generate_content_async.call_args[0][0][-1]
+        assert "Python es un lenguaje de programación" in sent
+        assert "### Instrucciones:" not in sent
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.log_google_context')
+    @patch('app.services.api_service.llm_provider', new_callable=_gemini_provider)
+    async def test_google_ai_system_instruction_falls_back_to_full_prompt(self, mock_provider, mock_log):
+        """Si el modelo no admite instrucciones de sistema se envía el prompt completo"""
+        mock_provider.client.generate_content_async = AsyncMock(return_value=MagicMock(text="ok"))
+
+        with patch('app.services.llm_providers.settings.GOOGLE_AI_SYSTEM_INSTRUCTION', True), \
+             patch('app.services.llm_providers.settings.GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS', 3600), \
+             patch('app.services.llm_providers._start_background', side_effect=lambda target, *args: target(*args)), \
+             patch('app.services.llm_providers.genai') as mock_genai:
+            mock_genai.caching.CachedContent.create.side_effect = Exception("no admitido")
+            await generate_google_ai_response_async(user_question="¿Qué es Python?", context="Python")
+
+        sent = mock_provider.client.generate_content_async.call_args[0][0][-1]
+        assert sent.startswith("### Instrucciones:")
+
+    @pytest.mark.asyncio
+    @patch('app.services.api_service.log_google_context')
+    async def test_fake_provider_answers_offline(self, mock_log):
+        """Con el proveedor simulado el flujo completo funciona sin clave de API"""
+        with patch('app.services.api_service.llm_provider', FakeLLMProvider("instant", output_tokens=12)):
+            result = await generate_google_ai_response_async(
+                user_question="¿Qué es Python?",
+                context="Python es un lenguaje de programación"
+            )
+            streamed = [text async for text in generate_google_ai_response_stream(
+                user_question="¿Qué es Python?",
+                context="Python es un lenguaje de programación"
+            )]
+
+        assert result.startswith("Respuesta simulada:")
+        assert len(result.split()) == 12
+        assert "".join(streamed) == result
@@ -0,0 +1,45 @@
+from unittest.mock import MagicMock, patch
+
+from app.services.background_embedding_service import (
+    enqueue_message_embedding,
+    shutdown_background_embeddings
+)
+
+class TestBackgroundEmbeddingService:
+    """Tests para el cálculo de embeddings de mensajes en segundo plano"""
+
+    @patch('app.services.background_embedding_service.settings.EMBED_BOT_MESSAGES', False)
+    def test_disabled_does_not_enqueue(self):
+        """Con EMBED_BOT_MESSAGES desactivado no se encola nada"""
+        with patch('app.services.background_embedding_service._get_executor') as mock_executor:
+            assert enqueue_message_embedding(1, "Respuesta del bot") is None
+            mock_executor.assert_not_called()
+
+    @patch('app.services.background_embedding_service.settings.EMBED_BOT_MESSAGES', True)
+    def test_enqueued_embedding_is_saved(self):
+        """La tarea calcula el embedding sin caché ni agrupador y lo guarda con su propia sesión"""
+        mock_db = MagicMock()
+        with patch('app.services.background_embedding_service.SessionLocal', return_value=mock_db), \
+             patch('app.services.background_embedding_service.get_embedding_for_query',
+                   return_value=[0.1] * 768) as mock_embedding:
+            future = enqueue_message_embedding(42, "Respuesta del bot")
+            future.result(timeout=5)
+            shutdown_background_embeddings()
+
+        mock_embedding.assert_called_once_with("Respuesta del bot", use_cache=False, use_batcher=False)
+        assert mock_db.commit.called
+        assert mock_db.close.called
+
+    @patch('app.services.background_embedding_service.settings.EMBED_BOT_MESSAGES', True)
+    def test_errors_are_rolled_back(self):
+        """Un fallo al guardar no se propaga y deshace la transacción"""
+        mock_db = MagicMock()
+        mock_db.commit.side_effect = Exception("BD no disponible")
+        with patch('app.services.background_embedding_service.SessionLocal', return_value=mock_db), \
+             patch('app.services.background_embedding_service.get_embedding_for_query',
+                   return_value=[0.1] * 768):
+            enqueue_message_embedding(42, "Respuesta del bot").result(timeout=5)
+            shutdown_background_embeddings()
+
+        assert mock_db.rollback.called
+        assert mock_db.close.called
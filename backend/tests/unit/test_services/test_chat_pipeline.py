@@ -0,0 +1,336 @@
+import asyncio
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services.answer_cache_service import AnswerCacheLookup
+from app.services.api_service import AIResponseError
+from app.services.chat_service import (
+    LLM_UNAVAILABLE_TEXT,
+    _commit_and_release,
+    _prepare_turn,
+    add_message_and_generate_response_async,
+    stream_message_and_generate_response
+)
+from app.utils.llm_gateway import CircuitOpenError
+
+def _mock_conversation():
+    conversation = MagicMock()
+    conversation.id = 1
+    conversation.user_id = 1
+    conversation.subject_id = 3
+    return conversation
+
+@contextmanager
+def _patch_stages(**overrides):
+    """Parchea las etapas de preparación del turno; devuelve los mocks por nombre"""
+    stages = {
+        '_get_conversation_for_user': dict(return_value=_mock_conversation()),
+        'get_embedding_for_query_async': dict(return_value=[0.1] * 768),
+        'add_user_message': dict(return_value=MagicMock()),
+        'get_conversation_context': dict(return_value="Contexto"),
+        'get_conversation_history': dict(return_value="Bot: Hola"),
+        '_get_subject_info': dict(return_value={"name": "Estructuras de Datos"}),
+        '_load_image_for_ai': dict(return_value=(None, None)),
+        'lookup_cached_answer': dict(return_value=None),
+        'SessionLocal': dict(return_value=MagicMock())
+    }
+    stages.update(overrides)
+    with ExitStack() as stack:
+        yield {
+            name: stack.enter_context(patch(f'app.services.chat_service.{name}', **kwargs))
+            for name, kwargs in stages.items()
+        }
+
+class TestTurnPreparation:
+    """Tests para la etapa de orquestación de cada turno del chat"""
+
+    @pytest.mark.asyncio
+    async def test_blocking_stages_run_off_the_event_loop(self):
+        """BD se ejecuta en el pool acotado y la pregunta se codifica una vez en el agrupador"""
+        threads = {}
+
+        def record(name, value):
+            def _stage(*args, **kwargs):
+                threads[name] = threading.current_thread().name
+                return value
+            return _stage
+
+        with _patch_stages(
+            add_user_message=dict(side_effect=record("user_message", MagicMock())),
+            get_conversation_context=dict(side_effect=record("context", "Contexto"))
+        ) as mocks:
+            user_msg, inputs, _, timings = await _prepare_turn(MagicMock(), 1, 1, "¿Qué es un TAD?", None)
+
+        mocks['get_embedding_for_query_async'].assert_awaited_once_with("¿Qué es un TAD?")
+        assert mocks['add_user_message'].call_args[0][4] == [0.1] * 768
+        assert mocks['get_conversation_context'].call_args.kwargs["query_embedding"] == [0.1] * 768
+        assert threads["user_message"].startswith("chat-io")
+        assert threads["context"].startswith("chat-io")
+        assert inputs["context"] == "Contexto"
+        assert inputs["asignatura"] == {"name": "Estructuras de Datos"}
+        assert set(timings) >= {"embedding", "user_message", "context", "subject", "history", "image", "total"}
+
+    @pytest.mark.asyncio
+    async def test_independent_stages_overlap(self):
+        """Asignatura, contexto, historial e imagen se preparan a la vez"""
+        def slow(value):
+            def _stage(*args, **kwargs):
+                time.sleep(0.2)
+                return value
+            return _stage
+
+        with _patch_stages(
+            get_conversation_context=dict(side_effect=slow("Contexto")),
+            get_conversation_history=dict(side_effect=slow("")),
+            _get_subject_info=dict(side_effect=slow(None)),
+            _load_image_for_ai=dict(side_effect=slow((None, None)))
+        ):
+            _, _, _, timings = await _prepare_turn(MagicMock(), 1, 1, "Pregunta", None)
+
+        assert timings["total"] < 600
+
+    @pytest.mark.asyncio
+    async def test_current_question_is_appended_to_history(self):
+        """El historial incluye la pregunta actual aunque aún no esté confirmada"""
+        with _patch_stages() as mocks:
+            _, inputs, _, _ = await _prepare_turn(MagicMock(), 1, 1, "¿Qué es un TAD?", None)
+
+        assert inputs["conversation_history"] == "Bot: Hola\nUsuario: ¿Qué es un TAD?"
+        assert mocks['get_conversation_history'].call_args[0][1:] == (1, 9)
+
+    @pytest.mark.asyncio
+    async def test_context_failure_returns_no_inputs(self):
+        """Un fallo al preparar el contexto no impide guardar el mensaje del usuario"""
+        with _patch_stages(get_conversation_context=dict(side_effect=Exception("BD caída"))) as mocks:
+            user_msg, inputs, _, _ = await _prepare_turn(MagicMock(), 1, 1, "Pregunta", None)
+
+        assert user_msg is mocks['add_user_message'].return_value
+        assert inputs is None
+
+    @pytest.mark.asyncio
+    async def test_cached_answer_skips_retrieval(self):
+        """Con una respuesta en caché no se recupera contexto"""
+        hit = AnswerCacheLookup(3, 1, "modelo", [0.1] * 768, "Un TAD es...", 0.98)
+        with _patch_stages(
+            lookup_cached_answer=dict(return_value=hit),
+            get_conversation_history=dict(return_value="")
+        ) as mocks:
+            _, inputs, answer_lookup, _ = await _prepare_turn(MagicMock(), 1, 1, "¿Qué es un TAD?", None)
+
+        assert answer_lookup is hit
+        mocks['get_conversation_context'].assert_not_called()
+        assert mocks['lookup_cached_answer'].call_args[0][1:] == (3, "¿Qué es un TAD?", [0.1] * 768, False)
+        assert inputs["context"] == ""
+
+    @pytest.mark.asyncio
+    async def test_follow_up_turn_skips_the_answer_cache(self):
+        """En un turno con historial la caché no se consulta: su clave no incluye la conversación"""
+        with _patch_stages() as mocks:
+            _, inputs, answer_lookup, _ = await _prepare_turn(MagicMock(), 1, 1, "¿Y su coste?", None)
+
+        assert answer_lookup is None
+        mocks['lookup_cached_answer'].assert_not_called()
+        assert inputs["context"] == "Contexto"
+
+    @pytest.mark.asyncio
+    async def test_user_message_errors_propagate(self):
+        """Los errores al guardar el mensaje del usuario se propagan"""
+        with _patch_stages(add_user_message=dict(side_effect=ValueError("fallo"))):
+            with pytest.raises(ValueError):
+                await _prepare_turn(MagicMock(), 1, 1, "Pregunta", None)
+
+class TestAsyncChatPipeline:
+    """Tests para el pipeline asíncrono de mensajes del chat"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_conversations_overlap(self):
+        """Dos turnos a la vez no se serializan mientras esperan al modelo"""
+        async def slow_llm(**kwargs):
+            await asyncio.sleep(0.3)
+            return "Respuesta IA"
+
+        with patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, None, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_async', side_effect=slow_llm), \
+             patch('app.services.chat_service.add_bot_message'):
+            start = time.perf_counter()
+            await asyncio.gather(
+                add_message_and_generate_response_async(MagicMock(), 1, 1, "Pregunta 1"),
+                add_message_and_generate_response_async(MagicMock(), 1, 1, "Pregunta 2")
+            )
+            elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.55
+
+    @pytest.mark.asyncio
+    async def test_llm_errors_still_store_a_reply(self):
+        """Un fallo del modelo se convierte en un mensaje de disculpa guardado"""
+        with patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, None, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_async', side_effect=Exception("timeout")), \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            await add_message_and_generate_response_async(MagicMock(), 1, 1, "Pregunta")
+
+        assert mock_add_bot.call_args[0][2] == "Lo siento, hubo un error al generar la respuesta."
+
+    @pytest.mark.asyncio
+    async def test_unavailable_llm_reply_is_not_cached(self):
+        """Con el circuito abierto se guarda un aviso de servicio no disponible y no se cachea"""
+        miss = AnswerCacheLookup(3, 1, "modelo", [0.1] * 768)
+        with patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, miss, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_async',
+                   side_effect=CircuitOpenError("abierto")), \
+             patch('app.services.chat_service.store_answer') as mock_store, \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            await add_message_and_generate_response_async(MagicMock(), 1, 1, "¿Qué es un TAD?")
+
+        mock_store.assert_not_called()
+        assert mock_add_bot.call_args[0][2] == LLM_UNAVAILABLE_TEXT
+
+    @pytest.mark.asyncio
+    async def test_empty_llm_reply_is_not_cached(self):
+        """El aviso de respuesta vacía o sin proveedor se guarda como mensaje pero no se cachea"""
+        miss = AnswerCacheLookup(3, 1, "modelo", [0.1] * 768)
+        with patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, miss, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_async',
+                   side_effect=AIResponseError("Sin respuesta")), \
+             patch('app.services.chat_service.store_answer') as mock_store, \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            await add_message_and_generate_response_async(MagicMock(), 1, 1, "¿Qué es un TAD?")
+
+        mock_store.assert_not_called()
+        assert mock_add_bot.call_args[0][2] == "Sin respuesta"
+
+    @pytest.mark.asyncio
+    async def test_cache_hit_skips_the_llm(self):
+        """Un acierto de la caché semántica responde sin llamar al modelo"""
+        hit = AnswerCacheLookup(3, 1, "modelo", [0.1] * 768, "Respuesta en caché", 0.97)
+        with patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, hit, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_async') as mock_llm, \
+             patch('app.services.chat_service.store_answer') as mock_store, \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            await add_message_and_generate_response_async(MagicMock(), 1, 1, "¿Qué es un TAD?")
+
+        mock_llm.assert_not_called()
+        mock_store.assert_not_called()
+        assert mock_add_bot.call_args[0][2] == "Respuesta en caché"
+
+    @pytest.mark.asyncio
+    async def test_cache_miss_stores_the_answer(self):
+        """Tras un fallo de la caché la respuesta generada se guarda en ella"""
+        miss = AnswerCacheLookup(3, 1, "modelo", [0.1] * 768)
+        with patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, miss, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_async', AsyncMock(return_value="Respuesta IA")), \
+             patch('app.services.chat_service.SessionLocal', return_value=MagicMock()), \
+             patch('app.services.chat_service.store_answer') as mock_store, \
+             patch('app.services.chat_service.add_bot_message'):
+            await add_message_and_generate_response_async(MagicMock(), 1, 1, "¿Qué es un TAD?")
+
+        assert mock_store.call_args[0][1:] == (miss, "¿Qué es un TAD?", "Respuesta IA")
+
+    @pytest.mark.asyncio
+    async def test_follow_up_answer_is_not_cached(self):
+        """La respuesta a un turno de seguimiento no se guarda en la caché"""
+        with _patch_stages() as mocks, \
+             patch('app.services.chat_service.generate_google_ai_response_async', AsyncMock(return_value="Respuesta IA")), \
+             patch('app.services.chat_service.store_answer') as mock_store, \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            await add_message_and_generate_response_async(MagicMock(), 1, 1, "¿Y su coste?")
+
+        mocks['lookup_cached_answer'].assert_not_called()
+        mock_store.assert_not_called()
+        assert mock_add_bot.call_args[0][2] == "Respuesta IA"
+
+class TestStreamedChatPipeline:
+    """Tests para la respuesta del chat en streaming"""
+
+    async def _collect(self, **kwargs):
+        return [event async for event in stream_message_and_generate_response(**kwargs)]
+
+    @pytest.mark.asyncio
+    async def test_tokens_are_forwarded_and_reply_persisted_at_the_end(self):
+        """Los fragmentos se emiten en orden y la respuesta completa se guarda al final"""
+        mock_db = MagicMock()
+        user_msg, bot_msg = MagicMock(), MagicMock()
+
+        async def fake_stream(**kwargs):
+            for text in ("Un TAD ", "es un ", "tipo abstracto."):
+                yield text
+
+        with patch('app.services.chat_service.SessionLocal', return_value=mock_db), \
+             patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(user_msg, {}, None, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_stream', side_effect=fake_stream), \
+             patch('app.services.chat_service.add_bot_message', return_value=bot_msg) as mock_add_bot:
+            events = await self._collect(conversation_id=1, user_id=1, message_text="¿Qué es un TAD?")
+
+        assert events == [
+            ("user_message", user_msg),
+            ("token", "Un TAD "),
+            ("token", "es un "),
+            ("token", "tipo abstracto."),
+            ("bot_message", bot_msg)
+        ]
+        assert mock_add_bot.call_args[0][2] == "Un TAD es un tipo abstracto."
+        assert mock_db.commit.called
+        assert mock_db.close.called
+
+    @pytest.mark.asyncio
+    async def test_stream_error_keeps_partial_answer(self):
+        """Si el modelo falla a mitad, se guarda lo recibido hasta entonces"""
+        async def broken_stream(**kwargs):
+            yield "Respuesta parcial"
+            raise Exception("conexión cerrada")
+
+        with patch('app.services.chat_service.SessionLocal', return_value=MagicMock()), \
+             patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, None, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_stream', side_effect=broken_stream), \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            await self._collect(conversation_id=1, user_id=1, message_text="Pregunta")
+
+        assert mock_add_bot.call_args[0][2] == "Respuesta parcial"
+
+    @pytest.mark.asyncio
+    async def test_empty_stream_sends_notice_without_caching(self):
+        """Un stream sin texto envía el aviso al usuario y no lo guarda en la caché"""
+        miss = AnswerCacheLookup(3, 1, "modelo", [0.1] * 768)
+
+        async def empty_stream(**kwargs):
+            yield " "
+            raise AIResponseError("Sin respuesta")
+
+        with patch('app.services.chat_service.SessionLocal', return_value=MagicMock()), \
+             patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, miss, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_stream', side_effect=empty_stream), \
+             patch('app.services.chat_service.store_answer') as mock_store, \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            events = await self._collect(conversation_id=1, user_id=1, message_text="¿Qué es un TAD?")
+
+        assert ("token", "Sin respuesta") in events
+        mock_store.assert_not_called()
+        assert mock_add_bot.call_args[0][2] == "Sin respuesta"
+
+    @pytest.mark.asyncio
+    async def test_cached_answer_is_streamed_as_one_token(self):
+        """Una respuesta de la caché se envía de una vez sin llamar al modelo"""
+        hit = AnswerCacheLookup(3, 1, "modelo", [0.1] * 768, "Respuesta en caché", 0.97)
+        with patch('app.services.chat_service.SessionLocal', return_value=MagicMock()), \
+             patch('app.services.chat_service._prepare_turn', AsyncMock(return_value=(MagicMock(), {}, hit, {}))), \
+             patch('app.services.chat_service.generate_google_ai_response_stream') as mock_stream, \
+             patch('app.services.chat_service.add_bot_message') as mock_add_bot:
+            events = await self._collect(conversation_id=1, user_id=1, message_text="¿Qué es un TAD?")
+
+        assert [event for event in events if event[0] == "token"] == [("token", "Respuesta en caché")]
+        mock_stream.assert_not_called()
+        assert mock_add_bot.call_args[0][2] == "Respuesta en caché"
+
+    def test_user_message_is_committed_before_streaming(self):
+        """Antes de empezar el stream se confirma el mensaje y se cierra la sesión"""
+        mock_db, user_msg = MagicMock(), MagicMock()
+
+        _commit_and_release(mock_db, user_msg)
+
+        mock_db.commit.assert_called_once()
+        mock_db.refresh.assert_called_once_with(user_msg)
+        mock_db.close.assert_called_once()
@@ -0,0 +1,239 @@
+import struct
+
+import numpy as np
+from unittest.mock import MagicMock, patch
+
+from app.crud.crud_vector import (
+    COPY_BINARY_HEADER,
+    bulk_insert_document_chunks,
+    encode_chunks_copy_binary
+)
+from app.services.embedding_service import create_document_chunks_from_pages
+from app.utils.content_hash import chunk_content_hash
+from app.utils.embedding_cache import EmbeddingCache
+
+def _decode_copy_binary(payload):
+    """Decodifica el formato binario de COPY generado para document_chunks"""
+    assert payload.startswith(COPY_BINARY_HEADER)
+    offset = len(COPY_BINARY_HEADER)
+    rows = []
+    while True:
+        (field_count,) = struct.unpack_from(">h", payload, offset)
+        offset += 2
+        if field_count == -1:
+            break
+        fields = []
+        for _ in range(field_count):
+            (length,) = struct.unpack_from(">i", payload, offset)
+            offset += 4
+            if length == -1:
+                fields.append(None)
+                continue
+            fields.append(payload[offset:offset + length])
+            offset += length
+        document_id, content, vector, chunk_number, page_number, content_hash, embedding_model = fields
+        dimension, unused = struct.unpack_from(">hh", vector)
+        rows.append((
+            struct.unpack(">i", document_id)[0],
+            content.decode("utf-8"),
+            np.frombuffer(vector[4:], dtype=">f4").tolist(),
+            struct.unpack(">i", chunk_number)[0],
+            struct.unpack(">i", page_number)[0] if page_number else None,
+            dimension,
+            content_hash.decode("ascii"),
+            embedding_model.decode("utf-8") if embedding_model else None
+        ))
+    assert offset == len(payload)
+    return rows
+
+class TestBulkChunkInsert:
+    """Tests para la inserción masiva de chunks de documentos"""
+
+    def test_copy_binary_roundtrip(self):
+        """Cada fila se codifica con su documento, texto, vector pgvector y número"""
+        embeddings = np.array([[0.5, -1.0, 2.0], [0.25, 0.0, 1.5]], dtype=np.float32)
+
+        rows = _decode_copy_binary(encode_chunks_copy_binary(7, ["Árbol binario", "Pila"], embeddings))
+
+        assert rows == [
+            (7, "Árbol binario", [0.5, -1.0, 2.0], 0, None, 3, chunk_content_hash("Árbol binario"), None),
+            (7, "Pila", [0.25, 0.0, 1.5], 1, None, 3, chunk_content_hash("Pila"), None)
+        ]
+
+    def test_copy_binary_page_numbers_and_offset(self):
+        """Las páginas se codifican (NULL si faltan) y la numeración continúa desde start_number"""
+        embeddings = np.array([[1.0], [2.0]], dtype=np.float32)
+
+        rows = _decode_copy_binary(
+            encode_chunks_copy_binary(7, ["a", "b"], embeddings, page_numbers=[12, None], start_number=40)
+        )
+
+        assert [(row[3], row[4]) for row in rows] == [(40, 12), (41, None)]
+
+    def test_copy_binary_embedding_model(self):
+        """Cada fila se etiqueta con el modelo que generó su embedding"""
+        embeddings = np.array([[1.0]], dtype=np.float32)
+
+        rows = _decode_copy_binary(encode_chunks_copy_binary(7, ["a"], embeddings, embedding_model="modelo-b"))
+
+        assert rows[0][-1] == "modelo-b"
+
+    def test_uses_copy_with_psycopg2(self):
+        """Con un cursor que soporta COPY se envía una sola carga binaria"""
+        mock_db = MagicMock()
+        cursor = mock_db.connection().connection.cursor()
+        embeddings = np.random.rand(3, 768).astype(np.float32)
+
+        stats = bulk_insert_document_chunks(mock_db, 1, ["a", "b", "c"], embeddings)
+
+        cursor.copy_expert.assert_called_once()
+        statement = cursor.copy_expert.call_args[0][0]
+        assert "FORMAT binary" in statement
+        assert stats["method"] == "copy"
+        assert stats["chunks"] == 3
+        mock_db.add_all.assert_not_called()
+        cursor.close.assert_called_once()
+
+    def test_falls_back_to_executemany(self):
+        """Sin soporte de COPY se hace un único INSERT con todas las filas"""
+        mock_db = MagicMock()
+        mock_db.connection().connection.cursor.return_value = MagicMock(spec=["close"])
+        embeddings = np.random.rand(2, 768).astype(np.float32)
+
+        stats = bulk_insert_document_chunks(mock_db, 1, ["a", "b"], embeddings)
+
+        mock_db.execute.assert_called_once()
+        rows = mock_db.execute.call_args[0][1]
+        assert [row["chunk_number"] for row in rows] == [0, 1]
+        assert stats["method"] == "executemany"
+
+class TestStreamingChunking:
+    """Tests para la división y carga de chunks a medida que llegan las páginas"""
+
+    @patch('app.services.embedding_service.settings.CHUNK_BREAKPOINT_PERCENTILE', None)
+    @patch('app.services.embedding_service.settings.CHUNK_EMBEDDING_MODE', 'pooled')
+    @patch('app.services.embedding_service.settings.CHUNK_STREAM_SENTENCES', 2)
+    def test_chunks_are_built_per_window_with_page_numbers(self):
+        """Los chunks se forman por ventanas y se cargan de una vez, las oraciones se codifican una vez y los chunks guardan su página"""
+        topics = {"A": [1.0, 0.0], "B": [0.0, 1.0]}
+        mock_model = MagicMock()
+        mock_model.encode.side_effect = lambda sentences: np.array([topics[s[0]] for s in sentences], dtype=np.float32)
+        pages = [(1, "A1. A2."), (2, "A3. B1."), (3, "B2.")]
+        mock_db = MagicMock()
+        loads = []
+
+        def fake_bulk(db, document_id, chunks, embeddings, page_numbers, content_hashes, embedding_model, start_number=0):
+            loads.append((list(chunks), list(page_numbers), start_number, embedding_model))
+            return {"chunks": len(chunks), "bytes": 10, "seconds": 0.01, "method": "copy"}
+
+        with patch('app.services.embedding_service.get_active_embedding_model', return_value='modelo-prueba'), \
+             patch('app.services.embedding_service.load_sentence_transformer_model_singleton', return_value=mock_model), \
+             patch('app.services.embedding_service.sentence_embedding_cache', None), \
+             patch('app.services.embedding_service.get_chunk_embeddings_by_hash', return_value={}), \
+             patch('app.services.embedding_service._split_sentences', side_effect=lambda text: text.split(" ")), \
+             patch('app.services.embedding_service.bulk_insert_document_chunks', side_effect=fake_bulk):
+            stats = create_document_chunks_from_pages(mock_db, 1, iter(pages))
+
+        assert loads == [(["A1. A2. A3.", "B1. B2."], [1, 2], 0, "modelo-prueba")]
+        encoded = [s for call in mock_model.encode.call_args_list for s in call.args[0]]
+        assert encoded == ["A1.", "A2.", "A3.", "B1.", "B2."]
+        assert stats["chunks"] == 2
+        assert stats["pages"] == 3
+        assert stats["embedding_model"] == "modelo-prueba"
+        mock_db.commit.assert_called_once()
+
+    @patch('app.services.embedding_service.settings.CHUNK_EMBEDDING_MODE', 'reencode')
+    def test_table_is_locked_after_encoding(self):
+        """document_chunks se bloquea después de codificar y el modelo activo se vuelve a leer con el bloqueo"""
+        calls = []
+        mock_model = MagicMock()
+        mock_model.encode.side_effect = lambda texts: calls.append("encode") or np.ones((len(texts), 2), dtype=np.float32)
+
+        def fake_bulk(db, document_id, chunks, embeddings, page_numbers, content_hashes, embedding_model):
+            calls.append(("insert", embedding_model))
+            return {"chunks": len(chunks), "bytes": 10, "seconds": 0.01, "method": "copy"}
+
+        with patch('app.services.embedding_service.lock_document_chunks_for_insert',
+                   side_effect=lambda db: calls.append("lock")), \
+             patch('app.services.embedding_service.get_active_embedding_model',
+                   side_effect=lambda refresh=False: calls.append(("model", refresh)) or 'modelo-prueba'), \
+             patch('app.services.embedding_service.load_sentence_transformer_model_singleton', return_value=mock_model), \
+             patch('app.services.embedding_service.sentence_embedding_cache', None), \
+             patch('app.services.embedding_service.get_chunk_embeddings_by_hash', return_value={}), \
+             patch('app.services.embedding_service._split_sentences', side_effect=lambda text: text.split(". ")), \
+             patch('app.services.embedding_service.bulk_insert_document_chunks', side_effect=fake_bulk):
+            create_document_chunks_from_pages(MagicMock(), 1, iter([(1, "Una pila. Una cola.")]))
+
+        lock_at = calls.index("lock")
+        assert "encode" not in calls[lock_at:]
+        assert calls[lock_at:] == ["lock", ("model", True), ("insert", "modelo-prueba")]
+
+    @patch('app.services.embedding_service.settings.CHUNK_EMBEDDING_MODE', 'reencode')
+    def test_chunks_are_reencoded_if_the_model_changed_while_encoding(self):
+        """Si un re-embedding activa otro modelo durante la ingesta, los chunks se cargan codificados con el nuevo"""
+        old_model, new_model = MagicMock(), MagicMock()
+        old_model.encode.side_effect = lambda texts: np.ones((len(texts), 2), dtype=np.float32)
+        new_model.encode.side_effect = lambda texts: np.full((len(texts), 3), 2.0, dtype=np.float32)
+        active = iter(['modelo-viejo', 'modelo-nuevo'])
+        loads = []
+
+        def fake_bulk(db, document_id, chunks, embeddings, page_numbers, content_hashes, embedding_model):
+            loads.append((embeddings.shape, embedding_model))
+            return {"chunks": len(chunks), "bytes": 10, "seconds": 0.01, "method": "copy"}
+
+        with patch('app.services.embedding_service.lock_document_chunks_for_insert'), \
+             patch('app.services.embedding_service.get_active_embedding_model', side_effect=lambda refresh=False: next(active)), \
+             patch('app.services.embedding_service.load_sentence_transformer_model_singleton',
+                   side_effect=lambda name: old_model if name == 'modelo-viejo' else new_model), \
+             patch('app.services.embedding_service.sentence_embedding_cache', None), \
+             patch('app.services.embedding_service.get_chunk_embeddings_by_hash', return_value={}), \
+             patch('app.services.embedding_service._split_sentences', side_effect=lambda text: text.split(". ")), \
+             patch('app.services.embedding_service.bulk_insert_document_chunks', side_effect=fake_bulk):
+            stats = create_document_chunks_from_pages(MagicMock(), 1, iter([(1, "Una pila.")]))
+
+        assert loads == [((1, 3), 'modelo-nuevo')]
+        assert stats["embedding_model"] == 'modelo-nuevo'
+
+    def test_empty_document_is_not_committed(self):
+        """Sin páginas con texto no se carga ni se confirma nada"""
+        mock_db = MagicMock()
+        with patch('app.services.embedding_service.get_active_embedding_model', return_value='modelo-prueba'), \
+             patch('app.services.embedding_service.load_sentence_transformer_model_singleton'):
+            stats = create_document_chunks_from_pages(mock_db, 1, iter([]))
+
+        assert stats["chunks"] == 0
+        assert stats["pages"] == 0
+        mock_db.commit.assert_not_called()
+
+    @patch('app.services.embedding_service.settings.CHUNK_BREAKPOINT_PERCENTILE', None)
+    @patch('app.services.embedding_service.settings.CHUNK_EMBEDDING_MODE', 'reencode')
+    def test_reupload_only_encodes_what_changed(self):
+        """Al volver a subir un documento corregido solo se codifican las oraciones y chunks nuevos"""
+        mock_model = MagicMock()
+        mock_model.encode.side_effect = lambda texts: np.array(
+            [[1.0, 0.0] if text.startswith("A") else [0.0, 1.0] for text in texts], dtype=np.float32
+        )
+        stored = {}
+
+        def fake_bulk(db, document_id, chunks, embeddings, page_numbers, content_hashes, embedding_model, start_number=0):
+            stored.update(zip(content_hashes, embeddings))
+            return {"chunks": len(chunks), "bytes": 10, "seconds": 0.01, "method": "copy"}
+
+        def run(pages):
+            mock_model.encode.reset_mock()
+            return create_document_chunks_from_pages(MagicMock(), 1, iter(pages))
+
+        with patch('app.services.embedding_service.get_active_embedding_model', return_value='modelo-prueba'), \
+             patch('app.services.embedding_service.load_sentence_transformer_model_singleton', return_value=mock_model), \
+             patch('app.services.embedding_service.sentence_embedding_cache', EmbeddingCache(1024 * 1024, 60)), \
+             patch('app.services.embedding_service.get_chunk_embeddings_by_hash',
+                   side_effect=lambda db, hashes, model: {h: stored[h] for h in hashes if h in stored}), \
+             patch('app.services.embedding_service._split_sentences', side_effect=lambda text: text.split(" ")), \
+             patch('app.services.embedding_service.bulk_insert_document_chunks', side_effect=fake_bulk):
+            first = run([(1, "A1. A2."), (2, "B1. B2.")])
+            second = run([(1, "A1. A2."), (2, "B1. B3.")])
+
+        assert (first["encoded_sentences"], first["reused_chunks"], first["reencoded_chunks"]) == (4, 0, 2)
+        assert (second["encoded_sentences"], second["reused_chunks"], second["reencoded_chunks"]) == (1, 1, 1)
+        encoded = [text for call in mock_model.encode.call_args_list for text in call.args[0]]
+        assert encoded == ["B3.", "B1. B3."]
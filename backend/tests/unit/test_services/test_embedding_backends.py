@@ -0,0 +1,46 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+from app.services.embedding_backends import EMBEDDING_BACKENDS, load_embedding_model
+
+class TestEmbeddingBackends:
+    """Tests para la selección del backend de inferencia de embeddings"""
+
+    @patch('app.services.embedding_backends.settings.EMBEDDING_BACKEND', 'onnx')
+    def test_backend_from_settings(self):
+        """Sin backend explícito se usa el configurado"""
+        onnx_model = MagicMock()
+        with patch.dict(EMBEDDING_BACKENDS, {"onnx": MagicMock(return_value=onnx_model)}):
+            assert load_embedding_model("modelo") is onnx_model
+            EMBEDDING_BACKENDS["onnx"].assert_called_once_with("modelo")
+
+    def test_failed_backend_falls_back_to_torch(self):
+        """Si el backend alternativo no carga (p. ej. falta onnxruntime) se usa PyTorch"""
+        torch_model = MagicMock()
+        with patch.dict(EMBEDDING_BACKENDS, {
+            "onnx-int8": MagicMock(side_effect=ImportError("onnxruntime")),
+            "torch": MagicMock(return_value=torch_model)
+        }):
+            assert load_embedding_model("modelo", "onnx-int8") is torch_model
+
+    def test_torch_errors_are_raised(self):
+        """Un fallo del backend de PyTorch no tiene alternativa y se propaga"""
+        with patch.dict(EMBEDDING_BACKENDS, {"torch": MagicMock(side_effect=OSError("sin modelo"))}):
+            with pytest.raises(OSError):
+                load_embedding_model("modelo", "torch")
+
+    def test_unknown_backend_is_rejected(self):
+        """Un backend mal escrito en la configuración se rechaza"""
+        with pytest.raises(ValueError, match="desconocido"):
+            load_embedding_model("modelo", "tensorrt")
+
+    @patch('app.services.embedding_backends.settings.EMBEDDING_ONNX_FILE', '')
+    @patch('app.services.embedding_backends.SentenceTransformer')
+    def test_onnx_int8_uses_quantized_file(self, mock_st):
+        """onnx-int8 carga el fichero cuantizado del repositorio del modelo en CPU"""
+        load_embedding_model("all-mpnet-base-v2", "onnx-int8")
+
+        kwargs = mock_st.call_args.kwargs
+        assert kwargs["backend"] == "onnx"
+        assert kwargs["device"] == "cpu"
+        assert kwargs["model_kwargs"]["file_name"].startswith("onnx/model_qint8")
@@ -0,0 +1,219 @@
+import pytest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from unittest.mock import MagicMock, patch
+
+from app.services import ingestion_service
+from app.services.ingestion_service import (
+    _on_job_done,
+    _recover_crashed_job,
+    enqueue_ingestion_job,
+    retry_ingestion_job,
+    run_ingestion_job
+)
+
+def _mock_job(attempts=1, max_attempts=3):
+    job = MagicMock()
+    job.attempts = attempts
+    job.max_attempts = max_attempts
+    job.document_id = 5
+    return job
+
+def _done_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+class TestRunIngestionJob:
+    """Tests para la ejecución de un trabajo de ingesta"""
+
+    @patch('app.services.ingestion_service._generate_summary')
+    @patch('app.services.ingestion_service._set_job_status')
+    @patch('app.services.ingestion_service.find_indexed_duplicate', return_value=None)
+    @patch('app.services.ingestion_service.iter_pdf_pages', return_value=iter([(1, "Texto del PDF")]))
+    @patch('app.services.ingestion_service._claim_job', return_value=_mock_job())
+    @patch('app.services.ingestion_service.SessionLocal')
+    def test_job_goes_through_all_stages(self, mock_session, mock_claim, mock_pages, mock_duplicate, mock_set_status, mock_summary):
+        """El trabajo recorre chunking y embedding y termina indexado"""
+        mock_session.return_value.query.return_value.filter.return_value.first.return_value.summary = None
+        def fake_chunks(db, document_id, pages, on_stage):
+            assert list(pages) == [(1, "Texto del PDF")]
+            on_stage("chunking")
+            on_stage("embedding")
+            return {"chunks": 12, "pages": 1}
+
+        with patch('app.services.ingestion_service.create_document_chunks_from_pages', side_effect=fake_chunks):
+            result = run_ingestion_job(10)
+
+        assert result == {"status": "indexed", "attempts": 1}
+        statuses = [call.args[1] for call in mock_set_status.call_args_list]
+        assert statuses == ["chunking", "embedding", "indexed"]
+        assert mock_set_status.call_args.kwargs["chunk_count"] == 12
+        mock_summary.assert_called_once_with(5)
+
+    @patch('app.services.ingestion_service._generate_summary')
+    @patch('app.services.ingestion_service._set_job_status')
+    @patch('app.services.ingestion_service.clone_document_chunks', return_value=30)
+    @patch('app.services.ingestion_service.find_indexed_duplicate', return_value=4)
+    @patch('app.services.ingestion_service._claim_job', return_value=_mock_job())
+    @patch('app.services.ingestion_service.SessionLocal')
+    def test_duplicate_pdf_reuses_indexed_chunks(self, mock_session, mock_claim, mock_duplicate, mock_clone, mock_set_status, mock_summary):
+        """Un PDF idéntico a otro indexado copia sus chunks y su resumen sin extraer ni codificar"""
+        db = mock_session.return_value
+        document = db.query.return_value.filter.return_value.first.return_value
+        document.summary = None
+        db.query.return_value.filter.return_value.scalar.return_value = "Resumen del tema"
+
+        with patch('app.services.ingestion_service.iter_pdf_pages') as mock_pages, \
+             patch('app.services.ingestion_service.create_document_chunks_from_pages') as mock_chunks:
+            result = run_ingestion_job(10)
+
+        assert result == {"status": "indexed", "attempts": 1}
+        mock_clone.assert_called_once_with(db, 4, document.id)
+        mock_pages.assert_not_called()
+        mock_chunks.assert_not_called()
+        assert document.summary == "Resumen del tema"
+        assert mock_set_status.call_args.kwargs["chunk_count"] == 30
+        mock_summary.assert_not_called()
+
+    @pytest.mark.parametrize("attempts,expected", [(1, "queued"), (3, "failed")])
+    @patch('app.services.ingestion_service._set_job_status')
+    @patch('app.services.ingestion_service.find_indexed_duplicate', return_value=None)
+    @patch('app.services.ingestion_service.create_document_chunks_from_pages', return_value={"chunks": 0, "pages": 0})
+    @patch('app.services.ingestion_service.iter_pdf_pages', return_value=iter([]))
+    @patch('app.services.ingestion_service.SessionLocal')
+    def test_failures_are_retried_until_max_attempts(self, mock_session, mock_pages, mock_chunks, mock_duplicate, mock_set_status, attempts, expected):
+        """Un fallo vuelve a poner el trabajo en cola hasta agotar los intentos"""
+        with patch('app.services.ingestion_service._claim_job', return_value=_mock_job(attempts=attempts)):
+            result = run_ingestion_job(10)
+
+        assert result["status"] == expected
+        assert mock_set_status.call_args.args[1] == expected
+        assert "No se pudo extraer texto" in mock_set_status.call_args.kwargs["error"]
+        assert mock_session.return_value.rollback.called
+
+    @patch('app.services.ingestion_service._claim_job', return_value=None)
+    @patch('app.services.ingestion_service.SessionLocal')
+    def test_job_not_in_queue_is_skipped(self, mock_session, mock_claim):
+        """Un trabajo ya reclamado por otro proceso no se procesa dos veces"""
+        with patch('app.services.ingestion_service.iter_pdf_pages') as mock_pages:
+            assert run_ingestion_job(10)["status"] == "skipped"
+            mock_pages.assert_not_called()
+
+class TestIngestionQueue:
+    """Tests para la cola de trabajos de ingesta"""
+
+    @patch('app.services.ingestion_service.settings.INGESTION_RETRY_BACKOFF_SECONDS', 10)
+    def test_retry_uses_exponential_backoff(self):
+        """Los reintentos se encolan con espera exponencial"""
+        with patch('app.services.ingestion_service.enqueue_ingestion_job') as mock_enqueue:
+            _on_job_done(10, _done_future({"status": "queued", "attempts": 2}))
+            _on_job_done(11, _done_future({"status": "indexed", "attempts": 1}))
+
+        mock_enqueue.assert_called_once_with(10, delay_seconds=20)
+
+    @patch('app.services.ingestion_service.settings.INGESTION_RETRY_BACKOFF_SECONDS', 10)
+    def test_crashed_worker_replaces_the_pool_and_requeues_the_job(self):
+        """Si un proceso muere, el pool roto se descarta y el trabajo vuelve a la cola con espera"""
+        broken_pool = MagicMock()
+        future = Future()
+        future.set_exception(BrokenProcessPool("proceso terminado"))
+
+        with patch.object(ingestion_service, '_executor', broken_pool), \
+             patch('app.services.ingestion_service._recover_crashed_job',
+                   return_value={"status": "queued", "attempts": 1}) as mock_recover, \
+             patch('app.services.ingestion_service.enqueue_ingestion_job') as mock_enqueue:
+            _on_job_done(10, future, executor=broken_pool)
+            assert ingestion_service._executor is None
+
+        broken_pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        mock_recover.assert_called_once_with(10)
+        mock_enqueue.assert_called_once_with(10, delay_seconds=10)
+
+    @pytest.mark.parametrize("attempts,expected", [(1, "queued"), (3, "failed")])
+    @patch('app.services.ingestion_service.SessionLocal')
+    def test_crashed_job_counts_the_attempt(self, mock_session, attempts, expected):
+        """Un trabajo en curso cuyo proceso murió vuelve a la cola hasta agotar los intentos"""
+        job = _mock_job(attempts=attempts)
+        job.status = "embedding"
+        mock_session.return_value.query.return_value.filter.return_value.first.return_value = job
+
+        result = _recover_crashed_job(10)
+
+        assert result == {"status": expected, "attempts": attempts}
+        assert job.status == expected
+        assert "anómala" in job.error
+        mock_session.return_value.commit.assert_called_once()
+
+    def test_submit_to_broken_pool_uses_a_new_pool(self):
+        """Enviar un trabajo a un pool roto lo sustituye y reintenta el envío"""
+        broken_pool, new_pool = MagicMock(), MagicMock()
+        broken_pool.submit.side_effect = BrokenProcessPool("proceso terminado")
+
+        with patch.object(ingestion_service, '_executor', broken_pool), \
+             patch('app.services.ingestion_service.ProcessPoolExecutor', return_value=new_pool):
+            enqueue_ingestion_job(10)
+            assert ingestion_service._executor is new_pool
+
+        broken_pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        new_pool.submit.assert_called_once_with(run_ingestion_job, 10)
+
+    def test_only_failed_jobs_can_be_retried(self):
+        """Reintentar un trabajo que no ha fallado devuelve 400"""
+        mock_db = MagicMock()
+        with patch('app.services.ingestion_service.get_latest_ingestion_job', return_value=MagicMock(status="embedding")):
+            with pytest.raises(HTTPException) as exc_info:
+                retry_ingestion_job(mock_db, 5)
+
+        assert exc_info.value.status_code == 400
+
+    def test_failed_job_is_requeued(self):
+        """Un trabajo fallido vuelve a la cola con los intentos reiniciados"""
+        mock_db = MagicMock()
+        job = MagicMock(id=10, status="failed", attempts=3)
+        with patch('app.services.ingestion_service.get_latest_ingestion_job', return_value=job), \
+             patch('app.services.ingestion_service.enqueue_ingestion_job') as mock_enqueue:
+            retry_ingestion_job(mock_db, 5)
+
+        assert job.status == "queued"
+        assert job.attempts == 0
+        mock_enqueue.assert_called_once_with(10)
+
+    def test_upload_only_enqueues_the_ingestion(self, tmp_path):
+        """Subir un documento guarda el fichero y encola la ingesta sin procesar el PDF"""
+        from app.services.document_service import save_document
+
+        mock_db = MagicMock()
+        pdf_file = MagicMock()
+        pdf_file.filename = "tema1.pdf"
+        pdf_file.file.read.side_effect = [b"%PDF-1.4", b""]
+        document = MagicMock(user_id=1, subject_id=2, topic_id=0, title="Tema 1", description=None)
+        job = MagicMock(id=10)
+
+        with patch('app.services.document_service.settings.UPLOAD_FOLDER', str(tmp_path)), \
+             patch('app.services.document_service.create_ingestion_job', return_value=job), \
+             patch('app.services.document_service.enqueue_ingestion_job') as mock_enqueue:
+            saved_document, saved_job = save_document(mock_db, pdf_file, document)
+
+        assert saved_job is job
+        mock_enqueue.assert_called_once_with(10)
+
+    def test_upload_succeeds_when_the_job_cannot_be_submitted(self, tmp_path):
+        """Si el envío al pool falla, el documento se guarda y el trabajo queda en cola"""
+        from app.services.document_service import save_document
+
+        mock_db = MagicMock()
+        pdf_file = MagicMock()
+        pdf_file.filename = "tema1.pdf"
+        pdf_file.file.read.side_effect = [b"%PDF-1.4", b""]
+        document = MagicMock(user_id=1, subject_id=2, topic_id=0, title="Tema 1", description=None)
+        job = MagicMock(id=10, status="queued")
+
+        with patch('app.services.document_service.settings.UPLOAD_FOLDER', str(tmp_path)), \
+             patch('app.services.document_service.create_ingestion_job', return_value=job), \
+             patch('app.services.document_service.enqueue_ingestion_job', side_effect=BrokenProcessPool("roto")):
+            saved_document, saved_job = save_document(mock_db, pdf_file, document)
+
+        assert saved_job is job
+        assert saved_job.status == "queued"
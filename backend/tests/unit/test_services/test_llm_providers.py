@@ -0,0 +1,151 @@
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from app.services.llm_providers import (
+    FakeLLMProvider,
+    GeminiProvider,
+    LatencyProfile,
+    LLMProvider,
+    load_llm_provider
+)
+
+
+class TestFakeLLMProvider:
+    """Tests para el proveedor de LLM simulado"""
+
+    def test_same_prompt_gives_same_answer(self):
+        provider = FakeLLMProvider("instant", output_tokens=20)
+
+        first = provider.generate("¿Qué es una pila? Material: estructura LIFO", timeout=1)
+
+        assert first == provider.generate("¿Qué es una pila? Material: estructura LIFO", timeout=1)
+        assert first != provider.generate("¿Qué es una cola? Material: estructura FIFO", timeout=1)
+        assert len(first.split()) == 20
+        assert first.startswith("Respuesta simulada:")
+
+    def test_latency_follows_profile_and_prompt_size(self):
+        provider = FakeLLMProvider(LatencyProfile(100, 50, 200), output_tokens=100)
+
+        # 100 ms + 200 ms por cada 1000 tokens del prompt (4000 caracteres) + 100 tokens a 50 tokens/s
+        assert provider.first_token_seconds("a" * 4000) == pytest.approx(0.3)
+        assert provider.latency_seconds("a" * 4000) == pytest.approx(2.3)
+
+    def test_generate_times_out(self):
+        provider = FakeLLMProvider(LatencyProfile(50, 0))
+
+        with patch('app.services.llm_providers.time.sleep') as mock_sleep:
+            with pytest.raises(TimeoutError):
+                provider.generate("pregunta", timeout=0.01)
+        mock_sleep.assert_called_once_with(0.01)
+
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError):
+            FakeLLMProvider("inexistente")
+
+    @pytest.mark.asyncio
+    async def test_stream_matches_generate(self):
+        provider = FakeLLMProvider("instant", output_tokens=30)
+        contents = [{"mime_type": "image/png", "data": "..."}, "Describe la imagen del grafo dirigido"]
+
+        stream = await provider.open_stream(contents, timeout=1)
+        chunks = [chunk async for chunk in stream]
+
+        assert len(chunks) == 4
+        assert "".join(chunks) == await provider.generate_async(contents, timeout=1)
+
+
+class TestGeminiProvider:
+    """Tests para el proveedor de Google AI"""
+
+    def test_generate_passes_timeout_and_handles_blocked_responses(self):
+        client = MagicMock()
+        blocked = MagicMock()
+        type(blocked).text = property(lambda self: (_ for _ in ()).throw(ValueError("sin partes")))
+        client.generate_content.side_effect = [MagicMock(text="Hola"), blocked]
+        provider = GeminiProvider(client=client)
+
+        assert provider.generate(["prompt"], timeout=12) == "Hola"
+        assert client.generate_content.call_args.kwargs["request_options"] == {"timeout": 12}
+        assert provider.generate(["prompt"], timeout=12) == ""
+
+    def test_use_instructions_disabled_by_default(self):
+        provider = GeminiProvider(client=MagicMock())
+
+        with patch('app.services.llm_providers.settings.GOOGLE_AI_SYSTEM_INSTRUCTION', False):
+            assert provider.use_instructions("chat", "### Instrucciones:") is False
+
+    @pytest.mark.asyncio
+    async def test_instructions_client_is_used_for_its_key(self):
+        default_client, instructions_client = MagicMock(), MagicMock()
+        instructions_client.generate_content_async = AsyncMock(return_value=MagicMock(text="ok"))
+        provider = GeminiProvider(client=default_client)
+
+        with patch('app.services.llm_providers.settings.GOOGLE_AI_SYSTEM_INSTRUCTION', True), \
+             patch('app.services.llm_providers.settings.GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS', 0), \
+             patch('app.services.llm_providers.genai') as mock_genai:
+            mock_genai.GenerativeModel.return_value = instructions_client
+            assert provider.use_instructions("chat", "### Instrucciones:")
+            assert await provider.generate_async(["huecos"], timeout=5, instructions_key="chat") == "ok"
+
+        default_client.generate_content_async.assert_not_called()
+
+    def test_context_cache_is_created_in_the_background(self):
+        provider = GeminiProvider(client=MagicMock())
+        pending = []
+
+        with patch('app.services.llm_providers.settings.GOOGLE_AI_SYSTEM_INSTRUCTION', True), \
+             patch('app.services.llm_providers.settings.GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS', 3600), \
+             patch('app.services.llm_providers._start_background',
+                   side_effect=lambda target, *args: pending.append((target, args))), \
+             patch('app.services.llm_providers.genai') as mock_genai:
+            # Mientras se crea la caché se envía el prompt completo y no se lanza otra creación
+            assert provider.use_instructions("chat", "### Instrucciones:") is False
+            assert provider.use_instructions("chat", "### Instrucciones:") is False
+            assert len(pending) == 1
+            mock_genai.caching.CachedContent.create.assert_not_called()
+
+            target, args = pending.pop()
+            target(*args)
+            assert provider.use_instructions("chat", "### Instrucciones:") is True
+            mock_genai.caching.CachedContent.create.assert_called_once()
+
+    def test_failed_creation_is_retried_after_backoff(self):
+        provider = GeminiProvider(client=MagicMock())
+
+        with patch('app.services.llm_providers.settings.GOOGLE_AI_SYSTEM_INSTRUCTION', True), \
+             patch('app.services.llm_providers.settings.GOOGLE_AI_CONTEXT_CACHE_TTL_SECONDS', 3600), \
+             patch('app.services.llm_providers._start_background', side_effect=lambda target, *args: target(*args)), \
+             patch('app.services.llm_providers.time.monotonic') as mock_clock, \
+             patch('app.services.llm_providers.genai') as mock_genai:
+            mock_clock.return_value = 1000.0
+            create = mock_genai.caching.CachedContent.create
+            create.side_effect = [Exception("503"), MagicMock()]
+
+            assert provider.use_instructions("chat", "### Instrucciones:") is False
+            mock_clock.return_value = 1010.0
+            assert provider.use_instructions("chat", "### Instrucciones:") is False
+            assert create.call_count == 1
+
+            mock_clock.return_value = 1031.0
+            assert provider.use_instructions("chat", "### Instrucciones:") is True
+            assert create.call_count == 2
+
+
+def test_incomplete_provider_cannot_be_created():
+    class OnlyGenerate(LLMProvider):
+        def generate(self, contents, timeout, instructions_key=None):
+            return "ok"
+
+    with pytest.raises(TypeError):
+        OnlyGenerate()
+
+
+def test_load_llm_provider():
+    with patch('app.services.llm_providers.settings.LLM_FAKE_PROFILE', "gemma"), \
+         patch('app.services.llm_providers.settings.LLM_FAKE_OUTPUT_TOKENS', 50):
+        provider = load_llm_provider("fake")
+
+    assert isinstance(provider, FakeLLMProvider)
+    assert provider.output_tokens == 50
+    with pytest.raises(ValueError):
+        load_llm_provider("openai")
@@ -0,0 +1,282 @@
+import pytest
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from app.services.reembedding_service import (
+    _embed_next_batch,
+    _on_job_done,
+    _swap_embeddings,
+    cancel_reembedding_job,
+    discard_previous_embeddings,
+    run_reembedding_job,
+    start_reembedding
+)
+
+def _mock_job(status="running", processed_chunks=0, total_chunks=None):
+    job = MagicMock()
+    job.id = 3
+    job.target_model = "modelo-nuevo"
+    job.status = status
+    job.last_chunk_id = 0
+    job.processed_chunks = processed_chunks
+    job.total_chunks = total_chunks
+    return job
+
+def _mock_model(dimensions=768):
+    model = MagicMock()
+    model.encode.side_effect = lambda texts: np.ones((len(texts), dimensions), dtype=np.float32)
+    return model
+
+class TestEmbedNextBatch:
+    """Tests para la recodificación de un lote de chunks"""
+
+    @patch('app.services.reembedding_service._pending_chunks_query')
+    def test_batch_is_staged_and_cursor_advances(self, mock_pending):
+        """El lote se guarda en la tabla auxiliar y el cursor avanza al último chunk"""
+        rows = [SimpleNamespace(id=4, content="Pila"), SimpleNamespace(id=9, content="Cola")]
+        mock_pending.return_value.limit.return_value.all.return_value = rows
+        db = MagicMock()
+        job = _mock_job()
+
+        assert _embed_next_batch(db, job, _mock_model()) == 2
+
+        staged = db.execute.call_args[0][1]
+        assert [row["chunk_id"] for row in staged] == [4, 9]
+        assert all(row["job_id"] == 3 for row in staged)
+        assert job.last_chunk_id == 9
+        assert job.processed_chunks == 2
+        db.commit.assert_not_called()
+
+    @patch('app.services.reembedding_service._pending_chunks_query')
+    def test_no_pending_chunks(self, mock_pending):
+        """Sin chunks pendientes no se codifica nada"""
+        mock_pending.return_value.limit.return_value.all.return_value = []
+        model = _mock_model()
+
+        assert _embed_next_batch(MagicMock(), _mock_job(), model) == 0
+        model.encode.assert_not_called()
+
+    @patch('app.services.reembedding_service._pending_chunks_query')
+    def test_dimension_mismatch_is_rejected(self, mock_pending):
+        """Un modelo con otra dimensión no puede escribir en la columna de embeddings"""
+        mock_pending.return_value.limit.return_value.all.return_value = [SimpleNamespace(id=1, content="Pila")]
+        db = MagicMock()
+
+        with pytest.raises(ValueError, match="migración"):
+            _embed_next_batch(db, _mock_job(), _mock_model(dimensions=384))
+        db.execute.assert_not_called()
+
+class TestRunReembeddingJob:
+    """Tests para la ejecución de un trabajo de re-embedding"""
+
+    @patch('app.services.reembedding_service._swap_embeddings')
+    @patch('app.services.reembedding_service.load_sentence_transformer_model_singleton')
+    @patch('app.services.reembedding_service._claim_job')
+    @patch('app.services.reembedding_service.SessionLocal')
+    def test_batches_are_committed_then_swapped(self, mock_session, mock_claim, mock_load, mock_swap):
+        """Cada lote se confirma por separado y al terminar se activa el modelo"""
+        job = _mock_job(total_chunks=5)
+        mock_claim.return_value = job
+        db = mock_session.return_value
+
+        with patch('app.services.reembedding_service._embed_next_batch', side_effect=[3, 2, 0]):
+            result = run_reembedding_job(3)
+
+        assert result["status"] == "swapped"
+        assert db.commit.call_count == 2
+        mock_load.assert_called_once_with("modelo-nuevo")
+        mock_swap.assert_called_once_with(db, job, mock_load.return_value)
+        db.close.assert_called_once()
+
+    @patch('app.services.reembedding_service._swap_embeddings')
+    @patch('app.services.reembedding_service.load_sentence_transformer_model_singleton')
+    @patch('app.services.reembedding_service._claim_job')
+    @patch('app.services.reembedding_service.SessionLocal')
+    def test_cancelled_job_stops_without_swap(self, mock_session, mock_claim, mock_load, mock_swap):
+        """Un trabajo cancelado entre lotes se detiene sin cambiar de modelo"""
+        job = _mock_job(status="cancelled", total_chunks=5)
+        mock_claim.return_value = job
+
+        with patch('app.services.reembedding_service._embed_next_batch') as mock_batch:
+            result = run_reembedding_job(3)
+
+        assert result["status"] == "cancelled"
+        mock_batch.assert_not_called()
+        mock_swap.assert_not_called()
+
+    @patch('app.services.reembedding_service._swap_embeddings')
+    @patch('app.services.reembedding_service.load_sentence_transformer_model_singleton')
+    @patch('app.services.reembedding_service._claim_job')
+    @patch('app.services.reembedding_service.SessionLocal')
+    def test_errors_mark_the_job_failed(self, mock_session, mock_claim, mock_load, mock_swap):
+        """Un error deshace el lote en curso y deja el trabajo en failed"""
+        mock_claim.return_value = _mock_job(total_chunks=5)
+        db = mock_session.return_value
+
+        with patch('app.services.reembedding_service._embed_next_batch', side_effect=ValueError("dimensión")):
+            result = run_reembedding_job(3)
+
+        assert result["status"] == "failed"
+        db.rollback.assert_called_once()
+        update = db.query.return_value.filter.return_value.update.call_args[0][0]
+        assert "failed" in update.values()
+        # Los lotes ya confirmados no se quedan huérfanos en chunk_reembeddings
+        db.query.return_value.filter.return_value.delete.assert_called_once()
+        mock_swap.assert_not_called()
+
+    @patch('app.services.reembedding_service._swap_embeddings')
+    @patch('app.services.reembedding_service.load_sentence_transformer_model_singleton')
+    @patch('app.services.reembedding_service._claim_job')
+    @patch('app.services.reembedding_service.SessionLocal')
+    def test_swap_db_error_requeues_the_job(self, mock_session, mock_claim, mock_load, mock_swap):
+        """Si el volcado falla en la BD (p. ej. lock_timeout) el trabajo vuelve a la cola con sus lotes"""
+        mock_claim.return_value = _mock_job(total_chunks=5)
+        mock_swap.side_effect = OperationalError("LOCK TABLE", {}, Exception("lock timeout"))
+        db = mock_session.return_value
+
+        with patch('app.services.reembedding_service._embed_next_batch', side_effect=[5, 0]):
+            result = run_reembedding_job(3)
+
+        assert result["status"] == "queued"
+        db.rollback.assert_called_once()
+        update = db.query.return_value.filter.return_value.update.call_args[0][0]
+        assert "queued" in update.values()
+        db.query.return_value.filter.return_value.delete.assert_not_called()
+
+    @patch('app.services.reembedding_service.enqueue_reembedding_job')
+    def test_requeued_job_is_retried_later(self, mock_enqueue):
+        """Un trabajo devuelto a la cola se vuelve a enviar tras REEMBEDDING_SWAP_RETRY_SECONDS"""
+        future = MagicMock()
+        future.result.return_value = {"status": "queued", "processed_chunks": 5}
+
+        with patch('app.services.reembedding_service.settings.REEMBEDDING_SWAP_RETRY_SECONDS', 60):
+            _on_job_done(3, future)
+
+        mock_enqueue.assert_called_once_with(3, delay_seconds=60)
+
+    @patch('app.services.reembedding_service.get_active_embedding_model_name', return_value="modelo-actual")
+    @patch('app.services.reembedding_service._embed_next_batch', return_value=0)
+    def test_swap_runs_without_statement_timeout(self, mock_batch, mock_active):
+        """El volcado no tiene statement_timeout y limita la espera por el bloqueo"""
+        db = MagicMock()
+        job = _mock_job()
+
+        with patch('app.services.reembedding_service.settings.REEMBEDDING_SWAP_LOCK_TIMEOUT_MS', 5000):
+            _swap_embeddings(db, job, _mock_model())
+
+        statements = [str(call.args[0]) for call in db.execute.call_args_list]
+        assert statements[:3] == [
+            "SET LOCAL statement_timeout = 0",
+            "SET LOCAL lock_timeout = 5000",
+            "LOCK TABLE document_chunks IN SHARE ROW EXCLUSIVE MODE"
+        ]
+        assert job.status == "swapped"
+        db.commit.assert_called_once()
+
+    @patch('app.services.reembedding_service.delete_previous_embeddings')
+    @patch('app.services.reembedding_service.get_active_embedding_model_name', return_value="modelo-actual")
+    @patch('app.services.reembedding_service._embed_next_batch', return_value=0)
+    def test_swap_keeps_previous_model_vectors(self, mock_batch, mock_active, mock_delete):
+        """El volcado deja los vectores del modelo activo en la tabla auxiliar y descarta los de trabajos anteriores"""
+        db = MagicMock()
+        job = _mock_job()
+
+        _swap_embeddings(db, job, _mock_model())
+
+        swap_sql, swap_params = [
+            (str(call.args[0]), call.args[1]) for call in db.execute.call_args_list if "RETURNING" in str(call.args[0])
+        ][0]
+        assert "RETURNING c.id, old.embedding" in swap_sql
+        assert "UPDATE chunk_reembeddings" in swap_sql
+        assert swap_params == {"model": "modelo-nuevo", "previous_model": "modelo-actual", "job_id": 3}
+        mock_delete.assert_called_once_with(db)
+        assert job.previous_model == "modelo-actual"
+
+    @patch('app.services.reembedding_service.threading.Timer')
+    @patch('app.services.reembedding_service.get_active_embedding_model')
+    def test_previous_vectors_are_discarded_after_grace_period(self, mock_active, mock_timer):
+        """Tras el volcado se programa el borrado de los vectores anteriores pasado el periodo de gracia"""
+        future = MagicMock()
+        future.result.return_value = {"status": "swapped", "processed_chunks": 5}
+
+        with patch('app.services.reembedding_service.settings.REEMBEDDING_PREVIOUS_VECTORS_GRACE_SECONDS', 90):
+            _on_job_done(3, future)
+
+        mock_active.assert_called_once_with(refresh=True)
+        mock_timer.assert_called_once_with(90, discard_previous_embeddings, args=(3,))
+        mock_timer.return_value.start.assert_called_once()
+
+    @patch('app.services.reembedding_service._claim_job', return_value=None)
+    @patch('app.services.reembedding_service.SessionLocal')
+    def test_job_not_queued_is_skipped(self, mock_session, mock_claim):
+        """Un trabajo que ya no está en cola no se procesa"""
+        assert run_reembedding_job(3) == {"status": "skipped", "processed_chunks": 0}
+
+class TestReembeddingJobManagement:
+    """Tests para la creación y cancelación de trabajos de re-embedding"""
+
+    @patch('app.services.reembedding_service.enqueue_reembedding_job')
+    @patch('app.services.reembedding_service.get_active_embedding_model', return_value="modelo-actual")
+    def test_start_enqueues_job(self, mock_active, mock_enqueue):
+        """Se crea un trabajo en cola para el modelo indicado"""
+        db = MagicMock()
+        db.query.return_value.filter.return_value.first.return_value = None
+
+        job = start_reembedding(db, " modelo-nuevo ")
+
+        assert job.target_model == "modelo-nuevo"
+        assert job.status == "queued"
+        db.commit.assert_called_once()
+        mock_enqueue.assert_called_once()
+
+    @patch('app.services.reembedding_service.enqueue_reembedding_job')
+    @patch('app.services.reembedding_service.get_active_embedding_model', return_value="modelo-actual")
+    def test_start_rejects_active_model_and_concurrent_jobs(self, mock_active, mock_enqueue):
+        """No se re-embebe con el modelo activo ni con otro trabajo en curso"""
+        db = MagicMock()
+        db.query.return_value.filter.return_value.first.return_value = None
+        with pytest.raises(HTTPException) as exc:
+            start_reembedding(db, "modelo-actual")
+        assert exc.value.status_code == 400
+
+        db.query.return_value.filter.return_value.first.return_value = _mock_job()
+        with pytest.raises(HTTPException) as exc:
+            start_reembedding(db, "modelo-nuevo")
+        assert exc.value.status_code == 409
+        mock_enqueue.assert_not_called()
+
+    @patch('app.services.reembedding_service.enqueue_reembedding_job')
+    @patch('app.services.reembedding_service.get_active_embedding_model', return_value="modelo-actual")
+    def test_start_with_active_model_repairs_stale_chunks(self, mock_active, mock_enqueue):
+        """Con el modelo activo se admite el trabajo si quedan chunks de otro modelo"""
+        db = MagicMock()
+        db.query.return_value.filter.return_value.first.side_effect = [SimpleNamespace(id=7), None]
+
+        job = start_reembedding(db, "modelo-actual")
+
+        assert job.target_model == "modelo-actual"
+        mock_enqueue.assert_called_once()
+
+    def test_cancel_discards_staged_embeddings(self):
+        """Cancelar marca el trabajo y borra los embeddings ya calculados"""
+        db = MagicMock()
+        job = _mock_job(status="running")
+        db.query.return_value.filter.return_value.first.return_value = job
+
+        cancel_reembedding_job(db, 3)
+
+        assert job.status == "cancelled"
+        db.query.return_value.filter.return_value.delete.assert_called_once()
+        db.commit.assert_called_once()
+
+    def test_cancel_finished_job_is_rejected(self):
+        """Un trabajo terminado no se puede cancelar"""
+        db = MagicMock()
+        db.query.return_value.filter.return_value.first.return_value = _mock_job(status="swapped")
+
+        with pytest.raises(HTTPException) as exc:
+            cancel_reembedding_job(db, 3)
+        assert exc.value.status_code == 400
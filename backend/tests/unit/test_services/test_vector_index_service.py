@@ -0,0 +1,58 @@
+import pytest
+from unittest.mock import MagicMock
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud.crud_vector import set_vector_search_params
+from app.services.vector_index_service import build_create_index_sql
+
+
+class TestVectorIndexService:
+    """Tests para la gestión de índices vectoriales"""
+
+    def test_build_create_index_sql_hnsw(self):
+        """El índice HNSW usa la clase de operadores de la métrica"""
+        sql = build_create_index_sql("cosine", "hnsw")
+
+        assert sql.startswith("CREATE INDEX CONCURRENTLY ix_document_chunks_embedding_cosine")
+        assert "USING hnsw (embedding vector_cosine_ops)" in sql
+        assert f"m = {settings.HNSW_M}" in sql
+
+    def test_build_create_index_sql_ivfflat(self):
+        """El índice IVFFlat se crea con el número de listas configurado"""
+        sql = build_create_index_sql("inner_product", "ivfflat", index_name="tmp_idx", concurrently=False)
+
+        assert sql.startswith("CREATE INDEX tmp_idx")
+        assert "USING ivfflat (embedding vector_ip_ops)" in sql
+        assert f"lists = {settings.IVFFLAT_LISTS}" in sql
+
+    def test_build_create_index_sql_invalid(self):
+        """Métricas o tipos de índice desconocidos devuelven 400"""
+        with pytest.raises(HTTPException) as exc:
+            build_create_index_sql("manhattan")
+        assert exc.value.status_code == 400
+
+        with pytest.raises(HTTPException):
+            build_create_index_sql("cosine", "btree")
+
+    def test_set_vector_search_params_defaults_skip_query(self):
+        """Con los valores por defecto no se envía ninguna sentencia"""
+        mock_db = MagicMock(spec=Session)
+
+        set_vector_search_params(mock_db)
+        set_vector_search_params(mock_db, ef_search=settings.HNSW_EF_SEARCH, probes=settings.IVFFLAT_PROBES)
+
+        mock_db.execute.assert_not_called()
+
+    def test_set_vector_search_params_override(self):
+        """Los valores distintos se fijan en una única sentencia local a la transacción"""
+        mock_db = MagicMock(spec=Session)
+
+        set_vector_search_params(mock_db, ef_search=200, probes=settings.IVFFLAT_PROBES + 5)
+
+        mock_db.execute.assert_called_once()
+        statement, params = mock_db.execute.call_args[0]
+        assert "hnsw.ef_search" in str(statement)
+        assert "ivfflat.probes" in str(statement)
+        assert params == {"ef_search": "200", "probes": str(settings.IVFFLAT_PROBES + 5)}
@@ -0,0 +1,112 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from app.crud.crud_vector import RetrievedChunk, build_similarity_query, search_similar_chunks_db
+
+
+class TestSimilarityQuery:
+    """Tests para la consulta de similitud con parámetros enlazados"""
+
+    @pytest.mark.parametrize("metric, operator", [
+        ("cosine", "<=>"),
+        ("l2", "<->"),
+        ("inner_product", "<#>"),
+    ])
+    def test_query_uses_bound_embedding(self, metric, operator):
+        """El embedding se envía como parámetro y no como texto SQL"""
+        sql = str(build_similarity_query(metric).compile(dialect=postgresql.dialect()))
+
+        assert f"{operator} CAST(%(query_embedding)s AS vector(768))" in sql
+        assert "LIMIT %(limit)s" in sql
+        assert "ARRAY[" not in sql
+
+    def test_query_is_built_once_per_shape(self):
+        """La misma (métrica, filtro) reutiliza la misma sentencia"""
+        assert build_similarity_query("cosine", True) is build_similarity_query("cosine", True)
+        assert build_similarity_query("cosine", True) is not build_similarity_query("cosine", False)
+
+        sql = str(build_similarity_query("cosine", True).compile(dialect=postgresql.dialect()))
+        assert "documents.subject_id = %(subject_id)s" in sql
+
+    def test_search_similar_chunks_db_params(self):
+        """La búsqueda pasa embedding, asignatura y límite como parámetros"""
+        mock_db = MagicMock(spec=Session)
+        row = MagicMock(id=7, document_id=2, document_title="Tema 1", content="Contenido", chunk_number=0, page_number=3, distance=0.25)
+        mock_db.execute.return_value.all.return_value = [row]
+        embedding = [0.1] * 768
+
+        results = search_similar_chunks_db(mock_db, embedding, subject_id=3, limit=5)
+
+        query, params = mock_db.execute.call_args[0]
+        assert query is build_similarity_query("cosine", True, False, False)
+        assert params == {"query_embedding": embedding, "limit": 5, "subject_id": 3}
+        assert results == [(RetrievedChunk(7, 2, "Tema 1", "Contenido", 0, 3), 0.75)]
+
+    def test_previous_vectors_query_reads_swapped_job_vectors(self):
+        """La consulta de vectores anteriores compara con chunk_reembeddings de un trabajo ya volcado"""
+        sql = str(build_similarity_query("cosine", True, True, True).compile(dialect=postgresql.dialect()))
+
+        assert "chunk_reembeddings.embedding <=> CAST(%(query_embedding)s AS vector(768))" in sql
+        assert "reembedding_jobs.status = %(status_1)s" in sql
+        assert "reembedding_jobs.previous_model = %(embedding_model)s" in sql
+        assert "document_chunks.embedding_model" not in sql
+
+    def test_query_projects_title_without_embedding(self):
+        """La consulta trae el título del documento y no el embedding"""
+        sql = str(build_similarity_query("cosine").compile(dialect=postgresql.dialect()))
+        select_clause = sql.split("FROM")[0]
+
+        assert "documents.title AS document_title" in select_clause
+        assert "document_chunks.embedding," not in select_clause
+        assert "JOIN documents" in sql
+
+
+class TestRetrievalDiagnostics:
+    """Tests para el modo de diagnóstico de la recuperación"""
+
+    def test_search_issues_single_query_without_diagnostics(self):
+        """Sin diagnóstico, la búsqueda ejecuta una única consulta"""
+        from app.services.vector_service import search_similar_chunks
+
+        mock_db = MagicMock(spec=Session)
+        row = MagicMock(id=7, document_id=2, document_title="Tema 1", content="Contenido", chunk_number=0, page_number=3, distance=0.25)
+        mock_db.execute.return_value.all.return_value = [row]
+
+        with patch("app.services.vector_service.settings.RETRIEVAL_DIAGNOSTICS", False):
+            results = search_similar_chunks(mock_db, [0.1] * 768, subject_id=1)
+
+        assert len(results) == 1
+        mock_db.execute.assert_called_once()
+        mock_db.query.assert_not_called()
+
+    def test_search_falls_back_to_previous_model_vectors(self):
+        """Sin chunks del modelo de la pregunta (justo tras un cambio de modelo) se buscan los vectores conservados"""
+        from app.services.vector_service import search_similar_chunks
+
+        mock_db = MagicMock(spec=Session)
+        row = MagicMock(id=7, document_id=2, document_title="Tema 1", content="Contenido", chunk_number=0, page_number=3, distance=0.25)
+        mock_db.execute.return_value.all.side_effect = [[], [row]]
+
+        with patch("app.services.vector_service.settings.RETRIEVAL_DIAGNOSTICS", False), \
+             patch("app.services.vector_service.get_active_embedding_model", return_value="modelo-anterior"):
+            results = search_similar_chunks(mock_db, [0.1] * 768, subject_id=1)
+
+        assert results == [(RetrievedChunk(7, 2, "Tema 1", "Contenido", 0, 3), 0.75)]
+        query, params = mock_db.execute.call_args_list[-1][0]
+        assert query is build_similarity_query("cosine", True, True, True)
+        assert params["embedding_model"] == "modelo-anterior"
+
+    def test_search_runs_diagnostics_when_enabled(self):
+        """Con diagnóstico activado se consultan los conteos de la asignatura"""
+        from app.services.vector_service import search_similar_chunks
+
+        mock_db = MagicMock(spec=Session)
+        mock_db.execute.return_value.all.return_value = []
+
+        with patch("app.services.vector_service.settings.RETRIEVAL_DIAGNOSTICS", True), \
+             patch("app.services.vector_service.get_retrieval_diagnostics") as mock_diagnostics:
+            search_similar_chunks(mock_db, [0.1] * 768, subject_id=1)
+
+        mock_diagnostics.assert_called_once_with(mock_db, 1)
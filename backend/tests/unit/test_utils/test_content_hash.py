@@ -0,0 +1,27 @@
+import io
+import os
+
+from app.utils.content_hash import chunk_content_hash, store_content_addressed
+
+class TestContentHash:
+    """Tests para el almacenamiento y los hashes por contenido"""
+
+    def test_chunk_hash_ignores_whitespace(self):
+        """Chunks que solo difieren en espacios comparten hash"""
+        assert chunk_content_hash("Una pila  es LIFO.\n") == chunk_content_hash("Una pila es LIFO.")
+        assert chunk_content_hash("Una pila es LIFO.") != chunk_content_hash("Una cola es FIFO.")
+
+    def test_identical_files_are_stored_once(self, tmp_path):
+        """El mismo contenido se guarda una sola vez y sin ficheros temporales"""
+        first_path, first_hash, first_reused = store_content_addressed(io.BytesIO(b"%PDF-1.4 tema"), str(tmp_path))
+        second_path, second_hash, second_reused = store_content_addressed(io.BytesIO(b"%PDF-1.4 tema"), str(tmp_path))
+        other_path, other_hash, _ = store_content_addressed(io.BytesIO(b"%PDF-1.4 otro"), str(tmp_path))
+
+        assert (first_reused, second_reused) == (False, True)
+        assert first_path == second_path
+        assert first_hash == second_hash != other_hash
+        assert other_path != first_path
+        assert os.path.basename(first_path) == f"{first_hash}.pdf"
+        with open(first_path, "rb") as f:
+            assert f.read() == b"%PDF-1.4 tema"
+        assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
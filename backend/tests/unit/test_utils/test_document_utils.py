@@ -1,14 +1,22 @@
+import asyncio
+import threading
 import pytest
 from unittest.mock import patch, MagicMock
 import io
 import numpy as np
 
 from app.utils.document_utils import extract_text_from_pdf
+from app.utils.embedding_batcher import EmbeddingBatcher
 from app.services.embedding_service import (
     load_sentence_transformer_model_singleton, 
     get_embedding_for_query,
+    get_embedding_for_query_async,
     semantic_split_text,
-    create_document_chunks
+    create_document_chunks,
+    adjacent_similarities,
+    embed_chunks,
+    pool_chunk_embeddings,
+    semantic_split_sentences
 )
 
 @pytest.fixture
@@ -55,7 +63,7 @@ class TestDocumentUtils:
 class TestEmbeddingService:
     """Tests para el servicio de embeddings"""
     
-    @patch('app.services.embedding_service.SentenceTransformer')
+    @patch('app.services.embedding_backends.SentenceTransformer')
     def test_load_sentence_transformer_model_singleton(self, mock_st):
         """Test para el patrón singleton del modelo de transformers"""
         # Primero, resetear la variable global para la prueba
@@ -74,6 +82,7 @@ class TestEmbeddingService:
         assert model1 == model2
         mock_st.assert_called_once()
     
+    @patch('app.services.embedding_service.query_embedding_batcher', None)
     @patch('app.services.embedding_service.load_sentence_transformer_model_singleton')
     def test_get_embedding_for_query(self, mock_load_model):
         """Test para obtener embeddings de consultas"""
@@ -90,7 +99,53 @@ class TestEmbeddingService:
         assert isinstance(result, list)
         assert len(result) == 768
         mock_model.encode.assert_called_once_with("¿Qué es Python?")
+
+    @patch('app.services.embedding_service.query_embedding_cache', None)
+    @patch('app.services.embedding_service.get_active_embedding_model', return_value='modelo')
+    def test_get_embedding_for_query_uses_batcher(self, mock_active):
+        """Con el agrupador activo la consulta se codifica en un lote"""
+        batcher = EmbeddingBatcher(lambda model_name, texts: np.ones((len(texts), 768)), max_wait_ms=1)
+        with patch('app.services.embedding_service.query_embedding_batcher', batcher):
+            result = get_embedding_for_query("¿Qué  es Python?")
+            async_result = asyncio.run(get_embedding_for_query_async("¿Qué es Python?"))
+        batcher.close()
+
+        assert result == async_result == [1.0] * 768
+        assert batcher.stats()["items"] == 2
     
+    @patch('app.services.embedding_service.query_embedding_cache', None)
+    @patch('app.services.embedding_service.get_active_embedding_model', return_value='modelo')
+    @patch('app.services.embedding_service.load_sentence_transformer_model_singleton')
+    def test_get_embedding_for_query_can_skip_batcher(self, mock_load_model, mock_active):
+        """Con use_batcher=False el texto se codifica aparte y no entra en el lote de las preguntas"""
+        mock_load_model.return_value.encode.return_value = np.ones(768)
+        batcher = EmbeddingBatcher(lambda model_name, texts: np.zeros((len(texts), 768)), max_wait_ms=1)
+        with patch('app.services.embedding_service.query_embedding_batcher', batcher):
+            result = get_embedding_for_query("Respuesta larga del bot", use_cache=False, use_batcher=False)
+        batcher.close()
+
+        assert result == [1.0] * 768
+        assert batcher.stats()["items"] == 0
+        mock_load_model.return_value.encode.assert_called_once_with("Respuesta larga del bot")
+
+    @patch('app.services.embedding_service.query_embedding_cache', None)
+    def test_get_embedding_for_query_async_reads_model_off_the_event_loop(self):
+        """La lectura del modelo activo (que puede consultar la BD) no bloquea el bucle de eventos"""
+        threads = []
+
+        def active_model(refresh=False):
+            threads.append(threading.current_thread())
+            return 'modelo'
+
+        batcher = EmbeddingBatcher(lambda model_name, texts: np.ones((len(texts), 768)), max_wait_ms=1)
+        with patch('app.services.embedding_service.query_embedding_batcher', batcher), \
+             patch('app.services.embedding_service.get_active_embedding_model', side_effect=active_model):
+            result = asyncio.run(get_embedding_for_query_async("¿Qué es Python?"))
+        batcher.close()
+
+        assert result == [1.0] * 768
+        assert threads and threading.main_thread() not in threads
+
     @patch('nltk.tokenize.sent_tokenize')
     @patch('app.services.embedding_service.load_sentence_transformer_model_singleton')
     def test_semantic_split_text(self, mock_load_model, mock_sent_tokenize):
@@ -112,12 +167,18 @@ class TestEmbeddingService:
         assert len(result) > 0  # Al menos debería devolver algún chunk
         mock_sent_tokenize.assert_called_once_with("Este es un texto de prueba que debería dividirse en chunks.")
     
-    @patch('app.services.embedding_service.semantic_split_text')
+    @patch('app.services.embedding_service.settings.CHUNK_EMBEDDING_MODE', 'reencode')
+    @patch('app.services.embedding_service.semantic_split_sentences')
     @patch('app.services.embedding_service.load_sentence_transformer_model_singleton')
     def test_create_document_chunks(self, mock_load_model, mock_split, mock_db_session):
         """Test para la creación de chunks de documento"""
         # Configurar los mocks
-        mock_split.return_value = ["Chunk 1", "Chunk 2", "Chunk 3"]
+        mock_split.return_value = (
+            ["Chunk 1", "Chunk 2", "Chunk 3"],
+            [(0, 1), (1, 2), (2, 3)],
+            np.random.rand(3, 768),
+            ["Chunk 1", "Chunk 2", "Chunk 3"]
+        )
         
         mock_model = MagicMock()
         mock_embeddings = np.random.rand(3, 768)
@@ -125,10 +186,97 @@ class TestEmbeddingService:
         mock_load_model.return_value = mock_model
         
         # Llamar a la función
-        chunks = create_document_chunks(mock_db_session, 1, "Este es un texto de prueba.")
+        with patch('app.services.embedding_service.bulk_insert_document_chunks',
+                   return_value={"chunks": 3, "method": "copy", "bytes": 0, "seconds": 0.1, "chunks_per_second": 30.0}) as mock_bulk:
+            stats = create_document_chunks(mock_db_session, 1, "Este es un texto de prueba.")
         
         # Verificar resultado
-        assert mock_db_session.add_all.called
-        assert mock_db_session.flush.called
+        assert mock_bulk.call_args[0][2] == ["Chunk 1", "Chunk 2", "Chunk 3"]
+        assert mock_db_session.commit.called
+        assert stats["chunks"] == 3
         mock_split.assert_called_once_with("Este es un texto de prueba.", mock_model)
-        mock_model.encode.assert_called_once()
\ No newline at end of file
+        mock_model.encode.assert_called_once()
+
+    def test_adjacent_similarities_match_pairwise_cosine(self):
+        """El cálculo por lotes coincide con la similitud coseno par a par"""
+        embeddings = np.random.rand(6, 16).astype(np.float32) * 3
+
+        similarities = adjacent_similarities(embeddings)
+
+        expected = [
+            np.dot(embeddings[i], embeddings[i + 1])
+            / (np.linalg.norm(embeddings[i]) * np.linalg.norm(embeddings[i + 1]))
+            for i in range(5)
+        ]
+        assert similarities.shape == (5,)
+        assert np.allclose(similarities, expected, atol=1e-6)
+        assert adjacent_similarities(embeddings[:1]).shape == (0,)
+
+    @patch('app.services.embedding_service.settings.CHUNK_BREAKPOINT_PERCENTILE', None)
+    def test_semantic_split_respects_threshold_and_length(self):
+        """Se corta donde la similitud baja del umbral o el chunk supera la longitud máxima"""
+        sentences = ["Uno.", "Dos.", "Tres.", "Cuatro."]
+        mock_model = MagicMock()
+        mock_model.encode.return_value = np.array([[1, 0], [1, 0.1], [0, 1], [0, 1]], dtype=np.float32)
+
+        with patch('app.services.embedding_service._split_sentences', return_value=sentences):
+            chunks, groups, _, _ = semantic_split_sentences("texto", mock_model, 0.7, 512)
+            _, short_groups, _, _ = semantic_split_sentences("texto", mock_model, 0.7, 7)
+
+        assert groups == [(0, 2), (2, 4)]
+        assert chunks == ["Uno. Dos.", "Tres. Cuatro."]
+        assert short_groups == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+    def test_semantic_split_percentile_threshold(self):
+        """Con percentil de corte solo se corta en las distancias más altas del documento"""
+        sentences = ["A.", "B.", "C.", "D.", "E."]
+        mock_model = MagicMock()
+        mock_model.encode.return_value = np.array(
+            [[1, 0], [1, 0.05], [1, 0.2], [0.1, 1], [0.2, 1]], dtype=np.float32
+        )
+
+        with patch('app.services.embedding_service._split_sentences', return_value=sentences):
+            _, groups, _, _ = semantic_split_sentences(
+                "texto", mock_model, similarity_threshold=0.99, breakpoint_percentile_threshold=80
+            )
+
+        # Con el umbral fijo de 0.99 se cortaría en casi todas las oraciones
+        assert groups == [(0, 3), (3, 5)]
+
+    def test_pooled_chunk_embeddings(self):
+        """El embedding de un chunk es la media ponderada de sus oraciones, con la escala del modelo"""
+        sentence_embeddings = np.array([[1.0, 0.0], [0.0, 1.0], [0.0, 1.0]], dtype=np.float32)
+
+        embeddings, coherence = pool_chunk_embeddings(
+            [(0, 2), (2, 3)], sentence_embeddings, np.array([10, 30, 5])
+        )
+
+        expected = np.array([0.25, 0.75]) / np.linalg.norm([0.25, 0.75])
+        assert np.allclose(embeddings[0], expected, atol=1e-6)
+        assert np.allclose(embeddings[1], [0.0, 1.0])
+        assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0)
+        assert coherence[0] < 1.0
+        assert coherence[1] == pytest.approx(1.0)
+
+        # Un subconjunto de grupos no contiguos da los mismos vectores
+        subset, _ = pool_chunk_embeddings([(2, 3)], sentence_embeddings, np.array([10, 30, 5]))
+        assert np.allclose(subset[0], embeddings[1])
+
+    @pytest.mark.parametrize("mode,expected_reencoded", [("pooled", 0), ("auto", 1), ("reencode", 2)])
+    def test_embed_chunks_modes(self, mode, expected_reencoded):
+        """Solo se recodifican los chunks que el modo exige"""
+        mock_model = MagicMock()
+        mock_model.encode.side_effect = lambda texts: np.ones((len(texts), 2), dtype=np.float32)
+        sentence_embeddings = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 0.0]], dtype=np.float32)
+
+        embeddings, reencoded = embed_chunks(
+            mock_model, ["A B", "C"], [(0, 2), (2, 3)], sentence_embeddings, ["A", "B", "C"],
+            mode=mode, min_coherence=0.9
+        )
+
+        assert reencoded == expected_reencoded
+        assert embeddings.shape == (2, 2)
+        if mode == "auto":
+            # Solo el chunk incoherente (dos oraciones ortogonales) pasa por el modelo
+            mock_model.encode.assert_called_once_with(["A B"])
+            assert np.allclose(embeddings[1], [1.0, 0.0])
\ No newline at end of file
@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.utils.embedding_batcher import EmbeddingBatcher
+
+def _encoder(calls):
+    def encode_batch(model_name, texts):
+        calls.append((model_name, list(texts)))
+        return np.array([[len(text), index] for index, text in enumerate(texts)], dtype=np.float32)
+    return encode_batch
+
+class TestEmbeddingBatcher:
+    """Tests para el agrupador de embeddings de consultas concurrentes"""
+
+    def test_concurrent_texts_share_one_batch(self):
+        """Los textos que llegan dentro de la ventana se codifican en una sola llamada"""
+        calls = []
+        batcher = EmbeddingBatcher(_encoder(calls), max_batch_size=8, max_wait_ms=200)
+
+        futures = [batcher.submit("modelo", text) for text in ["a", "bb", "ccc"]]
+        results = [future.result(timeout=5) for future in futures]
+        batcher.close()
+
+        assert calls == [("modelo", ["a", "bb", "ccc"])]
+        assert [result.tolist() for result in results] == [[1, 0], [2, 1], [3, 2]]
+        assert batcher.stats()["largest_batch"] == 3
+
+    def test_batches_are_capped_and_grouped_by_model(self):
+        """Un lote no supera max_batch_size y cada modelo se codifica por separado"""
+        calls = []
+        started, release = threading.Event(), threading.Event()
+        encode = _encoder(calls)
+
+        def blocking_encode(model_name, texts):
+            started.set()
+            release.wait(5)
+            return encode(model_name, texts)
+
+        batcher = EmbeddingBatcher(blocking_encode, max_batch_size=2, max_wait_ms=0)
+        # El primer texto ocupa al hilo; el resto se acumula mientras tanto
+        first = batcher.submit("modelo", "t0")
+        assert started.wait(5)
+        futures = [batcher.submit("modelo", "t1"), batcher.submit("otro", "t2"), batcher.submit("modelo", "t3")]
+        release.set()
+        for future in [first] + futures:
+            future.result(timeout=5)
+        batcher.close()
+
+        assert calls == [("modelo", ["t0"]), ("modelo", ["t1"]), ("otro", ["t2"]), ("modelo", ["t3"])]
+        assert batcher.stats()["batches"] == 4
+
+    def test_duplicate_texts_are_encoded_once(self):
+        """Las preguntas repetidas dentro de un lote comparten el resultado"""
+        calls = []
+        batcher = EmbeddingBatcher(_encoder(calls), max_batch_size=8, max_wait_ms=200)
+
+        futures = [batcher.submit("modelo", "igual"), batcher.submit("modelo", "igual")]
+        results = [future.result(timeout=5) for future in futures]
+        batcher.close()
+
+        assert calls == [("modelo", ["igual"])]
+        assert results[0].tolist() == results[1].tolist()
+
+    def test_errors_reach_every_caller(self):
+        """Un fallo del modelo se propaga a todos los textos del lote"""
+        def failing(model_name, texts):
+            raise RuntimeError("sin memoria")
+
+        batcher = EmbeddingBatcher(failing, max_batch_size=8, max_wait_ms=50)
+        futures = [batcher.submit("modelo", "a"), batcher.submit("modelo", "b")]
+
+        for future in futures:
+            with pytest.raises(RuntimeError, match="sin memoria"):
+                future.result(timeout=5)
+        batcher.close()
+
+    def test_close_rejects_new_texts(self):
+        """Tras cerrar no se aceptan más textos"""
+        batcher = EmbeddingBatcher(_encoder([]))
+        batcher.submit("modelo", "a").result(timeout=5)
+        batcher.close()
+
+        with pytest.raises(RuntimeError):
+            batcher.submit("modelo", "b")
@@ -0,0 +1,62 @@
+import numpy as np
+from unittest.mock import patch
+
+from app.utils.embedding_cache import ENTRY_OVERHEAD_BYTES, EmbeddingCache
+
+class TestEmbeddingCache:
+    """Tests para la caché LRU + TTL de embeddings"""
+
+    def test_key_normalizes_whitespace(self):
+        """Textos que solo difieren en espacios comparten clave; otro modelo no"""
+        key = EmbeddingCache.make_key("modelo", "¿Qué es  un TAD?")
+
+        assert key == EmbeddingCache.make_key("modelo", "  ¿Qué es un TAD?\n")
+        assert key != EmbeddingCache.make_key("otro-modelo", "¿Qué es un TAD?")
+
+    def test_hit_and_miss_counters(self):
+        """Los aciertos y fallos se contabilizan"""
+        cache = EmbeddingCache(max_bytes=1024 * 1024, ttl_seconds=60)
+
+        assert cache.get("a") is None
+        cache.put("a", [0.1, 0.2])
+        result = cache.get("a")
+
+        assert result.dtype == np.float32
+        assert np.allclose(result, [0.1, 0.2])
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        """Al superar el límite en bytes se expulsa la entrada menos usada"""
+        entry_bytes = 4 * 4 + ENTRY_OVERHEAD_BYTES
+        cache = EmbeddingCache(max_bytes=2 * entry_bytes, ttl_seconds=60)
+
+        cache.put("a", [1, 2, 3, 4])
+        cache.put("b", [1, 2, 3, 4])
+        cache.get("a")
+        cache.put("c", [1, 2, 3, 4])
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats()["evictions"] == 1
+        assert cache.current_bytes <= cache.max_bytes
+
+    def test_entries_expire(self):
+        """Las entradas caducadas no se devuelven"""
+        cache = EmbeddingCache(max_bytes=1024, ttl_seconds=10)
+
+        with patch("app.utils.embedding_cache.time.time", return_value=1000.0):
+            cache.put("a", [1.0])
+        with patch("app.utils.embedding_cache.time.time", return_value=1011.0):
+            assert cache.get("a") is None
+
+    def test_disk_tier(self, tmp_path):
+        """Con disk_dir el embedding sobrevive a una caché nueva"""
+        EmbeddingCache(max_bytes=1024, ttl_seconds=60, disk_dir=str(tmp_path)).put("a", [0.5, 1.5])
+
+        cache = EmbeddingCache(max_bytes=1024, ttl_seconds=60, disk_dir=str(tmp_path))
+        result = cache.get("a")
+
+        assert result.tolist() == [0.5, 1.5]
+        assert cache.stats()["disk_hits"] == 1
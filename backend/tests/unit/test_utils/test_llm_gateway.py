@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from unittest.mock import patch
+
+from app.utils.llm_gateway import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LLMGateway,
+    LLMTimeoutError,
+    is_retryable_error
+)
+
+
+class ApiError(Exception):
+    """Error con código HTTP, como las excepciones de google.api_core"""
+
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def make_gateway(**kwargs):
+    options = dict(max_concurrency=4, attempt_timeout_seconds=1.0, deadline_seconds=5.0, max_attempts=3,
+                   backoff_base_seconds=0.0, backoff_max_seconds=0.0, failure_threshold=3, recovery_seconds=60)
+    options.update(kwargs)
+    return LLMGateway("prueba", **options)
+
+
+def test_is_retryable_error():
+    assert is_retryable_error(ApiError(429))
+    assert is_retryable_error(ApiError(503))
+    assert is_retryable_error(TimeoutError())
+    assert not is_retryable_error(ApiError(400))
+    assert not is_retryable_error(ValueError("respuesta bloqueada"))
+
+
+def test_call_passes_attempt_timeout():
+    gateway = make_gateway()
+    timeouts = []
+
+    assert gateway.call(lambda timeout: timeouts.append(timeout) or "ok") == "ok"
+    assert timeouts == [1.0]
+    assert gateway.stats()["succeeded"] == 1
+
+
+def test_call_retries_transient_errors():
+    gateway = make_gateway()
+    outcomes = [ApiError(429), ApiError(503), "ok"]
+
+    def fn(timeout):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert gateway.call(fn) == "ok"
+    stats = gateway.stats()
+    assert stats["retries"] == 2
+    assert stats["circuit_state"] == CircuitBreaker.CLOSED
+
+
+def test_call_does_not_retry_request_errors():
+    gateway = make_gateway()
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise ApiError(400)
+
+    with pytest.raises(ApiError):
+        gateway.call(fn)
+    assert len(calls) == 1
+    assert gateway.stats()["failed"] == 1
+
+
+def test_backoff_uses_jitter_within_cap():
+    gateway = make_gateway(backoff_base_seconds=1.0, backoff_max_seconds=3.0, max_attempts=4, deadline_seconds=100,
+                           failure_threshold=10)
+    sleeps = []
+
+    def fn(timeout):
+        raise ApiError(503)
+
+    with patch("app.utils.llm_gateway.time.sleep", side_effect=sleeps.append), \
+         patch("app.utils.llm_gateway.random.uniform", side_effect=lambda low, high: high) as uniform:
+        with pytest.raises(ApiError):
+            gateway.call(fn)
+
+    assert [call.args for call in uniform.call_args_list] == [(0, 1.0), (0, 2.0), (0, 3.0)]
+    assert sleeps == [1.0, 2.0, 3.0]
+
+
+def test_circuit_opens_and_fails_fast():
+    gateway = make_gateway(max_attempts=1, failure_threshold=2)
+    calls = []
+
+    def failing(timeout):
+        calls.append(timeout)
+        raise ApiError(503)
+
+    for _ in range(2):
+        with pytest.raises(ApiError):
+            gateway.call(failing)
+    with pytest.raises(CircuitOpenError):
+        gateway.call(failing)
+
+    assert len(calls) == 2
+    stats = gateway.stats()
+    assert stats["circuit_state"] == CircuitBreaker.OPEN
+    assert stats["rejected_open_circuit"] == 1
+    assert stats["circuit_opened"] == 1
+
+
+def test_circuit_half_open_probe_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=0.0)
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    # Solo pasa una llamada de prueba a la vez
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_circuit_half_open_probe_reopens_on_failure():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_call_limits_concurrency():
+    gateway = make_gateway(max_concurrency=2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def fn(timeout):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return "ok"
+
+    threads = [threading.Thread(target=gateway.call, args=(fn,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = gateway.stats()
+    assert peak[0] == 2
+    assert stats["max_in_flight"] == 2
+    assert stats["succeeded"] == 6
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_call_async_times_out_and_retries():
+    gateway = make_gateway(attempt_timeout_seconds=0.05, max_attempts=2)
+    attempts = []
+
+    async def fn(timeout):
+        attempts.append(timeout)
+        if len(attempts) == 1:
+            await asyncio.sleep(1)
+        return "ok"
+
+    assert await gateway.call_async(fn) == "ok"
+    stats = gateway.stats()
+    assert len(attempts) == 2
+    assert stats["timeouts"] == 1 and stats["retries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_call_async_respects_deadline_while_waiting_for_a_slot():
+    gateway = make_gateway(max_concurrency=1)
+    release = asyncio.Event()
+
+    async def slow(timeout):
+        await release.wait()
+        return "ok"
+
+    first = asyncio.create_task(gateway.call_async(slow))
+    await asyncio.sleep(0.01)
+    gateway.deadline_seconds = 0.05
+    with pytest.raises(LLMTimeoutError):
+        await gateway.call_async(slow)
+    release.set()
+    assert await first == "ok"
+    assert gateway.stats()["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_async_retries_before_first_chunk():
+    gateway = make_gateway()
+    opened = []
+
+    async def chunks():
+        for chunk in ("Hola, ", "estudiante"):
+            yield chunk
+
+    async def open_stream(timeout):
+        opened.append(timeout)
+        if len(opened) == 1:
+            raise ApiError(429)
+        return chunks()
+
+    result = [chunk async for chunk in gateway.stream_async(open_stream)]
+
+    assert result == ["Hola, ", "estudiante"]
+    stats = gateway.stats()
+    assert stats["retries"] == 1 and stats["succeeded"] == 1 and stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_async_does_not_retry_after_first_chunk():
+    gateway = make_gateway()
+    opened = []
+
+    async def chunks():
+        yield "Hola"
+        raise ApiError(503)
+
+    async def open_stream(timeout):
+        opened.append(timeout)
+        return chunks()
+
+    received = []
+    with pytest.raises(ApiError):
+        async for chunk in gateway.stream_async(open_stream):
+            received.append(chunk)
+
+    assert received == ["Hola"]
+    assert len(opened) == 1
+    assert gateway.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_async_releases_slot_when_consumer_stops():
+    gateway = make_gateway(max_concurrency=1)
+
+    async def chunks():
+        for chunk in ("a", "b", "c"):
+            yield chunk
+
+    async def open_stream(timeout):
+        return chunks()
+
+    stream = gateway.stream_async(open_stream)
+    assert await stream.__anext__() == "a"
+    await stream.aclose()
+
+    stats = gateway.stats()
+    assert stats["in_flight"] == 0 and stats["cancelled"] == 1
+    assert [chunk async for chunk in gateway.stream_async(open_stream)] == ["a", "b", "c"]
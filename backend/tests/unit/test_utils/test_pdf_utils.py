@@ -0,0 +1,76 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+from app.utils.pdf_utils import iter_pdf_pages
+
+def _mock_pages(texts):
+    pages = []
+    for text in texts:
+        page = MagicMock()
+        page.extract_text.return_value = text
+        pages.append(page)
+    return pages
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "documento.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    return str(path)
+
+class FakeExecutor:
+    """Ejecuta las tareas al enviarlas y registra cuántas hay pendientes de recoger a la vez"""
+
+    def __init__(self, *args, **kwargs):
+        self.pending = 0
+        self.max_pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, func, *args):
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        future = MagicMock()
+
+        def result():
+            self.pending -= 1
+            return func(*args)
+
+        future.result.side_effect = result
+        return future
+
+class TestIterPdfPages:
+    """Tests para la extracción de PDFs página a página"""
+
+    @patch('app.utils.pdf_utils.settings.PDF_PARALLEL_MIN_PAGES', 50)
+    def test_small_pdf_is_read_lazily_with_page_numbers(self, pdf_path):
+        """Los PDFs pequeños se leen en el proceso, página a página y sin páginas vacías"""
+        pages = _mock_pages(["  Intro ", "", "Tema 1"])
+        with patch('app.utils.pdf_utils.pypdf.PdfReader') as mock_reader, \
+             patch('app.utils.pdf_utils.ProcessPoolExecutor') as mock_executor:
+            mock_reader.return_value.pages = pages
+            iterator = iter_pdf_pages(pdf_path)
+
+            assert next(iterator) == (1, "Intro")
+            pages[2].extract_text.assert_not_called()
+            assert list(iterator) == [(3, "Tema 1")]
+
+        mock_executor.assert_not_called()
+        for page in pages:
+            page.extract_text.assert_called_once()
+
+    @patch('app.utils.pdf_utils.settings.PDF_PARALLEL_MIN_PAGES', 4)
+    @patch('app.utils.pdf_utils.settings.PDF_PAGES_PER_TASK', 2)
+    def test_large_pdf_is_split_in_bounded_batches(self, pdf_path):
+        """Los PDFs grandes se reparten por lotes, en orden y con pocos lotes en vuelo"""
+        executor = FakeExecutor()
+        with patch('app.utils.pdf_utils.pypdf.PdfReader') as mock_reader, \
+             patch('app.utils.pdf_utils.ProcessPoolExecutor', return_value=executor):
+            mock_reader.return_value.pages = _mock_pages([f"Página {i}" for i in range(1, 11)])
+            result = list(iter_pdf_pages(pdf_path, workers=2))
+
+        assert result == [(i, f"Página {i}") for i in range(1, 11)]
+        assert executor.max_pending <= 4
@@ -0,0 +1,154 @@
+import logging
+import sys
+
+import pytest
+from unittest.mock import patch
+
+from app.utils import prompt_budget
+from app.utils.prompt_budget import (
+    SUMMARY_HEADER,
+    count_tokens,
+    fit_context,
+    fit_history,
+    fit_prompt_sections,
+    load_prompt_tokenizer,
+    split_context_chunks,
+    split_history_turns,
+    truncate_to_tokens
+)
+
+
+# Sin el parche del fixture, para probar la carga real
+_load_tokenizer = prompt_budget._get_tokenizer
+
+
+class WordTokenizer:
+    """Tokenizador de prueba: un token por palabra"""
+
+    def encode(self, text, add_special_tokens=False):
+        self.words = text.split()
+        return list(range(len(self.words)))
+
+    def decode(self, ids):
+        return " ".join(self.words[i] for i in ids)
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer():
+    with patch.object(prompt_budget, "_get_tokenizer", return_value=WordTokenizer()):
+        yield
+
+
+def chunk(title, words):
+    return f"[Del documento '{title}']: " + " ".join(["palabra"] * words)
+
+
+def test_count_tokens_uses_tokenizer():
+    assert count_tokens("uno dos tres") == 3
+    assert count_tokens("") == 0
+
+
+def test_count_tokens_estimates_without_tokenizer():
+    with patch.object(prompt_budget, "_get_tokenizer", return_value=None), \
+         patch.object(prompt_budget.settings, "PROMPT_CHARS_PER_TOKEN", 4.0):
+        assert count_tokens("a" * 40) == 10
+
+
+def test_tokenizer_load_failure_is_reported(caplog):
+    with patch.object(prompt_budget, "_get_tokenizer", _load_tokenizer), \
+         patch.object(prompt_budget, "_tokenizer", None), \
+         patch.object(prompt_budget, "_tokenizer_unavailable", False), \
+         patch.dict(sys.modules, {"transformers": None}), \
+         caplog.at_level(logging.ERROR, logger=prompt_budget.__name__):
+        assert load_prompt_tokenizer() is False
+
+    assert "ESTIMACIÓN" in caplog.text
+
+
+def test_truncate_to_tokens():
+    assert truncate_to_tokens("uno dos tres", 5) == "uno dos tres"
+    assert truncate_to_tokens("uno dos tres cuatro", 3) == "uno dos…"
+
+
+def test_split_context_chunks_keeps_inner_blank_lines():
+    context = "[Del documento 'A']: uno\n\ndos\n\n[Del documento 'B', pág. 2]: tres"
+    assert split_context_chunks(context) == ["[Del documento 'A']: uno\n\ndos", "[Del documento 'B', pág. 2]: tres"]
+
+
+def test_split_history_turns_keeps_multiline_messages():
+    history = "Usuario: hola\nBot: línea uno\nlínea dos\nUsuario: adiós"
+    assert split_history_turns(history) == ["Usuario: hola", "Bot: línea uno\nlínea dos", "Usuario: adiós"]
+
+
+def test_fit_context_drops_lowest_scoring_chunks():
+    context = "\n\n".join([chunk("A", 10), chunk("B", 10), chunk("C", 10)])
+
+    fitted, tokens, kept, dropped = fit_context(context, 30)
+
+    # Cada chunk ocupa 13 tokens (cabecera + 10 palabras); caben los dos primeros
+    assert (kept, dropped) == (2, 1)
+    assert "'A'" in fitted and "'B'" in fitted and "'C'" not in fitted
+    assert tokens <= 30
+
+
+def test_fit_context_truncates_single_oversized_chunk():
+    fitted, tokens, kept, dropped = fit_context(chunk("A", 50), 10)
+
+    assert (kept, dropped) == (1, 0)
+    assert tokens <= 10
+    assert fitted.endswith("…")
+
+
+def test_fit_history_keeps_everything_within_budget():
+    history = "Usuario: hola\nBot: hola qué tal\nUsuario: bien"
+
+    fitted, tokens, summarized, dropped = fit_history(history, 100, 4)
+
+    assert fitted == history
+    assert (summarized, dropped) == (0, 0)
+
+
+def test_fit_history_summarizes_older_turns_first():
+    old_turns = [f"Bot: Respuesta {i} corta. " + "detalle " * 30 for i in range(3)]
+    history = "\n".join(old_turns + ["Usuario: pregunta reciente", "Usuario: pregunta actual"])
+
+    fitted, tokens, summarized, dropped = fit_history(history, 60, 2)
+
+    lines = fitted.split("\n")
+    assert lines[0] == SUMMARY_HEADER
+    assert lines[-2:] == ["Usuario: pregunta reciente", "Usuario: pregunta actual"]
+    assert "- Bot: Respuesta 2 corta." in lines
+    assert (summarized, dropped) == (3, 0)
+    assert "detalle" not in fitted
+
+
+def test_fit_history_drops_oldest_summaries_when_needed():
+    history = "\n".join([f"Usuario: mensaje número {i} largo" for i in range(6)])
+
+    fitted, tokens, summarized, dropped = fit_history(history, 14, 1)
+
+    assert fitted.endswith("Usuario: mensaje número 5 largo")
+    assert dropped > 0
+    assert summarized + dropped == 5
+    assert tokens <= 14
+
+
+def test_fit_prompt_sections_gives_history_priority_within_its_budget():
+    context = "\n\n".join([chunk(str(i), 20) for i in range(5)])
+    history = "Usuario: hola\nBot: hola"
+
+    fitted = fit_prompt_sections(fixed_tokens=40, context=context, conversation_history=history,
+                                 budget=100, history_budget=20, recent_turns=4)
+
+    assert fitted.conversation_history == history
+    # Quedan 100 - 40 - 4 tokens para el material: caben dos chunks de 23
+    assert (fitted.chunks_kept, fitted.chunks_dropped) == (2, 3)
+    assert fitted.history_tokens + fitted.context_tokens <= 60
+
+
+def test_fit_prompt_sections_without_room_drops_everything():
+    fitted = fit_prompt_sections(fixed_tokens=200, context=chunk("A", 5), conversation_history="Usuario: hola",
+                                 budget=100, history_budget=20, recent_turns=4)
+
+    assert fitted.context == "" and fitted.conversation_history == ""
+    assert (fitted.chunks_dropped, fitted.turns_dropped) == (1, 1)
@@ -0,0 +1,65 @@
+import pytest
+
+from app.utils.prompt_templates import (
+    CHAT_TEMPLATE,
+    IMAGE_DESCRIPTION_TEMPLATE,
+    IMAGE_QUESTION_TEMPLATE,
+    PROMPT_TEMPLATES,
+    PromptTemplate,
+    format_subject_info,
+    select_template
+)
+
+
+def test_static_prefix_is_dedented_and_has_no_slots():
+    for template in PROMPT_TEMPLATES.values():
+        assert template.static_prefix.startswith("### Instrucciones:")
+        assert "{" not in template.static_prefix
+        assert not any(line.startswith(" ") for line in template.static_prefix.splitlines())
+
+
+def test_render_is_static_prefix_plus_dynamic_part():
+    values = {"context": "material", "conversation_history": "Usuario: hola", "user_question": "¿Qué es?"}
+
+    prompt = CHAT_TEMPLATE.render(**values)
+
+    assert prompt == f"{CHAT_TEMPLATE.static_prefix}\n\n{CHAT_TEMPLATE.render_dynamic(**values)}"
+    assert "### Material de la Asignatura:\nmaterial" in prompt
+    assert "### Solicitud del Estudiante:\n¿Qué es?" in prompt
+
+
+def test_render_inserts_values_literally_and_leaves_missing_slots_empty():
+    template = PromptTemplate("prueba", "Fijo", "A: {a}\nB: {b}")
+
+    assert template.slots == ("a", "b")
+    assert template.render_dynamic(a="def f(): return {'x': 1}") == "A: def f(): return {'x': 1}\nB: "
+
+
+def test_render_rejects_unknown_slots():
+    with pytest.raises(KeyError):
+        CHAT_TEMPLATE.render(contexto="material")
+
+
+def test_select_template():
+    assert select_template(False, "¿Qué es?") is CHAT_TEMPLATE
+    assert select_template(True, "¿Qué es?") is IMAGE_QUESTION_TEMPLATE
+    assert select_template(True, "  ") is IMAGE_DESCRIPTION_TEMPLATE
+
+
+def test_image_question_goes_in_dynamic_part():
+    prompt = IMAGE_QUESTION_TEMPLATE.render(context="material", user_question="¿Qué muestra?")
+
+    assert "¿Qué muestra?" not in IMAGE_QUESTION_TEMPLATE.static_prefix
+    assert "### Pregunta del Estudiante:\n¿Qué muestra?" in prompt
+
+
+def test_format_subject_info():
+    assert format_subject_info(None) == ""
+    text = format_subject_info({"name": "Álgebra", "code": "ALG", "description": "Lineal", "summary": "Matrices"})
+    assert text.splitlines() == [
+        "**Información de la Asignatura:**",
+        "- Nombre: Álgebra",
+        "- Código: ALG",
+        "- Descripción: Lineal",
+        "- Resumen de la asignatura: Matrices"
+    ]